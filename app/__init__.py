@@ -1,54 +1,136 @@
-from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
-from flask import Flask
+from flask import Flask, Request, current_app
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
 from dotenv import load_dotenv
 import os
 import logging
+import tempfile
+import click
 from logging.handlers import RotatingFileHandler
-from authlib.integrations.flask_client import OAuth
 
 load_dotenv()
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', '5791677770b13ce0c676dfde280ba245')
-app.config['SESSION_TYPE'] = 'filesystem'
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('SQLALCHEMY_DATABASE_URI', 'sqlite:///site.db')
-app.config['MECHANIC_REGISTER_TOKEN'] = os.getenv('MECHANIC_REGISTER_TOKEN', 'mypasswordisyours')
-app.config['GOOGLE_CLIENT_ID'] = os.getenv('GOOGLE_CLIENT_ID')
-app.config['GOOGLE_CLIENT_SECRET'] = os.getenv('GOOGLE_CLIENT_SECRET')
-app.config['GOOGLE_DISCOVERY_URL'] = "https://accounts.google.com/.well-known/openid-configuration"
-
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
-bcrypt = Bcrypt(app)
-login_manager = LoginManager(app)
-login_manager.login_view = 'login'
+
+class LimitedRequest(Request):
+    # A view can lower the request body limit with @body_limit(config key).
+    # Werkzeug enforces it on the form parser and the input stream, so it
+    # also holds for chunked uploads that have no Content-Length.
+    @property
+    def max_content_length(self):
+        view = current_app.view_functions.get(self.endpoint) if current_app else None
+        key = getattr(view, 'body_limit', None)
+        return current_app.config[key] if key else super().max_content_length
+
+
+def body_limit(config_key):
+    # Apply below @bp.route and other decorators, see LimitedRequest
+    def decorator(view):
+        view.body_limit = config_key
+        return view
+    return decorator
+
+
+db = SQLAlchemy()
+bcrypt = Bcrypt()
+login_manager = LoginManager()
+login_manager.login_view = 'admin.login'
 login_manager.login_message_category = 'info'
 
-oauth = OAuth(app)
-google = oauth.register(
-    name='google',
-    client_id=app.config['GOOGLE_CLIENT_ID'],
-    client_secret=app.config['GOOGLE_CLIENT_SECRET'],
-    server_metadata_url=app.config['GOOGLE_DISCOVERY_URL'],
-    client_kwargs={
-        'scope': 'openid email profile',
-    }
-)
-# keep this import here to prevent cercular import
-from app.routes import admin, public, mechanic
-
-
-
-if not app.debug:
-    if not os.path.exists('logs'):
-        os.mkdir('logs')
-    file_handler = RotatingFileHandler('logs/app.log', maxBytes=10240, backupCount=10)
-    file_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'))
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-
-    app.logger.setLevel(logging.INFO)
-    app.logger.info('App startup')
+
+def _configure(app):
+    # Settings from the environment (and .env); create_app(config) overrides them
+    app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', '5791677770b13ce0c676dfde280ba245')
+    app.config['SESSION_TYPE'] = 'filesystem'
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('SQLALCHEMY_DATABASE_URI', 'sqlite:///site.db')
+    app.config['MECHANIC_REGISTER_TOKEN'] = os.getenv('MECHANIC_REGISTER_TOKEN', 'mypasswordisyours')
+    app.config['GOOGLE_CLIENT_ID'] = os.getenv('GOOGLE_CLIENT_ID')
+    app.config['GOOGLE_CLIENT_SECRET'] = os.getenv('GOOGLE_CLIENT_SECRET')
+    app.config['GOOGLE_DISCOVERY_URL'] = "https://accounts.google.com/.well-known/openid-configuration"
+    app.config['MECHANIC_DIRECTORY_TTL'] = int(os.getenv('MECHANIC_DIRECTORY_TTL', 300))
+    app.config['USER_CACHE_SIZE'] = int(os.getenv('USER_CACHE_SIZE', 1024))
+    app.config['USER_CACHE_TTL'] = int(os.getenv('USER_CACHE_TTL', 60))
+    app.config['COUNT_CACHE_TTL'] = int(os.getenv('COUNT_CACHE_TTL', 300))
+    app.config['SQL_QUERY_BUDGET'] = int(os.getenv('SQL_QUERY_BUDGET', 30))
+    app.config['SQL_REPEAT_THRESHOLD'] = int(os.getenv('SQL_REPEAT_THRESHOLD', 3))
+    app.config['SQL_STRICT'] = bool(int(os.getenv('SQL_STRICT', 0)))
+    app.config['METRICS_DIR'] = os.getenv('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'garage-metrics'))
+    app.config['METRICS_FLUSH_INTERVAL'] = int(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+    app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')
+    app.config['FRAGMENT_CACHE_SIZE'] = int(os.getenv('FRAGMENT_CACHE_SIZE', 512))
+    app.config['FRAGMENT_CACHE_TTL'] = int(os.getenv('FRAGMENT_CACHE_TTL', 300))
+    app.config['IMAGE_WORKERS'] = int(os.getenv('IMAGE_WORKERS', 2))
+    app.config['IMAGE_QUEUE_SIZE'] = int(os.getenv('IMAGE_QUEUE_SIZE', 32))
+    app.config['IMAGE_GC_GRACE'] = int(os.getenv('IMAGE_GC_GRACE', 3600))
+    app.config['IMAGE_CACHE_DIR'] = os.getenv('IMAGE_CACHE_DIR', os.path.join(app.instance_path, 'image_cache'))
+    app.config['IMAGE_CACHE_BYTES'] = int(os.getenv('IMAGE_CACHE_BYTES', 256 * 1024 * 1024))
+    app.config['SPEECH_BACKEND'] = os.getenv('SPEECH_BACKEND', 'google')
+    app.config['SPEECH_LANGUAGE'] = os.getenv('SPEECH_LANGUAGE', 'bg-BG')
+    app.config['SPEECH_CLIENT_POOL_SIZE'] = int(os.getenv('SPEECH_CLIENT_POOL_SIZE', 4))
+    app.config['SPEECH_MAX_UPLOAD_BYTES'] = int(os.getenv('SPEECH_MAX_UPLOAD_BYTES', 50 * 1024 * 1024))
+    app.config['SPEECH_UPLOAD_CHUNK_BYTES'] = int(os.getenv('SPEECH_UPLOAD_CHUNK_BYTES', 1024 * 1024))
+    app.config['SPEECH_UPLOAD_TTL'] = int(os.getenv('SPEECH_UPLOAD_TTL', 3600))
+    app.config['SPEECH_WORKERS'] = int(os.getenv('SPEECH_WORKERS', 4))
+    app.config['SPEECH_QUEUE_SIZE'] = int(os.getenv('SPEECH_QUEUE_SIZE', 32))
+    app.config['SPEECH_JOB_TIMEOUT'] = int(os.getenv('SPEECH_JOB_TIMEOUT', 600))
+    app.config['SPEECH_STREAM_WINDOW'] = int(os.getenv('SPEECH_STREAM_WINDOW', 25))
+    app.config['SPEECH_RESULT_TTL'] = int(os.getenv('SPEECH_RESULT_TTL', 7 * 24 * 3600))
+
+
+class MigrateGroup(click.Group):
+    # 'flask db': Flask-Migrate pulls in alembic, which is slower to import
+    # than the rest of the app together, so it is set up only when a
+    # migration command actually runs
+    def __init__(self, app, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.app = app
+
+    def _commands(self):
+        from flask_migrate import Migrate
+        if 'migrate' not in self.app.extensions:
+            Migrate(self.app, db)
+        return self.app.cli.commands['db']
+
+    def list_commands(self, ctx):
+        return self._commands().list_commands(ctx)
+
+    def get_command(self, ctx, name):
+        return self._commands().get_command(ctx, name)
+
+
+def create_app(config=None):
+    # Every call builds a new application: settings are read from the
+    # environment here, config overrides them, and the modules with hooks,
+    # commands or caches attach through their init_app(app). Caches and
+    # worker pools are per process and take their sizes from the last
+    # application created.
+    app = Flask(__name__)
+    app.request_class = LimitedRequest
+    _configure(app)
+    app.config.update(config or {})
+
+    db.init_app(app)
+    bcrypt.init_app(app)
+    login_manager.init_app(app)
+    app.cli.add_command(MigrateGroup(app, 'db', help='Perform database migrations.'))
+
+    from app.routes import admin, public, mechanic
+    from app import models, directory, pagination, images, fragments, queryplans, instrumentation, metrics
+    for module in (models, directory, pagination, images, fragments, queryplans, instrumentation, metrics):
+        module.init_app(app)
+    app.register_blueprint(public.bp)
+    app.register_blueprint(mechanic.bp)
+    app.register_blueprint(admin.bp)
+
+    if not app.debug and not app.testing and not any(
+            isinstance(handler, RotatingFileHandler) for handler in app.logger.handlers):
+        if not os.path.exists('logs'):
+            os.mkdir('logs')
+        file_handler = RotatingFileHandler('logs/app.log', maxBytes=10240, backupCount=10)
+        file_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'))
+        file_handler.setLevel(logging.INFO)
+        app.logger.addHandler(file_handler)
+
+        app.logger.setLevel(logging.INFO)
+        app.logger.info('App startup')
+    return app
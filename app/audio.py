@@ -0,0 +1,142 @@
+# audio.py
+# Dictation audio handling. Recordings are uploaded in chunks into a
+# per-user file under instance/audio_uploads, so an interrupted upload
+# can resume from the last received byte and nothing is held in memory.
+# Recognition reads the WAV back in 100 ms frames, downmixed to mono and
+# resampled to the rate the recognizer wants, one frame at a time.
+
+import fcntl
+import os
+import secrets
+import time
+import wave
+from flask import current_app
+
+COPY_BUFFER = 64 * 1024
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400, received=None):
+        super().__init__(message)
+        self.status = status
+        self.received = received
+
+
+def uploads_dir():
+    path = os.path.join(current_app.instance_path, 'audio_uploads')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def upload_path(user_id, upload_id):
+    # The owner is part of the file name, so ids cannot be used across users
+    if not upload_id.replace('-', '').replace('_', '').isalnum():
+        raise UploadError("Unknown upload", 404)
+    return os.path.join(uploads_dir(), f'{user_id}-{upload_id}.part')
+
+
+def _remove_stale_uploads():
+    cutoff = time.time() - current_app.config['SPEECH_UPLOAD_TTL']
+    for entry in os.scandir(uploads_dir()):
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def create_upload(user_id):
+    _remove_stale_uploads()
+    upload_id = secrets.token_urlsafe(16)
+    open(upload_path(user_id, upload_id), 'xb').close()
+    return upload_id
+
+
+def received_bytes(user_id, upload_id):
+    try:
+        return os.path.getsize(upload_path(user_id, upload_id))
+    except OSError:
+        raise UploadError("Unknown upload", 404)
+
+
+def append_chunk(user_id, upload_id, offset, stream, length):
+    # Appends one chunk at offset; a chunk for any other position is
+    # rejected with the current size so the client can resume from there.
+    # The part file stays locked from the offset check to the write, so a
+    # retried chunk racing the original cannot both be appended.
+    try:
+        part = open(upload_path(user_id, upload_id), 'r+b')
+    except FileNotFoundError:
+        raise UploadError("Unknown upload", 404)
+    with part:
+        fcntl.flock(part, fcntl.LOCK_EX)
+        received = os.fstat(part.fileno()).st_size
+        if offset != received:
+            raise UploadError("Unexpected offset", 409, received)
+        if length is None:
+            raise UploadError("Content-Length required", 411, received)
+        if length > current_app.config['SPEECH_UPLOAD_CHUNK_BYTES']:
+            raise UploadError("Chunk too large", 413, received)
+        if received + length > current_app.config['SPEECH_MAX_UPLOAD_BYTES']:
+            raise UploadError("Recording too long", 413, received)
+
+        part.seek(received)
+        remaining = length
+        while remaining:
+            data = stream.read(min(COPY_BUFFER, remaining))
+            if not data:
+                break
+            part.write(data)
+            remaining -= len(data)
+        if remaining:
+            # Connection dropped mid-chunk: keep only whole chunks
+            part.truncate(received)
+            raise UploadError("Incomplete chunk", 400, received)
+    return received + length
+
+
+def open_wav(source):
+    # source is a path or a binary file object
+    try:
+        audio = wave.open(source, 'rb')
+    except (wave.Error, EOFError):
+        raise UploadError("Audio must be a 16-bit PCM WAV file")
+    if audio.getsampwidth() != 2 or audio.getnchannels() not in (1, 2):
+        audio.close()
+        raise UploadError("Audio must be a 16-bit PCM WAV file")
+    return audio
+
+
+def wav_chunks(wav, seconds=0.1):
+    # Reads an open wave file in pieces; 100 ms is what streaming
+    # recognition expects per request
+    frames = max(int(wav.getframerate() * seconds), 1)
+    while True:
+        chunk = wav.readframes(frames)
+        if not chunk:
+            break
+        yield chunk
+
+
+def convert(chunks, sample_rate, channels, target_rate):
+    # Streaming stereo -> mono downmix and resampling of 16-bit PCM, by
+    # linear interpolation. The last sample and the position of the next
+    # output sample carry over from chunk to chunk, so chunked and whole
+    # input give the same result.
+    import numpy as np
+
+    step = sample_rate / target_rate
+    previous, position = None, 0.0
+    for chunk in chunks:
+        samples = np.frombuffer(chunk, dtype='<i2').astype(np.float64)
+        if channels == 2:
+            samples = samples.reshape(-1, 2).mean(axis=1)
+        if sample_rate != target_rate and len(samples):
+            if previous is not None:
+                samples = np.concatenate(([previous], samples))
+            positions = np.arange(position, len(samples) - 1, step)
+            next_position = positions[-1] + step if len(positions) else position
+            position = next_position - (len(samples) - 1)
+            previous = samples[-1]
+            samples = np.interp(positions, np.arange(len(samples)), samples)
+        yield np.clip(np.round(samples), -32768, 32767).astype('<i2').tobytes()
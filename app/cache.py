@@ -0,0 +1,218 @@
+# cache.py
+# Process-local caches and commit-driven invalidation.
+# Every flush records which model classes were touched; once the
+# transaction commits, callbacks registered with on_commit_of() run.
+# Rolled back transactions never invalidate anything.
+
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+_commit_listeners = []
+
+
+def on_commit_of(*models):
+    def decorator(func):
+        _commit_listeners.append((models, func))
+        return func
+    return decorator
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_models(session, flush_context):
+    changed = session.info.setdefault('changed_models', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        changed.add(type(obj))
+
+
+@event.listens_for(Session, 'after_commit')
+def _dispatch_changed_models(session):
+    changed = session.info.pop('changed_models', None)
+    if not changed:
+        return
+    for models, func in _commit_listeners:
+        if any(issubclass(model, models) for model in changed):
+            func(changed)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changed_models(session):
+    session.info.pop('changed_models', None)
+
+
+class CachedValue:
+    # A single lazily loaded value. ttl bounds staleness across worker
+    # processes, which never see each other's commits.
+    _missing = object()
+
+    def __init__(self, loader, ttl=None):
+        self.loader = loader
+        self.ttl = ttl
+        self._value = self._missing
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+
+    def _fresh(self):
+        if self._value is self._missing:
+            return False
+        return self.ttl is None or time.monotonic() - self._loaded_at < self.ttl
+
+    def get(self):
+        if self._fresh():
+            return self._value
+        with self._lock:
+            if not self._fresh():
+                self._value = self.loader()
+                self._loaded_at = time.monotonic()
+            return self._value
+
+    def invalidate(self, *args):
+        self._value = self._missing
+
+
+class LRUCache:
+    # Bounded mapping; least recently used keys are evicted first and
+    # entries older than ttl seconds are treated as missing.
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, stored_at = item
+            if self.ttl is not None and time.monotonic() - stored_at >= self.ttl:
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DiskCache:
+    # Size-bounded directory of generated files shared by all worker
+    # processes. Recency is the file mtime (refreshed on hits). Each
+    # process adds up the directory again once it has written
+    # CHECK_FRACTION of max_bytes since the last count (or its estimate goes
+    # over), and removes the least recently used files down to 90% of the
+    # limit when the real total is over it; between counts the directory
+    # can exceed max_bytes by about CHECK_FRACTION per writing process.
+    # Files being written are *.tmp and never evicted; one older than
+    # TMP_GRACE was left by a writer that died, and goes at the next count.
+    TOUCH_INTERVAL = 60
+    CHECK_FRACTION = 0.05
+    TMP_GRACE = 3600
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = None
+        self._written = 0
+        self._lock = threading.Lock()
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.TOUCH_INTERVAL:
+                os.utime(path)
+        except OSError:
+            # Missing, or evicted by another process just now
+            return None
+        return path
+
+    def put(self, key, write):
+        # write(path) produces the file; it is moved into place atomically.
+        # The temporary name is unique, so threads and processes rendering
+        # the same key do not write into each other's file.
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=f'{key}.', suffix='.tmp')
+        os.close(fd)
+        try:
+            write(tmp_path)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        with self._lock:
+            self._written += size
+            if (self._size is None or self._size + self._written > self.max_bytes
+                    or self._written >= self.max_bytes * self.CHECK_FRACTION):
+                self._size = self._total()
+                self._written = 0
+                if self._size > self.max_bytes:
+                    self._size = self._evict(int(self.max_bytes * 0.9))
+        return path
+
+    def discard(self, prefix):
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name.startswith(prefix):
+                try:
+                    os.remove(self.path(name))
+                except OSError:
+                    pass
+
+    def _entries(self):
+        entries = []
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            try:
+                stat = entry.stat()
+                if entry.name.endswith('.tmp'):
+                    if now - stat.st_mtime > self.TMP_GRACE:
+                        os.remove(entry.path)
+                    continue
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _total(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self, target):
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        return total
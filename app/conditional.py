@@ -0,0 +1,158 @@
+# conditional.py
+# Conditional GET for the read-heavy public pages. Every flush that adds,
+# changes or deletes a post, comment, user or repair shop image bumps a
+# counter row for each scope it touches ('post', 'post:3', 'user:7', ...).
+# Row scopes are bumped in the same transaction. The table-wide scopes
+# ('post', 'comment', 'user') are shared by every writer, so they are
+# bumped right after the commit in a short transaction of their own;
+# holding those rows locked until the writer commits would serialize all
+# writes. Until that bump lands, a page revalidated against the old
+# counter may still get a 304.
+#
+# A view decorated with @conditional(...) derives its ETag and
+# Last-Modified from those counters with one primary-key lookup, and
+# answers a matching If-None-Match / If-Modified-Since with 304 before
+# running its own queries or rendering anything.
+
+import hashlib
+import os
+import time
+from datetime import datetime, timezone
+from functools import wraps
+from flask import request, session, make_response, current_app
+from flask_login import current_user
+from sqlalchemy import event, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from app import db
+from app.models import ChangeCounter, Post, Comment, User, Role, RepairShopImage
+
+_counters = ChangeCounter.__table__
+_build = None
+
+
+def _scopes_of(obj):
+    if isinstance(obj, Post):
+        return ('post', f'post:{obj.id}')
+    if isinstance(obj, Comment):
+        return ('comment', f'post:{obj.post_id}')
+    if isinstance(obj, User):
+        # Names and pictures appear next to every post and comment
+        return ('user', f'user:{obj.id}')
+    if isinstance(obj, Role):
+        return ('user',)
+    if isinstance(obj, RepairShopImage):
+        return (f'user:{obj.user_id}',)
+    return ()
+
+
+def _bump(connection, names):
+    now = datetime.utcnow()
+    upsert = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}.get(connection.dialect.name)
+    # Sorted, so concurrent transactions lock rows in the same order
+    for name in sorted(names):
+        if upsert is not None:
+            connection.execute(upsert(_counters).values(name=name, version=1, updated=now).on_conflict_do_update(
+                index_elements=[_counters.c.name],
+                set_={'version': _counters.c.version + 1, 'updated': now}))
+            continue
+        result = connection.execute(_counters.update().where(_counters.c.name == name).values(
+            version=_counters.c.version + 1, updated=now))
+        if not result.rowcount:
+            connection.execute(_counters.insert().values(name=name, version=1, updated=now))
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_change_counters(session, flush_context):
+    names = set()
+    for obj in session.new:
+        names.update(_scopes_of(obj))
+    for obj in session.deleted:
+        names.update(_scopes_of(obj))
+    for obj in session.dirty:
+        if session.is_modified(obj):
+            names.update(_scopes_of(obj))
+    rows = {name for name in names if ':' in name}
+    session.info.setdefault('changed_tables', set()).update(names - rows)
+    if rows:
+        _bump(session.connection(), rows)
+
+
+@event.listens_for(Session, 'after_commit')
+def _bump_table_counters(session):
+    names = session.info.pop('changed_tables', None)
+    if not names:
+        return
+    try:
+        with session.get_bind().begin() as connection:
+            _bump(connection, names)
+    except Exception as e:
+        current_app.logger.error(f'Could not bump change counters {sorted(names)}: {e}')
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_table_counters(session):
+    session.info.pop('changed_tables', None)
+
+
+def _build_id():
+    # Changes with every deploy of new templates, so cached pages rendered
+    # by older markup are not revalidated as fresh
+    global _build
+    if _build is None:
+        stamps = []
+        for directory, _, files in os.walk(os.path.join(current_app.root_path, 'templates')):
+            stamps.extend(f'{os.path.join(directory, name)}:{os.path.getmtime(os.path.join(directory, name))}'
+                          for name in files)
+        _build = hashlib.sha1('\n'.join(sorted(stamps)).encode()).hexdigest()[:8]
+    return _build
+
+
+def _validators(names):
+    rows = db.session.execute(select(_counters.c.name, _counters.c.version, _counters.c.updated)
+                              .where(_counters.c.name.in_(names))).all()
+    versions = {name: (version, updated) for name, version, updated in rows}
+    viewer = f'{current_user.id}:{current_user.version}' if current_user.is_authenticated else ''
+    # Pages embed CSRF tokens; start a new ETag well before they expire
+    csrf_epoch = int(time.time() // max((current_app.config.get('WTF_CSRF_TIME_LIMIT') or 3600) // 2, 1))
+    parts = [request.endpoint, request.full_path, viewer, str(csrf_epoch), _build_id()]
+    parts.extend(f'{name}={versions.get(name, (0, None))[0]}' for name in names)
+    etag = hashlib.sha1('\n'.join(parts).encode()).hexdigest()[:20]
+    updated = [updated for _, updated in versions.values()]
+    last_modified = max(updated).replace(microsecond=0, tzinfo=timezone.utc) if updated else None
+    return etag, last_modified
+
+
+def _revalidate(response, etag, last_modified):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
+
+
+def conditional(*scopes):
+    # scopes are counter names, formatted with the view arguments,
+    # e.g. @conditional('user', 'post:{post_id}')
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            # Pages carrying a flashed message are one-off
+            if request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+                return view(**kwargs)
+            etag, last_modified = _validators([scope.format(**kwargs) for scope in scopes])
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains(etag)
+            else:
+                not_modified = (last_modified is not None and request.if_modified_since is not None
+                                and last_modified <= request.if_modified_since)
+            if not_modified:
+                return _revalidate(make_response('', 304), etag, last_modified)
+            response = make_response(view(**kwargs))
+            if response.status_code == 200:
+                _revalidate(response, etag, last_modified)
+            return response
+        return wrapper
+    return decorator
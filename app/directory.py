@@ -0,0 +1,39 @@
+# directory.py
+# Cached list of mechanics shown in the sidebar and on the home page.
+
+from collections import namedtuple
+from app import db
+from app.cache import CachedValue, on_commit_of
+from app.models import User, Role, user_ids_with_role
+
+MechanicEntry = namedtuple('MechanicEntry', 'id username image_file expertise')
+
+
+def _load_mechanics():
+    rows = db.session.query(
+        User.id, User.username, User.image_file, User.expertise
+    ).filter(User.id.in_(user_ids_with_role('mechanic'))).order_by(User.id).all()
+    return tuple(MechanicEntry(*row) for row in rows)
+
+
+mechanic_directory = CachedValue(_load_mechanics)
+
+# Role membership changes show up as a dirty User (or Role) in the flush
+on_commit_of(User, Role)(mechanic_directory.invalidate)
+
+
+def init_app(app):
+    mechanic_directory.ttl = app.config['MECHANIC_DIRECTORY_TTL']
+
+
+class LazyMechanics:
+    # Handed to every template; only hits the cache when a template
+    # actually iterates or tests `mechanics`.
+    def __iter__(self):
+        return iter(mechanic_directory.get())
+
+    def __len__(self):
+        return len(mechanic_directory.get())
+
+    def __bool__(self):
+        return bool(mechanic_directory.get())
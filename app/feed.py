@@ -0,0 +1,66 @@
+# feed.py
+# Loads posts for the public feed pages in a fixed number of queries:
+# posts + authors, top-N comments (with per-post totals) + authors, and
+# role names for every author - no matter how many posts are on the page.
+
+from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+from app import db
+from app.models import Post, Comment, preload_role_names
+from app.pagination import keyset_page
+
+COMMENTS_PER_POST = 2
+
+
+def _posts_query():
+    return Post.query.options(joinedload(Post.author))
+
+
+def attach_top_comments(posts, per_post=COMMENTS_PER_POST):
+    # Sets post.top_comments (oldest first) and post.comment_count on every post
+    by_id = {post.id: post for post in posts}
+    for post in posts:
+        post.top_comments = []
+        post.comment_count = 0
+    if not by_id or per_post <= 0:
+        return posts
+
+    ranked = db.session.query(
+        Comment.id.label('id'),
+        func.row_number().over(
+            partition_by=Comment.post_id,
+            order_by=(Comment.date_posted, Comment.id)
+        ).label('position'),
+        func.count(Comment.id).over(partition_by=Comment.post_id).label('total'),
+    ).filter(Comment.post_id.in_(by_id)).subquery()
+
+    rows = db.session.query(Comment, ranked.c.total).join(
+        ranked, ranked.c.id == Comment.id
+    ).filter(
+        ranked.c.position <= per_post
+    ).options(
+        joinedload(Comment.author)
+    ).order_by(Comment.post_id, ranked.c.position).all()
+
+    for comment, total in rows:
+        post = by_id[comment.post_id]
+        post.top_comments.append(comment)
+        post.comment_count = total
+    preload_role_names([post.author for post in posts] +
+                       [comment.author for post in posts for comment in post.top_comments])
+    return posts
+
+
+def latest_posts(limit=5, per_post=COMMENTS_PER_POST):
+    posts = _posts_query().order_by(Post.date_posted.desc(), Post.id.desc()).limit(limit).all()
+    return attach_top_comments(posts, per_post)
+
+
+def posts_page(cursor=None, per_page=20):
+    return keyset_page(_posts_query(), Post.date_posted, Post.id, cursor=cursor, per_page=per_page)
+
+
+def comments_page(post_id, cursor=None, per_page=20):
+    query = Comment.query.options(joinedload(Comment.author)).filter(Comment.post_id == post_id)
+    return keyset_page(query, Comment.date_posted, Comment.id, cursor=cursor,
+                       per_page=per_page, descending=False)
@@ -5,6 +5,7 @@ from flask_wtf.file import FileAllowed
 from flask_login import current_user
 import re
 from app.models import User
+from app.normalize import CYRILLIC_TO_LATIN_MAP
 from werkzeug.utils import secure_filename
 from flask import request  # Import request
 
@@ -14,21 +15,6 @@ def validate_phone_number_format(form, field):
     if not re.match(r'^\d{10,30}$', phone_number):
         raise ValidationError('Invalid phone number. Only digits are allowed and it must be between 10 and 30 digits long.')
 
-CYRILLIC_TO_LATIN_MAP = {
-    'А': 'A', 
-    'В': 'B', 
-    'Е': 'E',
-    'К': 'K', 
-    'М': 'M', 
-    'Н': 'H', 
-    'О': 'O', 
-    'Р': 'P', 
-    'С': 'C', 
-    'Т': 'T', 
-    'У': 'Y', 
-    'Х': 'X'
-}
-
 def validate_registration_number(form, field):
     registration_number = field.data.upper()
     transformed_number = ""
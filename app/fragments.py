@@ -0,0 +1,107 @@
+# fragments.py
+# {% cache key, tags %} ... {% endcache %} stores rendered template
+# fragments. Each tag has a version token in the backend and a fragment is
+# stored under its key plus the current tokens of its tags, so
+# invalidating a tag only replaces its token and stale fragments age out.
+#
+# Committed changes invalidate tags named after the table and the row,
+# e.g. 'user' and 'user:7'; a repair shop image also touches its owner's
+# 'user:<id>', a comment its post's 'post:<id>'.
+#
+# The backend is anything with get(key) and set(key, value); the default
+# is an in-process LRUCache, whose ttl bounds how long other worker
+# processes (which never see this one's commits) can serve a stale copy.
+
+import secrets
+from jinja2 import nodes
+from jinja2.ext import Extension
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from app.cache import LRUCache
+from app.models import User, Role, Post, Comment, RepairShopImage
+
+TRACKED_MODELS = (User, Role, Post, Comment, RepairShopImage)
+
+
+class FragmentCache:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def _version(self, tag):
+        version = self.backend.get(f'tag:{tag}')
+        if version is None:
+            version = secrets.token_hex(4)
+            self.backend.set(f'tag:{tag}', version)
+        return version
+
+    def invalidate(self, tag):
+        # A tag without a version has no fragments yet; leaving it unset
+        # keeps bulk writes from filling the backend with tag entries
+        if self.backend.get(f'tag:{tag}') is not None:
+            self.backend.set(f'tag:{tag}', secrets.token_hex(4))
+
+    def render(self, key, tags, render):
+        versions = ','.join(self._version(tag) for tag in tags)
+        cache_key = f'fragment:{key}:{versions}'
+        fragment = self.backend.get(cache_key)
+        if fragment is None:
+            fragment = render()
+            self.backend.set(cache_key, fragment)
+        return fragment
+
+
+fragment_cache = FragmentCache(LRUCache())
+
+
+class FragmentCacheExtension(Extension):
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        if parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        else:
+            args.append(nodes.List([]))
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render', args), [], [], body).set_lineno(lineno)
+
+    def _render(self, key, tags, caller):
+        if isinstance(tags, str):
+            tags = [tags]
+        return fragment_cache.render(key, tags, caller)
+
+
+def init_app(app):
+    fragment_cache.backend.maxsize = app.config['FRAGMENT_CACHE_SIZE']
+    fragment_cache.backend.ttl = app.config['FRAGMENT_CACHE_TTL']
+    app.jinja_env.add_extension(FragmentCacheExtension)
+
+
+def _tags_of(obj):
+    table = obj.__tablename__
+    tags = {table, f'{table}:{obj.id}'}
+    if isinstance(obj, RepairShopImage):
+        tags.add(f'user:{obj.user_id}')
+    elif isinstance(obj, Comment):
+        tags.add(f'post:{obj.post_id}')
+    return tags
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_fragment_tags(session, flush_context):
+    tags = session.info.setdefault('fragment_tags', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, TRACKED_MODELS):
+            tags.update(_tags_of(obj))
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_fragment_tags(session):
+    for tag in session.info.pop('fragment_tags', ()):
+        fragment_cache.invalidate(tag)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_fragment_tags(session):
+    session.info.pop('fragment_tags', None)
@@ -0,0 +1,390 @@
+# images.py
+# Upload handling for profile and repair shop pictures. The request only
+# streams the upload into a staging directory; decoding, resizing and
+# re-encoding happen in a bounded process pool. Until the processed file
+# exists, templates get a placeholder that main.js swaps in place. An
+# upload that cannot be processed is dropped: users get the default
+# picture back and the repair shop image row is deleted.
+#
+# Files are named by a hash of the uploaded bytes, so identical uploads
+# share one blob and a name never changes content; they are served with
+# immutable cache headers. Blobs are referenced from User.image_file and
+# RepairShopImage.image_file and removed once a commit drops the last
+# reference (or by 'flask gc-images').
+#
+# Smaller sizes and WebP variants are rendered on first request by
+# /img/<hash>/<width> into a size-bounded disk cache, and templates emit
+# <picture>/srcset so browsers fetch the smallest adequate file.
+
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+import click
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from flask import url_for, request, current_app
+from flask.cli import with_appcontext
+from markupsafe import Markup, escape
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+from app import db
+from app.cache import DiskCache, LRUCache
+from app.models import User, RepairShopImage, user_cache
+
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+# Widths /img will render: 64/128 for avatars, 320 for cards, 500 is the
+# stored full size. Adding a size here needs no reprocessing.
+DERIVATIVE_WIDTHS = (64, 128, 320, 500)
+FULL_WIDTH = 500
+PLACEHOLDER = 'processing.svg'
+DEFAULT_PICTURE = 'default.jpg'
+# Hex digits of the content hash kept in the name; image_file columns are 20 chars
+NAME_LENGTH = 16
+ORIGINAL = re.compile(r'^[0-9a-f]{16}\.(jpg|jpeg|png)$')
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# Which column references the blobs stored in each folder
+REFERENCES = {
+    'profile_pics': User.image_file,
+    'repair_shop_pics': RepairShopImage.image_file,
+}
+
+SAVE_OPTIONS = {
+    'JPEG': {'quality': 85, 'optimize': True, 'progressive': True},
+    'PNG': {'optimize': True},
+    'WEBP': {'quality': 80, 'method': 4},
+}
+
+# Set up by init_app from IMAGE_CACHE_DIR and IMAGE_CACHE_BYTES
+image_cache = None
+# digest -> path of the stored picture
+_originals = LRUCache(maxsize=4096)
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_pending = 0
+_pending_lock = threading.Lock()
+
+
+def init_app(app):
+    global image_cache
+    image_cache = DiskCache(app.config['IMAGE_CACHE_DIR'], app.config['IMAGE_CACHE_BYTES'])
+    app.after_request(_cache_content_addressed)
+    app.add_template_global(picture)
+    app.cli.add_command(gc_images)
+
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+def picture_path(folder, filename):
+    return os.path.join(current_app.root_path, 'static', folder, filename)
+
+
+def staging_dir():
+    path = os.path.join(current_app.instance_path, 'staging')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _encode(image, path, image_format):
+    # Metadata (EXIF, comments) is never passed on, so saving strips it
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    image.save(path, format=image_format, **SAVE_OPTIONS.get(image_format, {}))
+
+
+def _image_format(ext):
+    from PIL import Image
+
+    return Image.registered_extensions()[ext.lower()]
+
+
+def process_upload(staged_path, target_path):
+    # Runs in a pool worker (or inline); the target appears atomically
+    from PIL import Image, ImageOps
+
+    tmp_path = target_path + '.tmp'
+    try:
+        with Image.open(staged_path) as image:
+            # Apply the EXIF orientation before the tag is dropped
+            image = ImageOps.exif_transpose(image)
+        image.thumbnail((FULL_WIDTH, FULL_WIDTH))
+        _encode(image, tmp_path, _image_format(os.path.splitext(target_path)[1]))
+        os.replace(tmp_path, target_path)
+    finally:
+        for path in (staged_path, tmp_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def find_original(digest):
+    path = _originals.get(digest)
+    if path is None:
+        for folder in REFERENCES:
+            for ext in ('.jpg', '.png', '.jpeg'):
+                if os.path.exists(picture_path(folder, digest + ext)):
+                    path = picture_path(folder, digest + ext)
+                    _originals.set(digest, path)
+                    return path
+    return path
+
+
+def thumbnail_etag(digest, width, ext=None):
+    return f'{digest}-{width}{ext or ""}'
+
+
+def thumbnail(digest, width, ext=None):
+    # Path of the cached derivative (rendered on first use), or None when
+    # there is no such picture or width; ext None keeps the stored format
+    from PIL import Image
+
+    if width not in DERIVATIVE_WIDTHS:
+        return None
+    source = find_original(digest)
+    if source is None:
+        return None
+    ext = ext or os.path.splitext(source)[1]
+    key = f'{digest}-{width}{ext}'
+    path = image_cache.get(key)
+    if path is not None:
+        return path
+
+    def render(tmp_path):
+        with Image.open(source) as image:
+            image.thumbnail((width, width))
+            _encode(image, tmp_path, _image_format(ext))
+
+    try:
+        return image_cache.put(key, render)
+    except FileNotFoundError:
+        if os.path.exists(source):
+            # Not the original that went missing; render it once more
+            return image_cache.put(key, render)
+        # Collected since it was looked up
+        _originals.invalidate(digest)
+        return None
+
+
+def immutable(response):
+    response.cache_control.no_cache = None
+    response.cache_control.public = True
+    response.cache_control.max_age = IMMUTABLE_MAX_AGE
+    response.cache_control.immutable = True
+    response.expires = datetime.now(timezone.utc) + timedelta(seconds=IMMUTABLE_MAX_AGE)
+    return response
+
+
+def _get_executor():
+    # Created lazily and per process, so pre-forked workers never share a pool
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ProcessPoolExecutor(max_workers=current_app.config['IMAGE_WORKERS'])
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def pending_jobs():
+    return _pending
+
+
+def _drop_references(folder, filename):
+    # The picture will never exist: users fall back to the default
+    # picture, repair shop images are removed
+    column = REFERENCES[folder]
+    reset_users = []
+    for obj in column.class_.query.filter(column == filename):
+        if isinstance(obj, User):
+            obj.image_file = DEFAULT_PICTURE
+            reset_users.append(obj.id)
+        else:
+            db.session.delete(obj)
+    db.session.commit()
+    for user_id in reset_users:
+        user_cache.invalidate(user_id)
+
+
+def _job_done(app, folder, filename, future):
+    # Runs on the pool's result thread, outside any app context
+    global _pending
+    with _pending_lock:
+        _pending -= 1
+    if future.exception() is not None:
+        app.logger.error(f'Image processing failed for {folder}/{filename}: {future.exception()}')
+        with app.app_context():
+            try:
+                _drop_references(folder, filename)
+            except Exception as e:
+                app.logger.error(f'Could not drop references to {folder}/{filename}: {e}')
+            finally:
+                db.session.remove()
+
+
+def submit(staged_path, target_path):
+    global _pending
+    with _pending_lock:
+        queued = current_app.config['IMAGE_WORKERS'] > 0 and _pending < current_app.config['IMAGE_QUEUE_SIZE']
+        if queued:
+            _pending += 1
+    if not queued:
+        # No pool configured or the queue is full: process in the request
+        process_upload(staged_path, target_path)
+        return
+    try:
+        folder, filename = os.path.split(target_path)
+        _get_executor().submit(process_upload, staged_path, target_path).add_done_callback(
+            partial(_job_done, current_app._get_current_object(), os.path.basename(folder), filename))
+    except Exception:
+        with _pending_lock:
+            _pending -= 1
+        raise
+
+
+def save_picture(form_picture, folder='profile_pics'):
+    if not allowed_file(form_picture.filename):
+        raise ValueError("Unsupported file type. Please upload a .jpg, .jpeg, or .png file.")
+
+    _, f_ext = os.path.splitext(form_picture.filename)
+    f_ext = '.jpg' if f_ext.lower() == '.jpeg' else f_ext.lower()
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=staging_dir())
+    try:
+        with os.fdopen(fd, 'wb') as staged:
+            for chunk in iter(lambda: form_picture.stream.read(64 * 1024), b''):
+                digest.update(chunk)
+                staged.write(chunk)
+        picture_fn = digest.hexdigest()[:NAME_LENGTH] + f_ext
+        target_path = picture_path(folder, picture_fn)
+        staged_path = os.path.join(staging_dir(), f'{folder}-{picture_fn}')
+        if os.path.exists(target_path):
+            # Identical upload: reuse the blob, and keep it out of the
+            # garbage collector's grace window until the new row commits
+            os.utime(target_path)
+            return picture_fn
+        if os.path.exists(staged_path):
+            # Identical upload that is still being processed
+            return picture_fn
+        os.replace(tmp_path, staged_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    submit(staged_path, target_path)
+    return picture_fn
+
+
+def collect_garbage(candidates=None, grace=None):
+    # Removes unreferenced blobs and their cached derivatives. candidates is a
+    # set of (folder, filename); None scans both folders completely.
+    # Files modified within grace seconds are kept, since their row may
+    # belong to a transaction that has not committed yet.
+    grace = current_app.config['IMAGE_GC_GRACE'] if grace is None else grace
+    removed = []
+    with db.engine.connect() as connection:
+        for folder, column in REFERENCES.items():
+            if candidates is None:
+                directory = os.path.join(current_app.root_path, 'static', folder)
+                names = set(os.listdir(directory)) if os.path.isdir(directory) else set()
+            else:
+                names = {name for candidate_folder, name in candidates if candidate_folder == folder}
+            names = {name for name in names if ORIGINAL.match(name)}
+            if not names:
+                continue
+            referenced = set(connection.scalars(select(column).where(column.in_(names))))
+            for name in sorted(names - referenced):
+                path = picture_path(folder, name)
+                if os.path.exists(path) and time.time() - os.path.getmtime(path) < grace:
+                    continue
+                if os.path.exists(path):
+                    os.remove(path)
+                digest = os.path.splitext(name)[0]
+                _originals.invalidate(digest)
+                image_cache.discard(f'{digest}-')
+                removed.append(f'{folder}/{name}')
+    return removed
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_released_images(session, flush_context):
+    released = session.info.setdefault('released_images', set())
+    for obj in session.dirty:
+        if isinstance(obj, User):
+            history = inspect(obj).attrs.image_file.history
+            released.update(('profile_pics', name) for name in history.deleted if name)
+    for obj in session.deleted:
+        if isinstance(obj, User) and obj.image_file:
+            released.add(('profile_pics', obj.image_file))
+        elif isinstance(obj, RepairShopImage):
+            released.add(('repair_shop_pics', obj.image_file))
+
+
+@event.listens_for(Session, 'after_commit')
+def _release_images(session):
+    released = session.info.pop('released_images', None)
+    if released:
+        try:
+            collect_garbage(released)
+        except Exception as e:
+            current_app.logger.error(f'Image garbage collection failed: {e}')
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_released_images(session):
+    session.info.pop('released_images', None)
+
+
+def _cache_content_addressed(response):
+    # A content-addressed name always refers to the same bytes
+    if request.endpoint == 'static' and response.status_code in (200, 304):
+        folder, _, name = request.view_args.get('filename', '').rpartition('/')
+        if folder in REFERENCES and ORIGINAL.match(name):
+            immutable(response)
+    return response
+
+
+def picture(folder, filename, width, **attrs):
+    # width is the rendered CSS width in pixels (or a sizes expression);
+    # remaining keyword arguments become attributes of the <img>
+    src = escape(url_for('static', filename=f'{folder}/{filename}'))
+    attributes = ' '.join(f'{name}="{escape(value)}"' for name, value in attrs.items())
+
+    if not os.path.exists(picture_path(folder, filename)):
+        if not os.path.exists(os.path.join(staging_dir(), f'{folder}-{filename}')):
+            # Processing failed before the row referencing it was committed
+            if folder != 'profile_pics':
+                return Markup('')
+            src = escape(url_for('static', filename=f'{folder}/{DEFAULT_PICTURE}'))
+            return Markup(f'<img src="{src}" {attributes}>')
+        # Still processing: main.js keeps retrying data-pending-src
+        placeholder = escape(url_for('static', filename=PLACEHOLDER))
+        return Markup(f'<img src="{placeholder}" data-pending-src="{src}" {attributes}>')
+    if not ORIGINAL.match(filename):
+        # Fixed names such as default.jpg
+        return Markup(f'<img src="{src}" {attributes}>')
+
+    digest = os.path.splitext(filename)[0]
+    sizes = escape(f'{width}px' if isinstance(width, int) else width)
+    # ext='' picks the stored-format route; url_for drops None and would
+    # fall through to the .webp one
+    srcset = ', '.join([f'{escape(url_for("public.image_thumbnail", digest=digest, width=w, ext=""))} {w}w'
+                        for w in DERIVATIVE_WIDTHS if w != FULL_WIDTH] + [f'{src} {FULL_WIDTH}w'])
+    webp_srcset = ', '.join(f'{escape(url_for("public.image_thumbnail", digest=digest, width=w, ext=".webp"))} {w}w'
+                            for w in DERIVATIVE_WIDTHS)
+    return Markup(f'<picture><source type="image/webp" srcset="{webp_srcset}" sizes="{sizes}">'
+                  f'<img src="{src}" srcset="{srcset}" sizes="{sizes}" {attributes}></picture>')
+
+
+@click.command('gc-images')
+@with_appcontext
+def gc_images():
+    """Remove pictures that are no longer referenced by any user or repair shop image."""
+    for removed in collect_garbage():
+        print(removed)
@@ -0,0 +1,123 @@
+# instrumentation.py
+# Per-request SQL accounting. Cursor events count statements and add up
+# their time for the current request; statements are also grouped by
+# shape (the SQL text with IN-lists collapsed), and a shape that runs
+# SQL_REPEAT_THRESHOLD times or more in one request is reported as a
+# likely N+1.
+#
+# Every response gets a Server-Timing header (db time, query count,
+# repeated shapes), and a JSON log line is written - at WARNING when a
+# request repeats statements or goes over its query budget. Budgets come
+# from @query_budget(n) on the view or SQL_QUERY_BUDGET; with SQL_STRICT
+# set, going over raises QueryBudgetExceeded so tests fail on it.
+
+import json
+import re
+import time
+from collections import Counter
+from flask import g, request, has_request_context, current_app
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)|\(\s*%\(\w+\)s(?:\s*,\s*%\(\w+\)s)+\s*\)')
+_SPACE = re.compile(r'\s+')
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class RequestStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.shapes = Counter()
+
+    def repeated(self):
+        threshold = current_app.config['SQL_REPEAT_THRESHOLD']
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= threshold]
+
+
+def query_budget(limit):
+    # Most queries the decorated view may run; apply it below @bp.route
+    # and other decorators, so they copy the attribute onto their wrappers
+    def decorator(view):
+        view.query_budget = limit
+        return view
+    return decorator
+
+
+def request_stats():
+    return g.get('sql_stats') if has_request_context() else None
+
+
+def _shape(statement):
+    return _IN_LIST.sub('(?)', _SPACE.sub(' ', statement).strip())
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_query(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    stats = request_stats()
+    if stats is None:
+        return
+    stats.queries += 1
+    started = getattr(context, '_query_started', None)
+    if started is not None:
+        stats.db_time += time.perf_counter() - started
+    stats.shapes[_shape(statement)] += 1
+
+
+def init_app(app):
+    app.before_request(_start_request_stats)
+    app.after_request(_report_request_stats)
+
+
+def _start_request_stats():
+    g.sql_stats = RequestStats()
+
+
+def _report_request_stats(response):
+    # Left in g for the request metrics recorded at teardown
+    stats = g.get('sql_stats')
+    if stats is None:
+        return response
+    total = time.perf_counter() - stats.started
+    repeated = stats.repeated()
+    view = current_app.view_functions.get(request.endpoint)
+    budget = getattr(view, 'query_budget', None) or current_app.config['SQL_QUERY_BUDGET']
+    over_budget = bool(budget) and stats.queries > budget
+
+    timing = [f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} queries"',
+              f'app;dur={total * 1000:.1f}']
+    if repeated:
+        timing.append(f'db-repeated;desc="{len(repeated)} statements repeated"')
+    response.headers.add('Server-Timing', ', '.join(timing))
+
+    record = {
+        'event': 'sql',
+        'method': request.method,
+        'path': request.path,
+        'endpoint': request.endpoint,
+        'status': response.status_code,
+        'queries': stats.queries,
+        'db_ms': round(stats.db_time * 1000, 1),
+        'total_ms': round(total * 1000, 1),
+        'budget': budget or None,
+        'repeated': [{'count': count, 'sql': shape[:200]} for shape, count in repeated],
+    }
+    line = json.dumps(record, ensure_ascii=False)
+    if repeated or over_budget:
+        current_app.logger.warning(line)
+    else:
+        current_app.logger.debug(line)
+
+    if over_budget and current_app.config['SQL_STRICT']:
+        raise QueryBudgetExceeded(f'{request.endpoint} ran {stats.queries} queries, budget is {budget}')
+    return response
@@ -0,0 +1,353 @@
+# metrics.py
+# Prometheus text-format metrics at /metrics: request counts and latency
+# per endpoint and status, time spent in the database, in templates and
+# in external calls (Speech, OAuth), requests in flight and the image and
+# transcription queue depths.
+#
+# Updates never take a lock: every thread writes to its own shard of
+# plain dicts and a scrape adds the shards up. Each worker process also
+# dumps its totals to METRICS_DIR (at most every METRICS_FLUSH_INTERVAL
+# seconds), and a scrape served by any worker merges the files of all of
+# them; the counters of workers that have exited are folded into one
+# file so totals stay monotonic across worker restarts.
+
+import bisect
+import fcntl
+import json
+import os
+import socket
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from flask import g, request, Response, abort, has_request_context, current_app, before_render_template, template_rendered
+from app.instrumentation import request_stats
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+EXTERNAL_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+RETIRED = '_retired.json'
+
+_flushed = 0
+
+
+class _ShardOwner:
+    # Lives in a thread's local storage; collected when the thread exits
+    pass
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self._shards = []
+        self._retired = {}
+        self._local = threading.local()
+        # Reentrant: a retiring thread's finalizer can run during a
+        # collection on the thread that holds it
+        self._lock = threading.RLock()
+        self._pid = os.getpid()
+
+    def shard(self):
+        values = getattr(self._local, 'values', None)
+        if values is None or self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    # Forked: the parent's numbers belong to the parent
+                    self._shards = []
+                    self._retired = {}
+                    self._pid = os.getpid()
+                values = {}
+                self._shards.append(values)
+            # Threads come and go (one per request under the threaded dev
+            # server); a finished thread's numbers move into _retired
+            owner = self._local.owner = _ShardOwner()
+            weakref.finalize(owner, self._retire, values, os.getpid())
+            self._local.values = values
+        return values
+
+    def _retire(self, values, pid):
+        with self._lock:
+            if pid != self._pid:
+                return
+            self._shards = [shard for shard in self._shards if shard is not values]
+            for (name, labels), value in values.items():
+                _add(self._retired, (name, labels), value)
+
+    def collect(self):
+        # -> {metric name: {labels: value}}, histogram values are bucket lists
+        totals = {name: {} for name in self.metrics}
+        with self._lock:
+            if self._pid != os.getpid():
+                return totals
+            for shard in [self._retired, *self._shards]:
+                for (name, labels), value in list(shard.items()):
+                    _add(totals[name], labels, value)
+        return totals
+
+
+def _add(values, labels, value):
+    if isinstance(value, list):
+        current = values.get(labels)
+        values[labels] = list(value) if current is None else [a + b for a, b in zip(current, value)]
+    else:
+        values[labels] = values.get(labels, 0) + value
+
+
+registry = Registry()
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        registry.metrics[name] = self
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        values = registry.shard()
+        key = (self.name, labels)
+        values[key] = values.get(key, 0) + amount
+
+
+class Gauge(Counter):
+    # Summed over threads and live processes
+    kind = 'gauge'
+
+    def dec(self, *labels):
+        self.inc(*labels, amount=-1)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+
+    def observe(self, value, *labels):
+        # Cells are per-bucket counts (the last one is +Inf) followed by the sum
+        values = registry.shard()
+        key = (self.name, labels)
+        cells = values.get(key)
+        if cells is None:
+            cells = values[key] = [0] * (len(self.buckets) + 2)
+        cells[bisect.bisect_left(self.buckets, value)] += 1
+        cells[-1] += value
+
+
+requests_total = Counter('http_requests_total', 'Requests handled', ('endpoint', 'method', 'status'))
+request_duration = Histogram('http_request_duration_seconds', 'Request latency', ('endpoint', 'status'))
+request_db_seconds = Counter('http_request_db_seconds_total', 'Time spent in SQL', ('endpoint',))
+request_queries = Counter('http_request_queries_total', 'SQL statements executed', ('endpoint',))
+request_template_seconds = Counter('http_request_template_seconds_total', 'Time spent rendering templates', ('endpoint',))
+request_external_seconds = Counter('http_request_external_seconds_total', 'Time spent waiting on external services', ('endpoint',))
+requests_in_flight = Gauge('http_requests_in_flight', 'Requests being handled')
+external_duration = Histogram('external_call_duration_seconds', 'Calls to external services', ('service',),
+                              buckets=EXTERNAL_BUCKETS)
+external_errors = Counter('external_call_errors_total', 'Failed calls to external services', ('service',))
+queue_depth = Gauge('background_queue_depth', 'Jobs queued or running in background pools', ('queue',))
+
+
+@contextmanager
+def external_call(service):
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        external_errors.inc(service)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        external_duration.observe(elapsed, service)
+        if has_request_context():
+            g.external_time = g.get('external_time', 0) + elapsed
+
+
+def metrics_dir():
+    path = current_app.config['METRICS_DIR']
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _process_file():
+    return os.path.join(metrics_dir(), f'{socket.gethostname()}-{os.getpid()}.json')
+
+
+def _serialize(totals):
+    return {name: [[list(labels), value] for labels, value in values.items()] for name, values in totals.items()}
+
+
+def _merge(totals, data, with_gauges=True):
+    for name, rows in data.items():
+        metric = registry.metrics.get(name)
+        if metric is None or (metric.kind == 'gauge' and not with_gauges):
+            continue
+        for labels, value in rows:
+            _add(totals.setdefault(name, {}), tuple(labels), value)
+
+
+def flush():
+    from app import images, transcription
+
+    global _flushed
+    totals = registry.collect()
+    # Queue lengths are only known process-wide, so they are sampled here
+    totals[queue_depth.name] = {('images',): images.pending_jobs(),
+                                ('transcription',): transcription.pending_jobs()}
+    path = _process_file()
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as snapshot:
+        json.dump(_serialize(totals), snapshot)
+    os.replace(tmp_path, path)
+    _flushed = time.monotonic()
+
+
+def _alive(name):
+    host, _, pid = name[:-len('.json')].rpartition('-')
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, ValueError):
+        pass
+    return True
+
+
+def _read(path):
+    try:
+        with open(path) as snapshot:
+            return json.load(snapshot)
+    except (OSError, ValueError):
+        return {}
+
+
+def collect_all():
+    flush()
+    directory = metrics_dir()
+    totals = {}
+    with open(os.path.join(directory, '.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        retired_path = os.path.join(directory, RETIRED)
+        retired = {}
+        _merge(retired, _read(retired_path))
+        changed = False
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith('.json') or name == RETIRED:
+                continue
+            data = _read(os.path.join(directory, name))
+            if _alive(name):
+                _merge(totals, data)
+            else:
+                _merge(retired, data, with_gauges=False)
+                os.remove(os.path.join(directory, name))
+                changed = True
+        if changed:
+            with open(retired_path + '.tmp', 'w') as snapshot:
+                json.dump(_serialize(retired), snapshot)
+            os.replace(retired_path + '.tmp', retired_path)
+    for name, values in retired.items():
+        for labels, value in values.items():
+            _add(totals.setdefault(name, {}), labels, value)
+    return totals
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def exposition(totals):
+    lines = []
+    for name, metric in registry.metrics.items():
+        lines.append(f'# HELP {name} {metric.documentation}')
+        lines.append(f'# TYPE {name} {metric.kind}')
+        for labels, value in sorted(totals.get(name, {}).items()):
+            if metric.kind != 'histogram':
+                lines.append(f'{name}{_format_labels(metric.labels, labels)} {_number(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip(list(metric.buckets) + ['+Inf'], value[:-1]):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f'{name}_bucket{_format_labels(metric.labels, labels, le)} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(metric.labels, labels)} {_number(value[-1])}')
+            lines.append(f'{name}_count{_format_labels(metric.labels, labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+def init_app(app):
+    before_render_template.connect(_start_template, app)
+    template_rendered.connect(_end_template, app)
+    app.before_request(_start_request_metrics)
+    app.after_request(_record_status)
+    app.teardown_request(_record_request_metrics)
+    app.add_url_rule('/metrics', 'metrics', metrics)
+
+
+def _start_template(sender, template, context, **extra):
+    g.setdefault('template_starts', []).append(time.perf_counter())
+
+
+def _end_template(sender, template, context, **extra):
+    starts = g.get('template_starts')
+    if starts:
+        elapsed = time.perf_counter() - starts.pop()
+        if not starts:
+            # Only the outermost render counts, nested ones are part of it
+            g.template_time = g.get('template_time', 0) + elapsed
+
+
+def _start_request_metrics():
+    g.metrics_started = time.perf_counter()
+    requests_in_flight.inc()
+
+
+def _record_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+def _record_request_metrics(exc):
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return
+    requests_in_flight.dec()
+    endpoint = request.endpoint or 'unmatched'
+    status = str(g.get('metrics_status', 500))
+    requests_total.inc(endpoint, request.method, status)
+    request_duration.observe(time.perf_counter() - started, endpoint, status)
+    stats = request_stats()
+    if stats is not None:
+        request_db_seconds.inc(endpoint, amount=stats.db_time)
+        request_queries.inc(endpoint, amount=stats.queries)
+    request_template_seconds.inc(endpoint, amount=g.get('template_time', 0))
+    request_external_seconds.inc(endpoint, amount=g.get('external_time', 0))
+    if time.monotonic() - _flushed > current_app.config['METRICS_FLUSH_INTERVAL']:
+        try:
+            flush()
+        except OSError as e:
+            current_app.logger.error(f'Could not write metrics: {e}')
+
+
+def metrics():
+    token = current_app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(401)
+    return Response(exposition(collect_all()), mimetype='text/plain; version=0.0.4')
@@ -1,12 +1,81 @@
 from app import db, login_manager
+from app.cache import LRUCache
+from app.normalize import normalize_registration_number, normalize_phone_number
 from datetime import datetime
 from flask_login import UserMixin, AnonymousUserMixin
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+# Detached snapshots of recently authenticated users, keyed by user id.
+# Views that change a user must call user_cache.invalidate(user.id).
+user_cache = LRUCache()
+
+def init_app(app):
+    user_cache.maxsize = app.config['USER_CACHE_SIZE']
+    user_cache.ttl = app.config['USER_CACHE_TTL']
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # A cache hit identifies the caller without touching the database.
+    # Invalidation only reaches this process: other workers keep their
+    # snapshot of a changed, demoted or deleted user for up to
+    # USER_CACHE_TTL seconds, so keep that short.
+    user_id = int(user_id)
+    snapshot = user_cache.get(user_id)
+    if snapshot is not None:
+        return snapshot
+    user = db.session.get(User, user_id)
+    if user is None:
+        return None
+    # The session may still hold the instance with the old roles resolved
+    user._role_names = None
+    preload_role_names([user])
+    snapshot = CachedUser.from_user(user)
+    user_cache.set(user_id, snapshot)
+    return snapshot
+
+def user_ids_with_role(name):
+    # Subquery for User.id.in_(); unlike User.roles.any() it starts from
+    # the role and uses ix_user_roles_role_user instead of scanning users
+    return db.session.query(user_roles.c.user_id).join(
+        Role, Role.id == user_roles.c.role_id
+    ).filter(Role.name == name)
+
+def preload_role_names(users):
+    # Resolves role names for many users with a single query
+    pending = {user.id: user for user in users if user is not None and user._role_names is None}
+    if not pending:
+        return users
+    names = {user_id: set() for user_id in pending}
+    rows = db.session.query(user_roles.c.user_id, Role.name).join(
+        Role, Role.id == user_roles.c.role_id
+    ).filter(user_roles.c.user_id.in_(pending))
+    for user_id, name in rows:
+        names[user_id].add(name)
+    for user_id, user in pending.items():
+        user._role_names = frozenset(names[user_id])
+    return users
+
+class RoleChecks:
+    # Shared by User and CachedUser, both expose role_names
+    def has_role(self, role_name):
+        return role_name in self.role_names
+
+    def is_admin(self):
+        return self.has_role('admin')
+
+    def is_mechanic(self):
+        return self.has_role('mechanic')
 
-class User(db.Model, UserMixin):
+    def is_car_owner(self):
+        return self.has_role('car_owner')
+
+    def can_comment(self, post):
+        if self.id == post.user_id or self.is_mechanic():
+            return True
+        return False
+
+class User(db.Model, UserMixin, RoleChecks):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(100), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
@@ -17,40 +86,63 @@ class User(db.Model, UserMixin):
     password = db.Column(db.String(60), nullable=False, default="$2b$12$rO6wrQC5uuyOg/LYIUbvmOxd7KhL3qaWfITos07XbCAgREWXlF2Am")
     date_created = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     visibility = db.Column(db.Boolean, nullable=False, default=True)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
     roles = db.relationship('Role', secondary='user_roles', backref=db.backref('users', lazy='dynamic'))
+    __table_args__ = (db.Index('ix_user_date_created', 'date_created', 'id'),)
     posts = db.relationship('Post', backref='author', lazy=True, cascade='all, delete-orphan')
     comments = db.relationship('Comment', backref='author', lazy=True, cascade='all, delete-orphan')
+
+    # Resolved once per instance, see role_names
+    _role_names = None
     
     def __repr__(self):
         return f"User('{self.username}', '{self.email}', '{self.phone_number}')"
 
-    def has_role(self, role_name):
-        return any(role.name == role_name for role in self.roles)
+    @property
+    def role_names(self):
+        if self._role_names is None:
+            self._role_names = frozenset(role.name for role in self.roles)
+        return self._role_names
 
-    def is_admin(self):
-        return self.has_role('admin')
+@event.listens_for(User.roles, 'append')
+@event.listens_for(User.roles, 'remove')
+def _reset_role_names(user, *args):
+    user._role_names = None
 
-    def is_mechanic(self):
-        return self.has_role('mechanic')
+@event.listens_for(Session, 'before_flush')
+def _bump_user_version(session, flush_context, instances):
+    for obj in session.dirty:
+        if isinstance(obj, User) and session.is_modified(obj):
+            obj.version = (obj.version or 0) + 1
 
-    def is_car_owner(self):
-        return self.has_role('car_owner')
-    
-    def can_comment(self, post):
-        if self.id == post.user_id or self.is_mechanic():
-            return True
-        return False
+class CachedUser(UserMixin, RoleChecks):
+    # Read-only stand-in for current_user; load the User row to modify it
+    __slots__ = ('id', 'username', 'email', 'phone_number', 'image_file',
+                 'biography', 'expertise', 'role_names', 'version')
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields[name])
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(**{name: getattr(user, name) for name in cls.__slots__})
+
+    def __repr__(self):
+        return f"CachedUser('{self.username}', version={self.version})"
 
 # Association table for user roles
 user_roles = db.Table('user_roles',
     db.Column('user_id', db.Integer, db.ForeignKey('user.id'), primary_key=True),
-    db.Column('role_id', db.Integer, db.ForeignKey('role.id'), primary_key=True)
+    db.Column('role_id', db.Integer, db.ForeignKey('role.id'), primary_key=True),
+    # The primary key only serves lookups by user; this one serves "users with role X"
+    db.Index('ix_user_roles_role_user', 'role_id', 'user_id')
 )
 
 class RepairShopImage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     image_file = db.Column(db.String(20), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
 
     def __repr__(self):
         return f"RepairShopImage('{self.image_file}', '{self.user_id}')"
@@ -67,6 +159,10 @@ class CarOwner(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=True)
     phone_number = db.Column(db.String, unique=True, nullable=True)
+    # Digits-only copy of phone_number for prefix search, and the same
+    # digits reversed so "ends with" is a prefix search too; see app/normalize.py
+    phone_search = db.Column(db.String, nullable=True, index=True)
+    phone_search_reversed = db.Column(db.String, nullable=True, index=True)
     cars = db.relationship('Car', backref='owner', lazy=True, cascade='all, delete-orphan')
 
     def __repr__(self):
@@ -81,25 +177,53 @@ class Car(db.Model):
     visibility = db.Column(db.Boolean, nullable=False, default=True)
     owner_id = db.Column(db.Integer, db.ForeignKey('car_owner.id'), nullable=False)
     mechanic_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # Latin-folded, alphanumeric-only copy of registration_number for prefix
+    # search; never longer than the original, so unbounded like it
+    registration_search = db.Column(db.String, nullable=True)
     visits = db.relationship('CarVisit', backref='car', lazy=True, cascade='all, delete-orphan')
     mechanic = db.relationship('User', backref='cars', lazy=True)
-    __table_args__ = (db.UniqueConstraint('registration_number', 'mechanic_id', name='_registration_mechanic_uc'),)
+    __table_args__ = (
+        db.UniqueConstraint('registration_number', 'mechanic_id', name='_registration_mechanic_uc'),
+        db.Index('ix_car_mechanic_registration_search', 'mechanic_id', 'registration_search'),
+        db.Index('ix_car_owner_mechanic', 'owner_id', 'mechanic_id'),
+        db.Index('ix_car_date_created', 'date_created', 'id'),
+        # Mechanic dashboard: only visible cars, newest first. Partial where
+        # the backend supports it; filter with visibility == True (SQLite
+        # cannot match the "IS 1" that .is_(True) renders)
+        db.Index('ix_car_mechanic_visible_created', 'mechanic_id', 'date_created', 'id',
+                 sqlite_where=db.text('visibility = 1'), postgresql_where=db.text('visibility')),
+    )
 
     def __repr__(self):
         return f"Car('{self.registration_number}', '{self.vin_number}')"
 
+@event.listens_for(CarOwner.phone_number, 'set')
+def _set_phone_search(owner, value, oldvalue, initiator):
+    owner.phone_search = normalize_phone_number(value)
+    owner.phone_search_reversed = owner.phone_search[::-1]
+
+@event.listens_for(Car.registration_number, 'set')
+def _set_registration_search(car, value, oldvalue, initiator):
+    car.registration_search = normalize_registration_number(value)
+
 class CarVisit(db.Model):
     __tablename__ = 'car_visit'
     id = db.Column(db.Integer, primary_key=True)
     date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     description = db.Column(db.String(), nullable=True)
     car_id = db.Column(db.Integer, db.ForeignKey('car.id'), nullable=False)
+    __table_args__ = (db.Index('ix_car_visit_car_date', 'car_id', 'date'),)
 
     def __repr__(self):
         return f"CarVisit('{self.date}', '{self.description}')"
 
 # Extend AnonymousUserMixin
 class Anonymous(AnonymousUserMixin):
+    role_names = frozenset()
+
+    def has_role(self, role_name):
+        return False
+
     def is_admin(self):
         return False
 
@@ -117,6 +241,7 @@ class Post(db.Model):
     date_posted = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
     comments = db.relationship('Comment', backref='post', lazy=True, cascade='all, delete-orphan')
+    __table_args__ = (db.Index('ix_post_date_posted', 'date_posted', 'id'),)
 
     def __repr__(self):
         return f"Post('{self.date_posted}')"
@@ -127,6 +252,18 @@ class Comment(db.Model):
     date_posted = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False)
+    __table_args__ = (db.Index('ix_comment_post_date', 'post_id', 'date_posted', 'id'),)
 
     def __repr__(self):
         return f"Comment('{self.content}', '{self.date_posted}')"
+
+class ChangeCounter(db.Model):
+    # Bumped in the same transaction as every change to the scope it names
+    # ('post', 'post:3', 'user:7', ...); see app/conditional.py
+    __tablename__ = 'change_counter'
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"ChangeCounter('{self.name}', {self.version})"
@@ -0,0 +1,49 @@
+# normalize.py
+# Canonical forms used for storing and searching registration numbers
+# and phone numbers. Kept free of app imports so models and forms can
+# both use it.
+
+import re
+
+CYRILLIC_TO_LATIN_MAP = {
+    'А': 'A', 
+    'В': 'B', 
+    'Е': 'E',
+    'К': 'K', 
+    'М': 'M', 
+    'Н': 'H', 
+    'О': 'O', 
+    'Р': 'P', 
+    'С': 'C', 
+    'Т': 'T', 
+    'У': 'Y', 
+    'Х': 'X'
+}
+
+_NOT_ALNUM = re.compile(r'[^0-9A-Z]')
+_NOT_DIGIT = re.compile(r'\D')
+
+
+def normalize_registration_number(value):
+    # 'са 1234 вх' -> 'CA1234BX'; anything that is not a latin letter or digit is dropped
+    if not value:
+        return ''
+    folded = ''.join(CYRILLIC_TO_LATIN_MAP.get(char, char) for char in value.upper())
+    return _NOT_ALNUM.sub('', folded)
+
+
+def normalize_phone_number(value):
+    if not value:
+        return ''
+    return _NOT_DIGIT.sub('', value)
+
+
+def prefix_range(column, prefix):
+    # Index-friendly "starts with" for already normalized values
+    return (column >= prefix) & (column < prefix[:-1] + chr(ord(prefix[-1]) + 1))
+
+
+def phone_range(search_column, reversed_column, phone):
+    # Numbers starting or ending with phone: people type either the full
+    # number or just its last digits. Both sides are index range scans.
+    return prefix_range(search_column, phone) | prefix_range(reversed_column, phone[::-1])
@@ -0,0 +1,149 @@
+# pagination.py
+# Keyset (seek) pagination over a (timestamp, id) ordering. The position
+# is handed to clients as an opaque cursor token, so page N costs the
+# same as page 1. paginate() combines it with numbered flask_paginate
+# links and cached totals for the list views.
+
+import base64
+import json
+from collections import namedtuple, defaultdict
+from datetime import datetime
+from flask import request, abort, url_for
+import flask_paginate
+from sqlalchemy import and_, or_, func
+from app import db
+from app.cache import LRUCache, on_commit_of
+
+KeysetPage = namedtuple('KeysetPage', 'items next_cursor')
+Count = namedtuple('Count', 'total exact')
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(timestamp, row_id):
+    raw = json.dumps([timestamp.isoformat(), row_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        timestamp, row_id = json.loads(raw)
+        return datetime.fromisoformat(timestamp), int(row_id)
+    except (ValueError, TypeError):
+        raise InvalidCursor(token)
+
+
+def keyset_page(query, timestamp_column, id_column, cursor=None, per_page=20, descending=True, offset=0):
+    # Raises InvalidCursor for tokens that were not produced by encode_cursor.
+    # offset is only used without a cursor, for jumping straight to a page.
+    if cursor:
+        timestamp, row_id = decode_cursor(cursor)
+        if descending:
+            query = query.filter(or_(timestamp_column < timestamp,
+                                     and_(timestamp_column == timestamp, id_column < row_id)))
+        else:
+            query = query.filter(or_(timestamp_column > timestamp,
+                                     and_(timestamp_column == timestamp, id_column > row_id)))
+    if descending:
+        query = query.order_by(timestamp_column.desc(), id_column.desc())
+    else:
+        query = query.order_by(timestamp_column.asc(), id_column.asc())
+
+    if offset and not cursor:
+        query = query.offset(offset)
+    rows = query.limit(per_page + 1).all()
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, timestamp_column.key), getattr(last, id_column.key))
+    return KeysetPage(rows, next_cursor)
+
+
+# Totals are cached per (statement, parameters, generation of the tables
+# involved). A commit touching a model bumps its generation, so stale
+# entries simply stop being looked up and age out of the LRU.
+count_cache = LRUCache(maxsize=512)
+_generations = defaultdict(int)
+
+
+def init_app(app):
+    count_cache.ttl = app.config['COUNT_CACHE_TTL']
+
+
+@on_commit_of(db.Model)
+def _bump_generations(changed):
+    for model in changed:
+        _generations[model.__name__] += 1
+
+
+def cached_count(query, models, approximate=False, cap=1000):
+    # -> Count(total, exact). approximate=True stops counting past cap
+    # rows, which bounds the cost for huge result sets; a larger result
+    # comes back as Count(cap, exact=False), i.e. "more than cap".
+    query = query.order_by(None)
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    key = (str(compiled), repr(sorted(compiled.params.items())), approximate and cap,
+           tuple(_generations[model.__name__] for model in models))
+    count = count_cache.get(key)
+    if count is None:
+        if approximate:
+            total = db.session.query(func.count()).select_from(query.limit(cap + 1).subquery()).scalar()
+            count = Count(min(total, cap), total <= cap)
+        else:
+            count = Count(query.count(), True)
+        count_cache.set(key, count)
+    return count
+
+
+class Pagination(flask_paginate.Pagination):
+    # The link to the following page carries a keyset cursor, so paging
+    # forward never needs an OFFSET; numbered jumps still use ?page=N and
+    # an OFFSET, so a deep numbered page costs what it always did.
+    # With exact=False the total is a lower bound: the numbered links
+    # stop at the pages it covers and the next link keeps going.
+    def __init__(self, next_cursor=None, exact=True, **kwargs):
+        self.next_cursor = next_cursor
+        self.exact = exact
+        if not exact:
+            kwargs.setdefault('display_msg', 'displaying <b>{start} - {end}</b> {record_name} '
+                                             'of more than <b>{total}</b>')
+        super().__init__(**kwargs)
+        if next_cursor:
+            self.has_next = True
+
+    def init_values(self):
+        super().init_values()
+        if not self.exact:
+            self.total_pages = max(self.total_pages, self.page)
+        self.args.pop('cursor', None)
+
+    def page_href(self, page):
+        # Builds each link from a copy of the request args, so the cursor
+        # for the next page never leaks into the other links
+        if self.href:
+            return super().page_href(page)
+        args = dict(self.args, **{self.page_parameter: page})
+        if self.next_cursor and page == self.page + 1:
+            args['cursor'] = self.next_cursor
+        if self.anchor:
+            return url_for(self.endpoint, _anchor=self.anchor, **args)
+        return url_for(self.endpoint, **args)
+
+
+def paginate(query, timestamp_column, id_column, models, per_page=10, descending=True, approximate=False):
+    # Reads page/per_page/cursor from the request -> (items, pagination)
+    page, per_page, offset = flask_paginate.get_page_args(
+        page_parameter='page', per_page_parameter='per_page', per_page=per_page)
+    count = cached_count(query, models, approximate=approximate)
+    try:
+        result = keyset_page(query, timestamp_column, id_column, cursor=request.args.get('cursor'),
+                             per_page=per_page, descending=descending, offset=offset)
+    except InvalidCursor:
+        abort(400)
+    pagination = Pagination(page=page, per_page=per_page, total=count.total, exact=count.exact,
+                            next_cursor=result.next_cursor, css_framework='bootstrap4')
+    return result.items, pagination
@@ -0,0 +1,141 @@
+# queryplans.py
+# 'flask check-query-plans' requests the hot pages through the test
+# client, records every SELECT they run and asks SQLite for its plan.
+# A plain "SCAN <table>" (no index) of anything but a tiny lookup table
+# fails the check, so a dropped index or a filter rewritten into a
+# non-sargable form shows up before it reaches production. Run it
+# against a database at the current migration with some rows in it;
+# tests/test_query_plans.py runs the same check on a small seeded schema.
+
+import re
+import sys
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import event, select, func
+from app import db
+from app.models import Role, Post, Car, user_roles
+
+# Lookup tables small enough that scanning them is the best plan
+FULL_SCAN_ALLOWED = {'role'}
+
+# (who, url); {post}, {mechanic} and {car} are filled from the database
+ROUTES = [
+    (None, '/'),
+    (None, '/posts'),
+    (None, '/post/{post}'),
+    (None, '/post/{post}/comments'),
+    (None, '/mechanic/{mechanic}'),
+    ('mechanic', '/mechanic_dashboard'),
+    ('mechanic', '/mechanic_dashboard?page=2'),
+    ('mechanic', '/mechanic_dashboard?search=CA1'),
+    ('mechanic', '/car/{car}'),
+    ('mechanic', '/car/{car}?search=01.2024'),
+    ('admin', '/admin_cars'),
+    ('admin', '/admin_cars?visibility=true&mechanic_id={mechanic}'),
+    ('admin', '/admin_cars?owner=0005'),
+    ('admin', '/admin_users'),
+    ('admin', '/edit_user/{mechanic}'),
+]
+
+_SCAN = re.compile(r'^SCAN (\w+)(?: AS (\w+))?$')
+_ALIAS = re.compile(r'"?(\w+)"? AS "?(\w+)"?')
+
+
+def _user_with_role(name):
+    return db.session.scalar(select(user_roles.c.user_id).join(Role, Role.id == user_roles.c.role_id)
+                             .where(Role.name == name).limit(1))
+
+
+def _route_arguments():
+    return {
+        'post': db.session.scalar(select(func.max(Post.id))) or 1,
+        'mechanic': _user_with_role('mechanic') or 1,
+        'car': db.session.scalar(select(func.max(Car.id))) or 1,
+    }
+
+
+def full_scans(connection, statement, parameters):
+    # -> plan lines of statement that read a whole table
+    tables = {name: name for name in db.metadata.tables}
+    tables.update((alias, table) for table, alias in _ALIAS.findall(statement) if table in db.metadata.tables)
+    scans = []
+    for row in connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters):
+        match = _SCAN.match(row[-1])
+        if match and tables.get(match.group(2) or match.group(1)) not in (None, *FULL_SCAN_ALLOWED):
+            scans.append(row[-1])
+    return scans
+
+
+def init_app(app):
+    app.cli.add_command(check_query_plans)
+
+
+def _clients(app):
+    clients = {None: app.test_client()}
+    for who in ('mechanic', 'admin'):
+        user_id = _user_with_role(who)
+        if user_id is None:
+            continue
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+        clients[who] = client
+    return clients
+
+
+def check_routes(routes=ROUTES):
+    # Yields (who, url, status or None when there is no such user, number
+    # of SELECTs, [(statement, full scans)]) for each route
+    app = current_app._get_current_object()
+    arguments = _route_arguments()
+    clients = _clients(app)
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        for who, url in routes:
+            url = url.format(**arguments)
+            if who not in clients:
+                yield who, url, None, 0, []
+                continue
+            statements.clear()
+            # A fresh app context per request, as in production; the CLI's
+            # own context would carry g (and the logged in user) across
+            with app.app_context():
+                status = clients[who].get(url).status_code
+            recorded = list(statements)
+            with db.engine.connect() as connection:
+                problems = [(statement, scans) for statement, parameters in recorded
+                            for scans in [full_scans(connection, statement, parameters)] if scans]
+            yield who, url, status, len(recorded), problems
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+
+@click.command('check-query-plans')
+@with_appcontext
+def check_query_plans():
+    """Fail if a hot page runs a query that scans a whole table (SQLite only)."""
+    if db.engine.dialect.name != 'sqlite':
+        click.echo('check-query-plans needs an SQLite database')
+        sys.exit(2)
+
+    failures = 0
+    for who, url, status, queries, problems in check_routes():
+        if status is None:
+            click.echo(f'skip  {url} (no {who} user)')
+            continue
+        click.echo(f'{"FAIL" if problems else "ok":5} {url} ({status}, {queries} queries)')
+        for statement, scans in problems:
+            failures += 1
+            click.echo(f'    {"; ".join(scans)}\n    {" ".join(statement.split())}')
+
+    if failures:
+        click.echo(f'{failures} queries scan whole tables')
+        sys.exit(1)
@@ -1,57 +1,44 @@
-from flask import render_template, url_for, flash, redirect, request
+from flask import Blueprint, render_template, url_for, flash, redirect, request, Response, stream_with_context
 from flask_login import login_user, current_user, logout_user, login_required
-from app import app, bcrypt, db
+from app import bcrypt, db
 from app.forms import   MechanicProfileForm, AdminCreateUserForm, AdminEditUserForm, UpdateAccountForm, EditCarForm 
-from app.models import User, Car, Role, RepairShopImage
-from flask_paginate import Pagination, get_page_args
+from app.models import User, Car, CarOwner, Role, RepairShopImage, user_cache
+from sqlalchemy.orm import selectinload, joinedload
+from app.pagination import paginate
+from app.directory import mechanic_directory
+from app.normalize import normalize_phone_number, phone_range
+import csv
+import io
+import json
 import os
-import secrets
-from PIL import Image
+import threading
 from flask import current_app, session
+from app.images import save_picture
+from app.instrumentation import query_budget
+from app.metrics import external_call
 
 
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+bp = Blueprint('admin', __name__)
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-
-def save_picture(form_picture, folder='profile_pics'):
-    if not allowed_file(form_picture.filename):
-        raise ValueError("Unsupported file type. Please upload a .jpg, .jpeg, or .png file.")
-
-    random_hex = secrets.token_hex(8)
-    _, f_ext = os.path.splitext(form_picture.filename)
-    picture_fn = random_hex + f_ext
-    picture_path = os.path.join(current_app.root_path, 'static', folder, picture_fn)
-
-    output_size = (500, 500)
-    i = Image.open(form_picture)
-    i.thumbnail(output_size)
-    i.save(picture_path)
-
-    return picture_fn
-
-
-
-@app.route("/create_user", methods=['GET', 'POST'])
+@bp.route("/create_user", methods=['GET', 'POST'])
 @login_required
 def create_user():
     if not current_user.is_admin():
         flash('Достъп отказан!', 'danger')
-        return redirect(url_for('home'))
+        return redirect(url_for('public.home'))
 
     form = AdminCreateUserForm()
     form.role.choices = [(role.id, role.name) for role in Role.query.all()]
 
     if form.validate_on_submit():
-        app.logger.info('Form validated successfully')
+        current_app.logger.info('Form validated successfully')
         try:
             # Check if the phone number is already registered
             user = User.query.filter_by(phone_number=form.phone_number.data).first()
             if user:
                 flash(f'Потребител с телефонен номер: {form.phone_number.data} е вече регистриран.', 'danger')
-                return redirect(url_for('create_user'))
+                return redirect(url_for('admin.create_user'))
 
             # Hash the password
             hashed_password = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
@@ -68,24 +55,24 @@ def create_user():
             
             db.session.commit()
             flash(f'User {form.username.data} регистриран успешно!', 'success')
-            app.logger.info(f'{current_user.username} created user {user.phone_number}')
-            return redirect(url_for('admin_users'))
+            current_app.logger.info(f'{current_user.username} created user {user.phone_number}')
+            return redirect(url_for('admin.admin_users'))
         except Exception as e:
             db.session.rollback()
-            app.logger.error(f'Error creating user: {str(e)}')
+            current_app.logger.error(f'Error creating user: {str(e)}')
             flash('Възникна грешка при създаването на потребителя. Моля, опитайте отново.', 'danger')
     
     if form.errors:
-        app.logger.info(f'Form errors: {form.errors}')
+        current_app.logger.info(f'Form errors: {form.errors}')
     
     return render_template('admin/create_user.html', form=form)
 
-@app.route("/search_users", methods=['GET'])
+@bp.route("/search_users", methods=['GET'])
 @login_required
 def search_users():
     if not current_user.is_admin():
         flash('Достъп отказан!', 'danger')
-        return redirect(url_for('home'))
+        return redirect(url_for('public.home'))
     
     query = request.args.get('query')
     if query:
@@ -96,12 +83,12 @@ def search_users():
     form = AdminCreateUserForm()
     return render_template('admin/admin_users.html', form=form, users=users)
 
-@app.route("/edit_user/<int:user_id>", methods=['GET', 'POST'])
+@bp.route("/edit_user/<int:user_id>", methods=['GET', 'POST'])
 @login_required
 def edit_user(user_id):
     if not current_user.is_admin():
         flash('Достъп отказан!', 'danger')
-        return redirect(url_for('home'))
+        return redirect(url_for('public.home'))
     
     user = User.query.get_or_404(user_id)
     form = AdminEditUserForm(original_username=user.username, original_email=user.email, original_phone_number=user.phone_number)
@@ -130,9 +117,10 @@ def edit_user(user_id):
             user.roles.append(new_role)
 
         db.session.commit()
-        app.logger.info(f'{current_user.username} updated user {user.phone_number}')
+        user_cache.invalidate(user.id)
+        current_app.logger.info(f'{current_user.username} updated user {user.phone_number}')
         flash(f'User {user.username} редактиран успешно!', 'success')
-        return redirect(url_for('admin_users'))
+        return redirect(url_for('admin.admin_users'))
     elif request.method == 'GET':
         form.username.data = user.username
         form.email.data = user.email
@@ -146,12 +134,12 @@ def edit_user(user_id):
 
 
 
-@app.route("/delete_user/<int:user_id>", methods=['POST'])
+@bp.route("/delete_user/<int:user_id>", methods=['POST'])
 @login_required
 def delete_user(user_id):
     if not current_user.is_admin():
         flash('Access denied!', 'danger')
-        return redirect(url_for('home'))
+        return redirect(url_for('public.home'))
 
     user = User.query.get_or_404(user_id)
 
@@ -160,7 +148,7 @@ def delete_user(user_id):
         new_mechanic = User.query.filter(User.roles.any(Role.name == 'mechanic'), User.id != user_id).first()
         if not new_mechanic:
             flash('No other mechanic found to reassign cars. Please create another mechanic first.', 'danger')
-            return redirect(url_for('admin_users'))
+            return redirect(url_for('admin.admin_users'))
 
         # Reassign all cars to the new mechanic
         cars = Car.query.filter_by(mechanic_id=user.id).all()
@@ -171,15 +159,35 @@ def delete_user(user_id):
 
     db.session.delete(user)
     db.session.commit()
+    user_cache.invalidate(user_id)
     flash(f'User {user.username} has been successfully deleted!', 'success')
-    return redirect(url_for('admin_users'))
-
-from app import oauth, google
+    return redirect(url_for('admin.admin_users'))
+
+_google_lock = threading.Lock()
+
+
+def google_client():
+    # authlib is only imported on the first sign-in, it is a good part of
+    # a worker's start-up otherwise
+    app = current_app._get_current_object()
+    with _google_lock:
+        if 'google' not in app.extensions:
+            from authlib.integrations.flask_client import OAuth
+            app.extensions['google'] = OAuth(app).register(
+                name='google',
+                client_id=app.config['GOOGLE_CLIENT_ID'],
+                client_secret=app.config['GOOGLE_CLIENT_SECRET'],
+                server_metadata_url=app.config['GOOGLE_DISCOVERY_URL'],
+                client_kwargs={
+                    'scope': 'openid email profile',
+                }
+            )
+    return app.extensions['google']
 
-# @app.route("/register", methods=['GET', 'POST'])
+# @bp.route("/register", methods=['GET', 'POST'])
 # def register():
 #     if current_user.is_authenticated:
-#         return redirect(url_for('home'))
+#         return redirect(url_for('public.home'))
     
 #     form = RegistrationForm()
 #     if form.validate_on_submit():
@@ -194,18 +202,19 @@ from app import oauth, google
 #             db.session.commit()
         
 #         flash(f'Регистрацията успешна за {form.username.data}!', 'success')
-#         app.logger.info(f'New user registered with {user.phone_number}')
-#         return redirect(url_for('login'))
+#         current_app.logger.info(f'New user registered with {user.phone_number}')
+#         return redirect(url_for('admin.login'))
         
 #     return render_template('admin/register.html', title='Register', form=form)
 
 
-@app.route('/login')
+@bp.route('/login')
 def login():
-    redirect_uri = url_for('auth_callback', _external=True)
+    redirect_uri = url_for('admin.auth_callback', _external=True)
     nonce = os.urandom(16).hex()
     session['nonce'] = nonce
-    return google.authorize_redirect(redirect_uri, nonce=nonce)
+    with external_call('oauth'):
+        return google_client().authorize_redirect(redirect_uri, nonce=nonce)
 
 def generate_unique_username(base_username):
     count = 1
@@ -216,15 +225,17 @@ def generate_unique_username(base_username):
     return new_username
 
 
-@app.route('/auth/callback')
+@bp.route('/auth/callback')
 def auth_callback():
-    token = google.authorize_access_token()
+    with external_call('oauth'):
+        token = google_client().authorize_access_token()
     nonce = session.pop('nonce', None)
     if not nonce:
         flash('Nonce not found in session.', 'danger')
-        return redirect(url_for('login'))
+        return redirect(url_for('admin.login'))
 
-    user_info = google.parse_id_token(token, nonce=nonce)
+    with external_call('oauth'):
+        user_info = google_client().parse_id_token(token, nonce=nonce)
     
     if user_info:
         user = User.query.filter_by(email=user_info['email']).first()
@@ -247,42 +258,43 @@ def auth_callback():
         
         login_user(user)
         if user.phone_number == '0000000000':
-            return redirect(url_for('update_phone_number'))
-        return redirect(url_for('home'))
+            return redirect(url_for('admin.update_phone_number'))
+        return redirect(url_for('public.home'))
     
     flash('Failed to authenticate with Google.', 'danger')
-    return redirect(url_for('login'))
+    return redirect(url_for('admin.login'))
 
-@app.route('/update_phone_number', methods=['GET', 'POST'])
+@bp.route('/update_phone_number', methods=['GET', 'POST'])
 @login_required
 def update_phone_number():
     if request.method == 'POST':
         phone_number = request.form.get('phone_number')
-        user = current_user
+        user = User.query.get_or_404(current_user.id)
         user.phone_number = phone_number
         db.session.commit()
+        user_cache.invalidate(user.id)
         flash('Your phone number has been updated!', 'success')
-        return redirect(url_for('home'))
+        return redirect(url_for('public.home'))
     
     return render_template('update_phone_number.html')
 
 
-@app.route("/admin_dashboard")
+@bp.route("/admin_dashboard")
 @login_required
 def admin_dashboard():
     if not current_user.is_admin():
         flash('Достъп отказан!', 'danger')
-        return redirect(url_for('home'))
+        return redirect(url_for('public.home'))
     return render_template('admin/admin_dashboard.html')
 
-@app.route('/admin_users', methods=['GET'])
+@bp.route('/admin_users', methods=['GET'])
 @login_required
+@query_budget(6)
 def admin_users():
     if not current_user.is_admin():
         flash('Access denied. Admins only!', 'danger')
-        return redirect(url_for('home'))
+        return redirect(url_for('public.home'))
 
-    page, per_page, offset = get_page_args(page_parameter='page', per_page_parameter='per_page', per_page=10)
     query = request.args.get('query')
 
     if query:
@@ -290,20 +302,18 @@ def admin_users():
     else:
         users_query = User.query
 
-    total = users_query.count()
-    users = users_query.offset(offset).limit(per_page).all()
-
-    pagination = Pagination(page=page, per_page=per_page, total=total, css_framework='bootstrap4')
+    users, pagination = paginate(users_query.options(selectinload(User.roles)), User.date_created, User.id,
+                                 models=[User], per_page=10, descending=False)
 
     return render_template('admin/admin_users.html', users=users, pagination=pagination)
 
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     logout_user()
-    return redirect(url_for('home'))
+    return redirect(url_for('public.home'))
 
-@app.route("/account", methods=['GET', 'POST'])
+@bp.route("/account", methods=['GET', 'POST'])
 @login_required
 def account():
     user = User.query.get_or_404(current_user.id)
@@ -323,8 +333,9 @@ def account():
                 hashed_password = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
                 user.password = hashed_password
             db.session.commit()
+            user_cache.invalidate(user.id)
             flash('Your account has been updated!', 'success')
-            return redirect(url_for('account'))
+            return redirect(url_for('admin.account'))
         except ValueError as e:
             flash(str(e), 'danger')
 
@@ -335,104 +346,162 @@ def account():
         form.biography.data = user.biography
         form.expertise.data = user.expertise
 
-    image_file = url_for('static', filename='profile_pics/' + current_user.image_file)
-    return render_template('admin/account.html', title='Account', form=form, image_file=image_file)
+    return render_template('admin/account.html', title='Account', form=form, image_file=user.image_file)
 
-@app.route("/restore_car_visibility/<int:car_id>", methods=["POST"])
+@bp.route("/restore_car_visibility/<int:car_id>", methods=["POST"])
 @login_required
 def restore_car_visibility(car_id):
     if not current_user.is_admin():
         flash('Достъп отказан!', 'danger')
-        return redirect(url_for('home'))
+        return redirect(url_for('public.home'))
 
     car = Car.query.get_or_404(car_id)
     car.visibility = True
     db.session.commit()
     flash(f'Car {car.registration_number} visibility restored successfully!', 'success')
-    return redirect(url_for('admin_cars'))
+    return redirect(url_for('admin.admin_cars'))
 
 
-@app.route('/admin_cars', methods=['GET', 'POST'])
+def mechanic_choices():
+    return [(mechanic.id, mechanic.username) for mechanic in mechanic_directory.get()]
+
+def filtered_cars_query():
+    # Filters shared by the admin car list and its export
+    query = Car.query
+    visibility = request.args.get('visibility')
+    if visibility:
+        query = query.filter(Car.visibility == (visibility == 'true'))
+    mechanic_id = request.args.get('mechanic_id', type=int)
+    if mechanic_id:
+        query = query.filter(Car.mechanic_id == mechanic_id)
+    owner = request.args.get('owner', '').strip()
+    if owner:
+        phone = normalize_phone_number(owner)
+        if phone and phone == owner.replace(' ', '').lstrip('+'):
+            owner_filter = phone_range(CarOwner.phone_search, CarOwner.phone_search_reversed, phone)
+        else:
+            owner_filter = CarOwner.name.ilike(f'%{owner}%')
+        query = query.filter(Car.owner_id.in_(db.session.query(CarOwner.id).filter(owner_filter)))
+    return query
+
+@bp.route('/admin_cars', methods=['GET', 'POST'])
 @login_required
+@query_budget(7)
 def admin_cars():
     form = EditCarForm()
-    form.mechanic_id.choices = [(mechanic.id, mechanic.username) for mechanic in User.query.filter(User.roles.any(Role.name == 'mechanic')).all()]
+    form.mechanic_id.choices = mechanic_choices()
 
-    visibility = request.args.get('visibility')
-    if visibility:
-        cars = Car.query.filter_by(visibility=(visibility == 'true')).all()
-    else:
-        cars = Car.query.all()
+    cars_query = filtered_cars_query().options(joinedload(Car.owner), joinedload(Car.mechanic))
+    cars, pagination = paginate(cars_query, Car.date_created, Car.id, models=[Car, CarOwner, User], per_page=25)
 
-    # Implement pagination if necessary
-    pagination = None  # Replace with actual pagination if used
+    return render_template('admin/admin_cars.html', cars=cars, pagination=pagination, form=form,
+                           mechanic_options=form.mechanic_id.choices)
 
-    return render_template('admin/admin_cars.html', cars=cars, pagination=pagination, form=form)
+EXPORT_COLUMNS = ['id', 'registration_number', 'vin_number', 'additional_info', 'date_created',
+                  'visibility', 'owner_name', 'owner_phone_number', 'mechanic']
 
-@app.route("/mechanic_profile/update", methods=['GET', 'POST'])
+@bp.route('/admin_cars/export.<any(csv, json):fmt>')
+@login_required
+def export_cars(fmt):
+    if not current_user.is_admin():
+        flash('Достъп отказан!', 'danger')
+        return redirect(url_for('public.home'))
+
+    # Plain column tuples streamed in batches; no ORM objects are built
+    rows = filtered_cars_query().outerjoin(Car.owner).outerjoin(Car.mechanic).with_entities(
+        Car.id, Car.registration_number, Car.vin_number, Car.additional_info, Car.date_created,
+        Car.visibility, CarOwner.name, CarOwner.phone_number, User.username
+    ).order_by(Car.id).execution_options(yield_per=500)
+
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        for row in rows:
+            writer.writerow(row)
+            if buffer.tell() > 65536:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    def generate_json():
+        yield '['
+        separator = ''
+        for row in rows:
+            record = dict(zip(EXPORT_COLUMNS, row))
+            record['date_created'] = record['date_created'].isoformat()
+            yield separator + json.dumps(record, ensure_ascii=False)
+            separator = ','
+        yield ']'
+
+    generate, mimetype = (generate_csv, 'text/csv') if fmt == 'csv' else (generate_json, 'application/json')
+    current_app.logger.info(f'{current_user.username} exported cars as {fmt}')
+    return Response(stream_with_context(generate()), content_type=f'{mimetype}; charset=utf-8',
+                    headers={'Content-Disposition': f'attachment; filename=cars.{fmt}'})
+
+@bp.route("/mechanic_profile/update", methods=['GET', 'POST'])
 @login_required
 def update_mechanic_profile():
     if not current_user.is_mechanic():
         flash('Достъп отказан. Само механици могат да актуализират профила си.', 'danger')
-        return redirect(url_for('home'))
+        return redirect(url_for('public.home'))
 
+    user = User.query.get_or_404(current_user.id)
     form = MechanicProfileForm()
     if form.validate_on_submit():
         try:
-            current_user.username = form.username.data
-            current_user.phone_number = form.phone_number.data
-            current_user.biography = form.biography.data
-            current_user.expertise = form.expertise.data
+            user.username = form.username.data
+            user.phone_number = form.phone_number.data
+            user.biography = form.biography.data
+            user.expertise = form.expertise.data
 
             if form.profile_picture.data:
                 picture_file = save_picture(form.profile_picture.data, folder='profile_pics')
-                current_user.image_file = picture_file
+                user.image_file = picture_file
 
             if form.repair_shop_pictures.data:
                 for picture in request.files.getlist(form.repair_shop_pictures.name):
                     picture_file = save_picture(picture, folder='repair_shop_pics')
-                    repair_shop_image = RepairShopImage(image_file=picture_file, user_id=current_user.id)
+                    repair_shop_image = RepairShopImage(image_file=picture_file, user_id=user.id)
                     db.session.add(repair_shop_image)
 
             db.session.commit()
+            user_cache.invalidate(user.id)
             flash('Профилът ви е актуализиран!', 'success')
-            return redirect(url_for('mechanic_profile', mechanic_id=current_user.id))
+            return redirect(url_for('mechanic.mechanic_profile', mechanic_id=user.id))
         except ValueError as e:
             flash(str(e), 'danger')
 
     elif request.method == 'GET':
-        form.username.data = current_user.username
-        form.phone_number.data = current_user.phone_number
-        form.biography.data = current_user.biography
-        form.expertise.data = current_user.expertise
+        form.username.data = user.username
+        form.phone_number.data = user.phone_number
+        form.biography.data = user.biography
+        form.expertise.data = user.expertise
 
     return render_template('public/update_mechanic_profile.html', title='Актуализиране на профила', form=form)
 
-@app.route('/delete_repair_shop_image_admin/<int:image_id>', methods=['POST'])
+@bp.route('/delete_repair_shop_image_admin/<int:image_id>', methods=['POST'])
 @login_required
 def delete_repair_shop_image_admin(image_id):
     if not current_user.is_admin():
         flash('You do not have permission to delete this image.', 'danger')
-        return redirect(url_for('admin_dashboard'))
+        return redirect(url_for('admin.admin_dashboard'))
     
     image = RepairShopImage.query.get_or_404(image_id)
-    
-    # Delete the image file from the filesystem
-    picture_path = os.path.join(current_app.root_path, 'static/repair_shop_pics', image.image_file)
-    if os.path.exists(picture_path):
-        os.remove(picture_path)
 
+    # The file is removed after commit once no other row references it
     db.session.delete(image)
     db.session.commit()
     flash('Image has been deleted!', 'success')
-    return redirect(url_for('edit_user', user_id=image.user_id))
+    return redirect(url_for('admin.edit_user', user_id=image.user_id))
 
-@app.route('/admin_update_car/<int:car_id>', methods=['GET', 'POST'])
+@bp.route('/admin_update_car/<int:car_id>', methods=['GET', 'POST'])
 @login_required
 def admin_update_car(car_id):
     car = Car.query.get_or_404(car_id)
     form = EditCarForm()
-    form.mechanic_id.choices = [(mechanic.id, mechanic.username) for mechanic in User.query.filter(User.roles.any(Role.name == 'mechanic')).all()]
+    form.mechanic_id.choices = mechanic_choices()
     
     if form.validate_on_submit():
         car.registration_number = form.registration_number.data
@@ -443,7 +512,7 @@ def admin_update_car(car_id):
         car.mechanic_id = form.mechanic_id.data
         db.session.commit()
         flash('Car and owner details updated successfully!', 'success')
-        return redirect(url_for('admin_cars'))
+        return redirect(url_for('admin.admin_cars'))
     elif request.method == 'GET':
         form.registration_number.data = car.registration_number
         form.vin_number.data = car.vin_number
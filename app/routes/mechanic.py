@@ -1,22 +1,39 @@
 # mechanic.py
-from flask import render_template, url_for, flash, redirect, request, jsonify
+from flask import Blueprint, render_template, url_for, flash, redirect, request, jsonify, Response, stream_with_context, current_app
 from flask_login import current_user, login_required
+from sqlalchemy import false
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+from werkzeug.exceptions import RequestEntityTooLarge
 from datetime import datetime
-from flask_paginate import Pagination, get_page_args
-from app import app, db
+from app.pagination import paginate
+from app import db, body_limit
 from app.forms import CreateCarForm, CreateVisitForm, UpdateCarForm
 from app.models import Car, CarOwner, CarVisit, User, RepairShopImage
-from google.cloud import speech
+from app.visits import visit_query, parse_date_input
+from app.normalize import normalize_registration_number, normalize_phone_number, prefix_range, phone_range
+from app.audio import UploadError, create_upload, received_bytes, append_chunk, upload_path, uploads_dir
+from app.transcription import TranscriptionBusy, submit, read_job
+from app.conditional import conditional
+from app.instrumentation import query_budget
+import json
 import os
+import secrets
+import time
 
+# Milliseconds the browser waits before reconnecting to a job stream
+SSE_RETRY_MS = 1000
 
-@app.route("/create_car", methods=["POST", "GET"])
+
+bp = Blueprint('mechanic', __name__)
+
+
+@bp.route("/create_car", methods=["POST", "GET"])
 @login_required
 def create_car():
     if not current_user.is_mechanic():
         flash('Достъп отказан. Тук се допускат само механици!', 'danger')
-        return redirect(url_for('home'))
+        return redirect(url_for('public.home'))
 
     form = CreateCarForm()
     if form.validate_on_submit():
@@ -31,7 +48,7 @@ def create_car():
             if car:
                 if car.visibility:
                     flash('This car already exists in your fleet. Redirecting to create a visit.', 'info')
-                    return redirect(url_for('create_visit', car_id=car.id))
+                    return redirect(url_for('mechanic.create_visit', car_id=car.id))
                 else:
                     car.visibility = True
                     car.vin_number = form.vin_number.data.upper()
@@ -39,7 +56,7 @@ def create_car():
                     car.owner_id = owner.id
                     db.session.commit()
                     flash('Car restored successfully!', 'success')
-                    return redirect(url_for('mechanic_dashboard'))
+                    return redirect(url_for('mechanic.mechanic_dashboard'))
             else:
                 new_car = Car(
                     registration_number=form.registration_number.data.upper(),
@@ -51,75 +68,84 @@ def create_car():
                 db.session.add(new_car)
                 db.session.commit()
                 flash('Car added successfully!', 'success')
-                return redirect(url_for('mechanic_dashboard'))
+                return redirect(url_for('mechanic.mechanic_dashboard'))
         except IntegrityError:
             db.session.rollback()
             flash('An unexpected error occurred. Please try again.', 'danger')
 
     return render_template('mechanic/create_car.html', form=form)
 
-@app.route('/car/<int:car_id>', methods=['GET'])
+@bp.route('/car/<int:car_id>', methods=['GET'])
 @login_required
+@query_budget(7)
 def car_detail(car_id):
     car = Car.query.get_or_404(car_id)
-    page, per_page, offset = get_page_args(page_parameter='page', per_page_parameter='per_page', per_page=5)
 
     search_query = request.args.get('search', '').strip()
-
-    visits_query = CarVisit.query.filter_by(car_id=car_id)
-
-    if search_query:
-        visits_query = visits_query.filter(
-            (CarVisit.description.ilike(f'%{search_query}%')) |
-            (CarVisit.date.like(f'%{search_query}%'))
-        )
-
-    total = visits_query.count()
-    visits = visits_query.offset(offset).limit(per_page).all()
-    
-    pagination = Pagination(page=page, per_page=per_page, total=total, css_framework='bootstrap4')
-
-    return render_template('mechanic/car_detail.html', car=car, visits=visits, pagination=pagination, search_query=search_query)
-
-@app.route('/mechanic_dashboard', methods=['GET', 'POST'])
+    date_from = parse_date_input(request.args.get('date_from'))
+    date_to = parse_date_input(request.args.get('date_to'))
+
+    visits_query = visit_query(car_id, search_query, date_from=date_from, date_to=date_to)
+    visits, pagination = paginate(visits_query, CarVisit.date, CarVisit.id, models=[CarVisit], per_page=5)
+
+    return render_template('mechanic/car_detail.html', car=car, visits=visits, pagination=pagination, search_query=search_query,
+                           date_from=request.args.get('date_from', ''), date_to=request.args.get('date_to', ''))
+
+def matching_car_ids(mechanic_id, search_query):
+    # Prefix match on the normalized registration number, prefix or suffix
+    # match on the owner phone.
+    # Each branch is an index range scan; the union replaces an OR across
+    # two tables that could use neither index.
+    branches = []
+    registration = normalize_registration_number(search_query)
+    if registration:
+        branches.append(db.session.query(Car.id).filter(
+            Car.mechanic_id == mechanic_id,
+            prefix_range(Car.registration_search, registration)
+        ))
+    phone = normalize_phone_number(search_query)
+    if phone:
+        owner_ids = db.session.query(CarOwner.id).filter(
+            phone_range(CarOwner.phone_search, CarOwner.phone_search_reversed, phone))
+        branches.append(db.session.query(Car.id).filter(
+            Car.owner_id.in_(owner_ids),
+            Car.mechanic_id == mechanic_id
+        ))
+    if not branches:
+        return db.session.query(Car.id).filter(false())
+    return branches[0].union(*branches[1:])
+
+@bp.route('/mechanic_dashboard', methods=['GET', 'POST'])
 @login_required
+@query_budget(7)
 def mechanic_dashboard():
     search_query = request.args.get('search', '').strip()
-    page, per_page, offset = get_page_args(page_parameter='page', per_page_parameter='per_page', per_page=10)
     mechanic_id = current_user.id
 
+    cars_query = Car.query.filter_by(mechanic_id=mechanic_id, visibility=True)
     if search_query:
-        cars_query = Car.query.filter(
-            (Car.mechanic_id == mechanic_id) &
-            (Car.visibility == True) &
-            ((Car.registration_number.contains(search_query)) |
-             (Car.owner.has(CarOwner.phone_number.contains(search_query))))
-        )
-    else:
-        cars_query = Car.query.filter_by(mechanic_id=mechanic_id, visibility=True)
-
-    total = cars_query.count()
-    cars = cars_query.offset(offset).limit(per_page).all()
-    
-    pagination = Pagination(page=page, per_page=per_page, total=total, css_framework='bootstrap4')
+        cars_query = cars_query.filter(Car.id.in_(matching_car_ids(mechanic_id, search_query)))
+
+    cars, pagination = paginate(cars_query.options(joinedload(Car.owner)), Car.date_created, Car.id,
+                                models=[Car, CarOwner], per_page=10, approximate=bool(search_query))
 
     return render_template('mechanic/mechanic_dashboard.html', cars=cars, pagination=pagination)
 
-@app.route("/delete_car/<int:car_id>", methods=["POST"])
+@bp.route("/delete_car/<int:car_id>", methods=["POST"])
 @login_required
 def delete_car(car_id):
     car = Car.query.get_or_404(car_id)
 
     if car.mechanic_id != current_user.id:
         flash('You do not have permission to delete this car.', 'danger')
-        return redirect(url_for('mechanic_dashboard'))
+        return redirect(url_for('mechanic.mechanic_dashboard'))
 
     car.visibility = False
     db.session.commit()
     flash('Car deleted successfully!', 'success')
-    return redirect(url_for('mechanic_dashboard'))
+    return redirect(url_for('mechanic.mechanic_dashboard'))
 
-@app.route("/update_car/<int:car_id>", methods=['GET', 'POST'])
+@bp.route("/update_car/<int:car_id>", methods=['GET', 'POST'])
 @login_required
 def update_car(car_id):
     car = Car.query.get_or_404(car_id)
@@ -130,9 +156,9 @@ def update_car(car_id):
         car.additional_info = form.additional_info.data
         db.session.commit()
         flash('Car details updated successfully!', 'success')
-        app.logger.info(f'{current_user.username} updated car {car.registration_number}')
+        current_app.logger.info(f'{current_user.username} updated car {car.registration_number}')
 
-        return redirect(url_for('mechanic_dashboard'))
+        return redirect(url_for('mechanic.mechanic_dashboard'))
     
     elif request.method == 'GET':
         form.vin_number.data = car.vin_number
@@ -140,13 +166,13 @@ def update_car(car_id):
     
     return render_template('mechanic/update_car.html', form=form, car=car)
 
-@app.route("/create_visit/<int:car_id>", methods=["POST", "GET"])
+@bp.route("/create_visit/<int:car_id>", methods=["POST", "GET"])
 @login_required
 def create_visit(car_id):
     car = Car.query.get_or_404(car_id)
     if car.mechanic_id != current_user.id:
         flash('Access denied. You do not have permission to add a visit to this car.', 'danger')
-        return redirect(url_for('home'))
+        return redirect(url_for('public.home'))
 
     form = CreateVisitForm()
     if form.validate_on_submit():
@@ -154,53 +180,146 @@ def create_visit(car_id):
         db.session.add(visit)
         db.session.commit()
         flash('Visit added successfully!', 'success')
-        app.logger.info(f'{current_user.username} created visit for car {car.registration_number}')
+        current_app.logger.info(f'{current_user.username} created visit for car {car.registration_number}')
 
-        return redirect(url_for('car_detail', car_id=car.id))
+        return redirect(url_for('mechanic.car_detail', car_id=car.id))
 
     return render_template('mechanic/create_visit.html', form=form, car=car)
 
-@app.route("/mechanic/<int:mechanic_id>")
+@bp.route("/mechanic/<int:mechanic_id>")
+@conditional('user', 'user:{mechanic_id}')
+@query_budget(6)
 def mechanic_profile(mechanic_id):
     mechanic = User.query.get_or_404(mechanic_id)
     if not mechanic.is_mechanic():
         flash('This user is not a mechanic.', 'danger')
-        return redirect(url_for('home'))
+        return redirect(url_for('public.home'))
     repair_shop_images = RepairShopImage.query.filter_by(user_id=mechanic.id).all()
     return render_template('public/mechanic_profile.html', mechanic=mechanic, repair_shop_images=repair_shop_images)
 
-@app.route('/speech_to_text', methods=['POST'])
+def _upload_error(e):
+    body = {"error": str(e)}
+    if e.received is not None:
+        body["received"] = e.received
+    return jsonify(body), e.status
+
+@bp.route('/speech_to_text/uploads', methods=['POST'])
 @login_required
-def speech_to_text():
+def create_audio_upload():
     if not current_user.is_mechanic():
         return jsonify({"error": "Access denied"}), 403
+    return jsonify({
+        "upload_id": create_upload(current_user.id),
+        "chunk_size": current_app.config['SPEECH_UPLOAD_CHUNK_BYTES'],
+        "max_bytes": current_app.config['SPEECH_MAX_UPLOAD_BYTES'],
+    }), 201
 
-    if 'audio' not in request.files or 'channels' not in request.form:
-        return jsonify({"error": "No audio file or channel count provided"}), 400
-
-    audio_file = request.files['audio']
-    audio_content = audio_file.read()
-    channels = int(request.form['channels'])
-
-    credentials_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
-    if not credentials_path:
-        return jsonify({"error": "Google application credentials not set"}), 500
-
-    client = speech.SpeechClient.from_service_account_file(credentials_path)
-
-    audio = speech.RecognitionAudio(content=audio_content)
-    config = speech.RecognitionConfig(
-        encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
-        language_code="bg-BG",
-        audio_channel_count=channels,
-        sample_rate_hertz=48000,
-    )
+@bp.route('/speech_to_text/uploads/<upload_id>', methods=['GET', 'PUT'])
+@login_required
+def audio_upload(upload_id):
+    # GET reports how much arrived, PUT ?offset=N appends the request body
+    if not current_user.is_mechanic():
+        return jsonify({"error": "Access denied"}), 403
+    try:
+        if request.method == 'GET':
+            return jsonify({"received": received_bytes(current_user.id, upload_id)})
+        offset = request.args.get('offset', type=int)
+        if offset is None:
+            return jsonify({"error": "offset required"}), 400
+        received = append_chunk(current_user.id, upload_id, offset, request.stream, request.content_length)
+        return jsonify({"received": received})
+    except UploadError as e:
+        return _upload_error(e)
+
+@bp.route('/speech_to_text', methods=['POST'])
+@login_required
+@body_limit('SPEECH_MAX_UPLOAD_BYTES')
+def speech_to_text():
+    # Queues a transcription job for a finished chunked upload (or a
+    # single multipart 'audio' file). Audio transcribed before with the
+    # same settings is answered from the stored result.
+    if not current_user.is_mechanic():
+        return jsonify({"error": "Access denied"}), 403
 
     try:
-        response = client.recognize(config=config, audio=audio)
-        transcript = ""
-        for result in response.results:
-            transcript += result.alternatives[0].transcript + " "
-        return jsonify({"transcript": transcript.strip()}), 200
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        upload_id = request.form.get('upload_id')
+        has_audio = 'audio' in request.files
+    except RequestEntityTooLarge:
+        return jsonify({"error": "Recording too long"}), 413
+    try:
+        if upload_id:
+            audio_path = upload_path(current_user.id, upload_id)
+            if not os.path.exists(audio_path):
+                return jsonify({"error": "Unknown upload"}), 404
+        elif has_audio:
+            audio_path = os.path.join(uploads_dir(), f'{current_user.id}-{secrets.token_urlsafe(16)}.part')
+            request.files['audio'].save(audio_path)
+        else:
+            return jsonify({"error": "No audio file provided"}), 400
+        job_id, job = submit(audio_path)
+    except UploadError as e:
+        return _upload_error(e)
+    except TranscriptionBusy:
+        return jsonify({"error": "Too many transcriptions in progress, try again shortly"}), 503
+
+    body = {"job_id": job_id, "status": job['status'], "poll": url_for('mechanic.transcription_job', job_id=job_id)}
+    if job['status'] == 'done':
+        return jsonify(dict(body, transcript=job['transcript'])), 200
+    return jsonify(body), 202
+
+@bp.route('/speech_to_text/jobs/<job_id>', methods=['GET'])
+@login_required
+def transcription_job(job_id):
+    # JSON status for polling, or server-sent events with partial
+    # transcripts until the job finishes
+    if not current_user.is_mechanic():
+        return jsonify({"error": "Access denied"}), 403
+    job = read_job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+
+    if request.accept_mimetypes.best != 'text/event-stream':
+        return jsonify(job)
+
+    def event(name, event_id=None, **data):
+        head = f'id: {event_id}\n' if event_id is not None else ''
+        return f'{head}event: {name}\ndata: {json.dumps(data)}\n\n'
+
+    # Each connection streams for at most SPEECH_STREAM_WINDOW seconds, so a
+    # long job does not hold a request thread; the browser reconnects after
+    # `retry` with the last event id (the job's update time) and gets only
+    # what changed since
+    last_id = request.headers.get('Last-Event-ID')
+
+    def events():
+        nonlocal last_id
+        yield f'retry: {SSE_RETRY_MS}\n\n'
+        window_end = time.monotonic() + current_app.config['SPEECH_STREAM_WINDOW']
+        current = job
+        while current is not None:
+            event_id = repr(current.get('updated'))
+            if current['status'] == 'done':
+                if event_id != last_id:
+                    yield event('final', event_id, transcript=current['transcript'])
+                yield event('done', event_id)
+                return
+            if current['status'] == 'error':
+                yield event('error', error=current['error'])
+                return
+            if time.time() - current.get('updated', 0) > current_app.config['SPEECH_JOB_TIMEOUT']:
+                break
+            if event_id != last_id:
+                text = ' '.join(filter(None, [current['transcript'], current['partial']]))
+                yield event('partial', event_id, transcript=text)
+                last_id = event_id
+            if time.monotonic() >= window_end:
+                return
+            time.sleep(0.25)
+            current = read_job(job_id)
+        yield event('error', error="Transcription timed out")
+
+    # The stream only reads job files; give the session's connection back
+    # instead of holding it (and its transaction) for the whole window
+    db.session.close()
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
@@ -1,37 +1,53 @@
 # public.py
 
-from flask import render_template, url_for, flash, redirect, request, jsonify
+from flask import Blueprint, render_template, url_for, flash, redirect, request, jsonify, abort, send_file, current_app
 from flask_login import current_user, login_required
-from app import app, db
+from app import db
 from app.forms import PostForm, CommentForm
-from app.models import Post, Comment, Car, User, Role, RepairShopImage
+from app.models import Post, Comment
+from app.feed import latest_posts, posts_page, comments_page
+from app.pagination import InvalidCursor
+from app.directory import LazyMechanics
+from app.search import search_posts, search_comments, search_mechanics
+from app.images import thumbnail, thumbnail_etag, immutable
+from app.conditional import conditional
+from app.instrumentation import query_budget
 
-@app.context_processor
+bp = Blueprint('public', __name__)
+
+
+@bp.app_context_processor
 def inject_mechanics():
-    mechanics = User.query.filter(User.roles.any(Role.name == 'mechanic')).all()
-    return dict(mechanics=mechanics)
+    return dict(mechanics=LazyMechanics())
 
-@app.route("/")
-@app.route("/home")
+@bp.route("/")
+@bp.route("/home")
+@conditional('post', 'comment', 'user')
+@query_budget(8)
 def home():
-    posts = Post.query.order_by(Post.date_posted.desc()).limit(5).all()
+    posts = latest_posts(limit=5)
     form = PostForm()
     return render_template('public/home.html', posts=posts, form=form)
 
-@app.route("/about")
+@bp.route("/about")
 def about():
     return render_template('public/about.html', title='About')
 
-# @app.route("/garage")
+# @bp.route("/garage")
 # def garage():
 #     return render_template('mechanic/garage.html', title='Garage', cars=Car.query.all())
 
-@app.route("/posts")
+@bp.route("/posts")
+@conditional('post', 'comment', 'user')
+@query_budget(5)
 def posts():
-    all_posts = Post.query.order_by(Post.date_posted.desc()).all()
-    return render_template('posts.html', posts=all_posts)
+    try:
+        page = posts_page(cursor=request.args.get('cursor'))
+    except InvalidCursor:
+        abort(400)
+    return render_template('posts.html', posts=page.items, next_cursor=page.next_cursor)
 
-@app.route("/post/new", methods=['POST'])
+@bp.route("/post/new", methods=['POST'])
 @login_required
 def new_post():
     form = PostForm()
@@ -40,10 +56,12 @@ def new_post():
         db.session.add(post)
         db.session.commit()
         flash('Поста е създаден успешно', 'success')
-        return redirect(url_for('home'))
+        return redirect(url_for('public.home'))
     return render_template('create_post.html', title='New Post', form=form, legend='New Post')
 
-@app.route("/post/<int:post_id>", methods=['GET', 'POST'])
+@bp.route("/post/<int:post_id>", methods=['GET', 'POST'])
+@conditional('post:{post_id}', 'user')
+@query_budget(6)
 def post(post_id):
     post = Post.query.get_or_404(post_id)
     form = CommentForm()
@@ -53,114 +71,135 @@ def post(post_id):
             db.session.add(comment)
             db.session.commit()
             flash('Your comment has been added!', 'success')
-            return redirect(url_for('post', post_id=post.id))
+            return redirect(url_for('public.post', post_id=post.id))
         else:
             flash('Само механици могат да отговарят на запитвания.', 'danger')
-    comments = Comment.query.filter_by(post_id=post.id).all()
-    return render_template('post.html', post=post, form=form, comments=comments)
+    page = comments_page(post.id)
+    return render_template('post.html', post=post, form=form, comments=page.items, next_cursor=page.next_cursor)
 
-@app.route("/post/<int:post_id>/comments", methods=['GET'])
+@bp.route("/post/<int:post_id>/comments", methods=['GET'])
+@conditional('post:{post_id}', 'user')
+@query_budget(5)
 def get_post_comments(post_id):
     post = Post.query.get_or_404(post_id)
-    limit = request.args.get('limit', type=int)
-    if limit:
-        comments = Comment.query.filter_by(post_id=post.id).limit(limit).all()
-    else:
-        comments = Comment.query.filter_by(post_id=post.id).all()
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    try:
+        page = comments_page(post.id, cursor=request.args.get('cursor'), per_page=max(limit, 1))
+    except InvalidCursor:
+        abort(400)
     comments_data = [{
+        'id': comment.id,
         'author': {
             'username': comment.author.username,
             'image_file': comment.author.image_file
         },
         'content': comment.content,
-        'date_posted': comment.date_posted.strftime('%Y-%m-%d %H:%M')
-    } for comment in comments]
-    return jsonify({'comments': comments_data})
+        'date_posted': comment.date_posted.strftime('%Y-%m-%d %H:%M'),
+        'can_edit': current_user.is_authenticated and comment.user_id == current_user.id
+    } for comment in page.items]
+    return jsonify({'comments': comments_data, 'next_cursor': page.next_cursor})
 
-@app.route("/search", methods=['GET'])
+@bp.route("/search", methods=['GET'])
 def search():
     query = request.args.get('query', '').strip()
+    page = request.args.get('page', 1, type=int)
     
     if query:
-        posts = Post.query.filter(Post.content.ilike(f'%{query}%')).order_by(Post.date_posted.desc()).all()
-        mechanics = User.query.filter(User.roles.any(Role.name == 'mechanic'), User.username.ilike(f'%{query}%')).all()
-        comments = Comment.query.filter(Comment.content.ilike(f'%{query}%')).order_by(Comment.date_posted.desc()).all()
+        posts = search_posts(query, page=page)
+        mechanics = search_mechanics(query) if page == 1 else []
+        comments = search_comments(query, page=page)
     else:
-        posts = []
+        posts = None
         mechanics = []
-        comments = []
+        comments = None
     
-    return render_template('search_results.html', posts=posts, mechanics=mechanics, comments=comments, query=query)
+    return render_template('search_results.html', posts=posts, mechanics=mechanics, comments=comments, query=query, page=page)
 
-@app.route("/edit_comment/<int:comment_id>", methods=['GET', 'POST'])
+@bp.route("/edit_comment/<int:comment_id>", methods=['GET', 'POST'])
 @login_required
 def edit_comment(comment_id):
     comment = Comment.query.get_or_404(comment_id)
     if comment.user_id != current_user.id:
         flash('You do not have permission to edit this comment.', 'danger')
-        return redirect(url_for('home'))
+        return redirect(url_for('public.home'))
 
     form = CommentForm()
     if form.validate_on_submit():
         comment.content = form.content.data
         db.session.commit()
         flash('Your comment has been updated!', 'success')
-        return redirect(url_for('post', post_id=comment.post_id))
+        return redirect(url_for('public.post', post_id=comment.post_id))
     elif request.method == 'GET':
         form.content.data = comment.content
 
     return render_template('edit_comment.html', form=form, comment=comment)
 
-@app.route("/delete_comment/<int:comment_id>", methods=['POST'])
+@bp.route("/delete_comment/<int:comment_id>", methods=['POST'])
 @login_required
 def delete_comment(comment_id):
     comment = Comment.query.get_or_404(comment_id)
     if comment.user_id != current_user.id:
         flash('You do not have permission to delete this comment.', 'danger')
-        return redirect(url_for('home'))
+        return redirect(url_for('public.home'))
 
     post_id = comment.post_id
     db.session.delete(comment)
     db.session.commit()
     flash('Your comment has been deleted!', 'success')
-    return redirect(url_for('post', post_id=post_id))
+    return redirect(url_for('public.post', post_id=post_id))
 
-@app.route("/edit_post/<int:post_id>", methods=['GET', 'POST'])
+@bp.route("/edit_post/<int:post_id>", methods=['GET', 'POST'])
 @login_required
 def edit_post(post_id):
     post = Post.query.get_or_404(post_id)
     if post.author_id != current_user.id:
         flash('You do not have permission to edit this post.', 'danger')
-        return redirect(url_for('home'))
+        return redirect(url_for('public.home'))
 
     form = PostForm()
     if form.validate_on_submit():
         post.content = form.content.data
         db.session.commit()
         flash('Your post has been updated!', 'success')
-        return redirect(url_for('post', post_id=post.id))
+        return redirect(url_for('public.post', post_id=post.id))
     elif request.method == 'GET':
         form.content.data = post.content
 
     return render_template('edit_post.html', form=form, post=post)
 
-@app.route("/delete_post/<int:post_id>", methods=['POST'])
+@bp.route("/delete_post/<int:post_id>", methods=['POST'])
 @login_required
 def delete_post(post_id):
     post = Post.query.get_or_404(post_id)
     if post.author_id != current_user.id:
         flash('You do not have permission to delete this post.', 'danger')
-        return redirect(url_for('home'))
+        return redirect(url_for('public.home'))
 
     db.session.delete(post)
     db.session.commit()
     flash('Your post has been deleted!', 'success')
-    return redirect(url_for('home'))
-
-@app.route("/privacy")
+    return redirect(url_for('public.home'))
+
+@bp.route("/img/<digest>/<int:width>", defaults={'ext': ''})
+@bp.route("/img/<digest>/<int:width>.webp", defaults={'ext': '.webp'})
+def image_thumbnail(digest, width, ext):
+    # Derivatives of content-addressed pictures never change, so a known
+    # ETag is answered without touching the disk
+    etag = thumbnail_etag(digest, width, ext)
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        return immutable(response)
+    path = thumbnail(digest, width, ext)
+    if path is None:
+        abort(404)
+    response = send_file(path, etag=etag, conditional=True)
+    return immutable(response)
+
+@bp.route("/privacy")
 def privacy():
     return render_template('privacy.html', title='Политика за поверителност')
 
-@app.route("/terms")
+@bp.route("/terms")
 def terms():
     return render_template('terms.html', title='Условия за ползване')
@@ -0,0 +1,167 @@
+# search.py
+# Full-text search over posts, comments, usernames and visit descriptions.
+# SQLite uses external-content FTS5 tables kept in sync by triggers,
+# PostgreSQL uses GIN expression indexes over to_tsvector('simple', ...).
+# Both fold case for Cyrillic; the 'simple' config / unicode61 tokenizer
+# do no stemming, which English-only stemmers would get wrong for Bulgarian.
+
+import re
+from collections import namedtuple
+from markupsafe import Markup, escape
+from sqlalchemy import event, text, func, select, literal_column, true
+from sqlalchemy.orm import joinedload
+from app import db
+from app.models import Post, Comment, User
+
+# (table, column) pairs that get a full-text index
+INDEXED = {
+    'post': ('post', 'content'),
+    'comment': ('comment', 'content'),
+    'user': ('user', 'username'),
+    'car_visit': ('car_visit', 'description'),
+}
+
+MAX_TERMS = 8
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_STOP = '\x03'
+
+SearchPage = namedtuple('SearchPage', 'hits page per_page has_next')
+
+
+def search_ddl(dialect_name, rebuild=False):
+    statements = []
+    for table, column in INDEXED.values():
+        if dialect_name == 'sqlite':
+            fts = f'{table}_fts'
+            statements += [
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({column}, content='{table}', content_rowid='id', tokenize='unicode61 remove_diacritics 0')",
+                f'CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON "{table}" BEGIN '
+                f'INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END',
+                f'CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON "{table}" BEGIN '
+                f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column}); END",
+                f'CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {column} ON "{table}" BEGIN '
+                f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column}); "
+                f'INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END',
+            ]
+            if rebuild:
+                statements.append(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+        elif dialect_name == 'postgresql':
+            statements.append(
+                f'CREATE INDEX IF NOT EXISTS ix_{table}_{column}_fts ON "{table}" '
+                f"USING gin (to_tsvector('simple', {column}))"
+            )
+    return statements
+
+
+def drop_search_ddl(dialect_name):
+    statements = []
+    for table, column in INDEXED.values():
+        if dialect_name == 'sqlite':
+            statements += [f'DROP TRIGGER IF EXISTS {table}_fts_{suffix}' for suffix in ('ai', 'ad', 'au')]
+            statements.append(f'DROP TABLE IF EXISTS {table}_fts')
+        elif dialect_name == 'postgresql':
+            statements.append(f'DROP INDEX IF EXISTS ix_{table}_{column}_fts')
+    return statements
+
+
+@event.listens_for(db.metadata, 'after_create')
+def _create_search_index(target, connection, **kw):
+    for statement in search_ddl(connection.dialect.name):
+        connection.execute(text(statement))
+
+
+def _terms(query):
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+def _match_expression(dialect_name, terms):
+    if dialect_name == 'sqlite':
+        return ' '.join(f'"{term}"*' for term in terms)
+    return ' & '.join(f'{term}:*' for term in terms)
+
+
+def _highlight(snippet):
+    # Snippets come back with control-character markers around matches;
+    # escape the user content first, then turn the markers into <mark>.
+    if snippet is None:
+        return Markup('')
+    return Markup(str(escape(snippet))
+                  .replace(HIGHLIGHT_START, '<mark>')
+                  .replace(HIGHLIGHT_STOP, '</mark>'))
+
+
+def _ranked(index, terms, limit, offset, role=None):
+    # role (user index only) keeps users with that role, inside the ranked
+    # statement so LIMIT counts only them
+    table, column = INDEXED[index]
+    dialect_name = db.engine.dialect.name
+    params = {'match': _match_expression(dialect_name, terms), 'role': role}
+    id_column = 'rowid' if dialect_name == 'sqlite' else 'id'
+    role_filter = (f' AND {id_column} IN (SELECT user_roles.user_id FROM user_roles '
+                   f'JOIN role ON role.id = user_roles.role_id WHERE role.name = :role)') if role else ''
+    if dialect_name == 'sqlite':
+        fts = f'{table}_fts'
+        sql = (f"SELECT rowid, snippet({fts}, 0, :start, :stop, '…', 24) FROM {fts} "
+               f'WHERE {fts} MATCH :match{role_filter} ORDER BY bm25({fts}), rowid DESC LIMIT :limit OFFSET :offset')
+    elif dialect_name == 'postgresql':
+        sql = (f"SELECT id, ts_headline('simple', {column}, q, :options) "
+               f"FROM \"{table}\", to_tsquery('simple', :match) q "
+               f"WHERE to_tsvector('simple', {column}) @@ q{role_filter} "
+               f"ORDER BY ts_rank(to_tsvector('simple', {column}), q) DESC, id DESC LIMIT :limit OFFSET :offset")
+        params['options'] = f'StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, MaxWords=30, MinWords=10'
+    else:
+        # No full-text support, fall back to a (slow) substring match
+        sql = (f'SELECT id, {column} FROM "{table}" WHERE lower({column}) LIKE :match{role_filter} '
+               f'ORDER BY id DESC LIMIT :limit OFFSET :offset')
+        params['match'] = '%' + '%'.join(terms) + '%'
+    params.update(start=HIGHLIGHT_START, stop=HIGHLIGHT_STOP, limit=limit, offset=offset)
+    return db.session.execute(text(sql), params).all()
+
+
+def matches(index, model, query):
+    # Filter clause selecting model rows that match query through the
+    # full-text index, for combining with ordinary filters without ranking
+    terms = _terms(query)
+    if not terms:
+        return true()
+    table_name, column = INDEXED[index]
+    dialect_name = db.engine.dialect.name
+    if dialect_name == 'sqlite':
+        fts = f'{table_name}_fts'
+        rowids = select(literal_column('rowid')).select_from(text(fts)).where(
+            text(f'{fts} MATCH :match').bindparams(match=_match_expression(dialect_name, terms)))
+        return model.id.in_(rowids)
+    if dialect_name == 'postgresql':
+        return func.to_tsvector('simple', getattr(model, column)).op('@@')(
+            func.to_tsquery('simple', _match_expression(dialect_name, terms)))
+    return func.lower(getattr(model, column)).like('%' + '%'.join(terms) + '%')
+
+
+def _search(index, model, query, page, per_page, options=()):
+    terms = _terms(query)
+    page = max(page, 1)
+    if not terms:
+        return SearchPage([], page, per_page, False)
+    rows = _ranked(index, terms, per_page + 1, (page - 1) * per_page)
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+    objects = {obj.id: obj for obj in model.query.options(*options).filter(model.id.in_([row[0] for row in rows]))}
+    hits = [(objects[row_id], _highlight(snippet)) for row_id, snippet in rows if row_id in objects]
+    return SearchPage(hits, page, per_page, has_next)
+
+
+def search_posts(query, page=1, per_page=10):
+    return _search('post', Post, query, page, per_page, options=[joinedload(Post.author)])
+
+
+def search_comments(query, page=1, per_page=10):
+    return _search('comment', Comment, query, page, per_page, options=[joinedload(Comment.author)])
+
+
+def search_mechanics(query, limit=10):
+    terms = _terms(query)
+    if not terms:
+        return []
+    ids = [row[0] for row in _ranked('user', terms, limit, 0, role='mechanic')]
+    mechanics = {user.id: user for user in User.query.filter(User.id.in_(ids))}
+    return [mechanics[user_id] for user_id in ids if user_id in mechanics]
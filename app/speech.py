@@ -0,0 +1,144 @@
+# speech.py
+# Speech recognition for dictated visit and car descriptions. Backends
+# implement stream(), which takes an iterator of LINEAR16 chunks and
+# yields (transcript, is_final) pairs as results arrive; SPEECH_BACKEND
+# picks one. Google clients are created once per process and shared
+# through a small pool instead of per request, and the google library
+# is only imported when that backend is used.
+
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from flask import current_app
+
+
+class SpeechError(Exception):
+    pass
+
+
+class SpeechBackend:
+    # Audio is converted to mono at this rate before it reaches stream();
+    # 16 kHz is the lowest rate that keeps recognition accuracy
+    sample_rate = 16000
+
+    def stream(self, chunks, sample_rate, channels, language):
+        raise NotImplementedError
+
+    def recognize(self, chunks, sample_rate, channels, language):
+        return ' '.join(text for text, is_final in self.stream(chunks, sample_rate, channels, language)
+                        if is_final and text)
+
+
+class ClientPool:
+    # Clients are thread safe, but each holds one gRPC channel; a few of
+    # them spread concurrent dictations over several connections.
+    def __init__(self, factory, size):
+        self.factory = factory
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def client(self):
+        try:
+            client = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    client = self.factory()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                client = self._idle.get()
+        try:
+            yield client
+        finally:
+            self._idle.put(client)
+
+
+class GoogleSpeechBackend(SpeechBackend):
+    def __init__(self):
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+
+    def _create_client(self):
+        from google.cloud import speech
+
+        credentials_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
+        if not credentials_path:
+            raise SpeechError("Google application credentials not set")
+        return speech.SpeechClient.from_service_account_file(credentials_path)
+
+    def _get_pool(self):
+        # gRPC channels do not survive fork, so every worker builds its own
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ClientPool(self._create_client, current_app.config['SPEECH_CLIENT_POOL_SIZE'])
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def stream(self, chunks, sample_rate, channels, language):
+        from google.cloud import speech
+
+        config = speech.StreamingRecognitionConfig(
+            config=speech.RecognitionConfig(
+                encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
+                language_code=language,
+                audio_channel_count=channels,
+                sample_rate_hertz=sample_rate,
+            ),
+            interim_results=True,
+        )
+        requests = (speech.StreamingRecognizeRequest(audio_content=chunk) for chunk in chunks)
+        with self._get_pool().client() as client:
+            try:
+                for response in client.streaming_recognize(config=config, requests=requests):
+                    for result in response.results:
+                        if result.alternatives:
+                            yield result.alternatives[0].transcript.strip(), result.is_final
+            except SpeechError:
+                raise
+            except Exception as e:
+                raise SpeechError(str(e)) from e
+
+
+class LocalSpeechBackend(SpeechBackend):
+    # Offline stand-in: reports how much audio it received, once per
+    # second as a partial result and once at the end as the final one.
+    def stream(self, chunks, sample_rate, channels, language):
+        received = 0
+        reported = 0
+        bytes_per_second = sample_rate * channels * 2
+        for chunk in chunks:
+            received += len(chunk)
+            if received // bytes_per_second > reported:
+                reported = received // bytes_per_second
+                yield f'[{reported} s]', False
+        yield f'[{received / bytes_per_second:.1f} s {language}]', True
+
+
+BACKENDS = {
+    'google': GoogleSpeechBackend,
+    'local': LocalSpeechBackend,
+}
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(name=None):
+    name = name or current_app.config['SPEECH_BACKEND']
+    with _backends_lock:
+        if name not in _backends:
+            _backends[name] = BACKENDS[name]()
+        return _backends[name]
+
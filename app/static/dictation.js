@@ -0,0 +1,207 @@
+// dictation.js
+// Records from the microphone and fills the field named by the record
+// button's data-dictate. The recording is uploaded as 16-bit PCM WAV in
+// chunks (resuming from the server's offset after a failed chunk) and
+// queued for transcription; the job's progress is streamed back as
+// server-sent events (EventSource), so partial results show up while it
+// runs.
+document.addEventListener('DOMContentLoaded', () => {
+    const recordButtons = document.querySelectorAll('button[data-dictate]');
+    if (!recordButtons.length) {
+        return;
+    }
+    if (!navigator.mediaDevices || !navigator.mediaDevices.getUserMedia) {
+        alert("Your browser does not support audio recording");
+        return;
+    }
+    recordButtons.forEach(setUpRecorder);
+});
+
+// data-dictate holds the selector of the field to fill, data-url the
+// speech_to_text endpoint (uploads live under data-url + '/uploads')
+function setUpRecorder(recordButton) {
+    const target = document.querySelector(recordButton.dataset.dictate);
+    const label = recordButton.innerText;
+    const sampleRate = 48000;
+    let isRecording = false;
+    let mediaRecorder;
+    let audioChunks = [];
+
+    recordButton.addEventListener('click', () => {
+        if (isRecording) {
+            mediaRecorder.stop();
+            isRecording = false;
+            recordButton.innerText = label;
+            return;
+        }
+        navigator.mediaDevices.getUserMedia({ audio: true })
+            .then(stream => {
+                mediaRecorder = new MediaRecorder(stream, { mimeType: 'audio/webm' });
+                mediaRecorder.start();
+                isRecording = true;
+                audioChunks = [];
+                recordButton.innerText = "⏹️ Спри запис";
+
+                mediaRecorder.ondataavailable = event => {
+                    audioChunks.push(event.data);
+                };
+
+                mediaRecorder.onstop = () => {
+                    stream.getTracks().forEach(track => track.stop());
+                    new Blob(audioChunks, { type: 'audio/webm' }).arrayBuffer()
+                        .then(data => new AudioContext().decodeAudioData(data))
+                        .then(buffer => {
+                            const offlineContext = new OfflineAudioContext(buffer.numberOfChannels, buffer.duration * sampleRate, sampleRate);
+                            const source = offlineContext.createBufferSource();
+                            source.buffer = buffer;
+                            source.connect(offlineContext.destination);
+                            source.start(0);
+                            return offlineContext.startRendering();
+                        })
+                        .then(renderedBuffer => transcribe(bufferToWave(renderedBuffer)))
+                        .catch(error => console.error('Error:', error));
+                };
+            })
+            .catch(error => {
+                console.error('Error accessing audio stream:', error);
+                alert('Error accessing audio stream. Please check your microphone permissions.');
+            });
+    });
+
+    function upload(wavBlob) {
+        const uploadsUrl = recordButton.dataset.url + '/uploads';
+        const request = (url, options) => fetch(url, options).then(response => response.json().then(data => {
+            // 409 carries the offset the server expects next
+            if (!response.ok && response.status !== 409) {
+                throw new Error(data.error);
+            }
+            return data;
+        }));
+
+        return request(uploadsUrl, { method: 'POST' }).then(({ upload_id, chunk_size, max_bytes }) => {
+            if (wavBlob.size > max_bytes) {
+                throw new Error('Записът е твърде дълъг');
+            }
+            const chunkUrl = uploadsUrl + '/' + upload_id;
+            let failures = 0;
+            const send = offset => {
+                if (offset >= wavBlob.size) {
+                    return upload_id;
+                }
+                return request(chunkUrl + '?offset=' + offset, {
+                    method: 'PUT',
+                    body: wavBlob.slice(offset, offset + chunk_size)
+                }).then(data => {
+                    failures = 0;
+                    return send(data.received);
+                }, error => {
+                    // Ask the server where to resume, a few times at most
+                    if (++failures > 3) {
+                        throw error;
+                    }
+                    return request(chunkUrl).then(data => send(data.received));
+                });
+            };
+            return send(0);
+        });
+    }
+
+    function transcribe(wavBlob) {
+        let finalText = '';
+
+        const show = partial => {
+            target.value = [finalText, partial].filter(Boolean).join(' ');
+        };
+        const handle = (event, data) => {
+            if (event === 'partial') {
+                show(data.transcript);
+            } else if (event === 'final') {
+                finalText = [finalText, data.transcript].filter(Boolean).join(' ');
+                show('');
+            } else if (event === 'error') {
+                show('');
+                alert('Грешка при транскрипцията: ' + data.error);
+            }
+        };
+
+        return upload(wavBlob).then(uploadId => {
+            const formData = new FormData();
+            formData.append('upload_id', uploadId);
+            return fetch(recordButton.dataset.url, { method: 'POST', body: formData });
+        }).then(response => response.json().then(job => {
+            if (!response.ok) {
+                throw new Error(job.error);
+            }
+            if (job.status === 'done') {
+                handle('final', job);
+                return null;
+            }
+            return job.poll;
+        })).then(poll => {
+            if (poll === null) {
+                return;
+            }
+            // The server ends each stream after a short window; EventSource
+            // reconnects by itself and sends the last event id to resume
+            const source = new EventSource(poll);
+            ['partial', 'final'].forEach(name => source.addEventListener(name, message => {
+                handle(name, JSON.parse(message.data));
+            }));
+            source.addEventListener('done', () => source.close());
+            source.addEventListener('error', message => {
+                // With data it is the job failing, without it the connection
+                if (message.data) {
+                    source.close();
+                    handle('error', JSON.parse(message.data));
+                } else if (source.readyState === EventSource.CLOSED) {
+                    handle('error', { error: 'Връзката със сървъра прекъсна' });
+                }
+            });
+        }).catch(error => handle('error', { error: error.message }));
+    }
+
+    function bufferToWave(buffer) {
+        let numOfChan = buffer.numberOfChannels,
+            length = buffer.length * numOfChan * 2 + 44,
+            bufferArray = new ArrayBuffer(length),
+            view = new DataView(bufferArray),
+            i, sample,
+            pos = 0;
+
+        setUint32(0x46464952);
+        setUint32(length - 8);
+        setUint32(0x45564157);
+
+        setUint32(0x20746D66);
+        setUint32(16);
+        setUint16(1);
+        setUint16(numOfChan);
+        setUint32(buffer.sampleRate);
+        setUint32(buffer.sampleRate * 2 * numOfChan);
+        setUint16(numOfChan * 2);
+        setUint16(16);
+
+        setUint32(0x61746164);
+        setUint32(length - pos - 4);
+
+        for (i = 0; i < buffer.length; i++) {
+            for (let channel = 0; channel < numOfChan; channel++) {
+                sample = Math.max(-1, Math.min(1, buffer.getChannelData(channel)[i])) * 0x7FFF;
+                view.setInt16(pos, sample, true);
+                pos += 2;
+            }
+        }
+
+        return new Blob([bufferArray], { type: "audio/wav" });
+
+        function setUint16(data) {
+            view.setUint16(pos, data, true);
+            pos += 2;
+        }
+
+        function setUint32(data) {
+            view.setUint32(pos, data, true);
+            pos += 4;
+        }
+    }
+}
@@ -17,4 +17,25 @@ document.addEventListener('DOMContentLoaded', (event) => {
             this.style.display = 'none';
         });
     });
+
+    // Uploaded pictures are resized in the background; until they exist
+    // the page shows a placeholder and polls for the real file.
+    document.querySelectorAll('img[data-pending-src]').forEach(img => {
+        const src = img.getAttribute('data-pending-src');
+        let attempts = 0;
+        const retry = () => {
+            const probe = new Image();
+            probe.onload = () => {
+                img.src = src;
+                img.removeAttribute('data-pending-src');
+            };
+            probe.onerror = () => {
+                if (++attempts < 20) {
+                    setTimeout(retry, Math.min(500 * attempts, 5000));
+                }
+            };
+            probe.src = src + (src.includes('?') ? '&' : '?') + 'r=' + attempts;
+        };
+        retry();
+    });
 });
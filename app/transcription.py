@@ -0,0 +1,181 @@
+# transcription.py
+# Dictations are transcribed as jobs on a bounded thread pool. A job's id
+# is derived from the audio content hash and the recognition config
+# (backend, language, channels), and its state lives in a small JSON file
+# under instance/transcripts. Retries and double submits of the same
+# recording therefore find the running or finished job instead of
+# starting another one, from any worker process.
+
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from app.audio import open_wav, wav_chunks, convert
+from app.speech import SpeechError, get_backend
+from app.metrics import external_call
+
+PARTIAL_INTERVAL = 0.5
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_pending = 0
+_pending_lock = threading.Lock()
+
+
+class TranscriptionBusy(Exception):
+    pass
+
+
+def jobs_dir():
+    path = os.path.join(current_app.instance_path, 'transcripts')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _job_path(job_id, ext='.json'):
+    return os.path.join(jobs_dir(), job_id + ext)
+
+
+def audio_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as audio:
+        for chunk in iter(lambda: audio.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def job_key(digest, channels, language, backend):
+    return hashlib.sha256(f'{digest}:{channels}:{language}:{backend}'.encode()).hexdigest()[:32]
+
+
+def read_job(job_id):
+    if not job_id.isalnum():
+        return None
+    try:
+        with open(_job_path(job_id)) as job_file:
+            return json.load(job_file)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_job(job_id, **state):
+    state['updated'] = time.time()
+    tmp_path = _job_path(job_id, f'.{os.getpid()}.{threading.get_ident()}.tmp')
+    with open(tmp_path, 'w') as job_file:
+        json.dump(state, job_file)
+    os.replace(tmp_path, _job_path(job_id))
+
+
+def _reusable(job):
+    # Finished jobs are the result cache; queued or running ones are only
+    # trusted while they keep updating (the worker may have died)
+    if job is None or job['status'] == 'error':
+        return False
+    if job['status'] == 'done':
+        return True
+    return time.time() - job['updated'] < current_app.config['SPEECH_JOB_TIMEOUT']
+
+
+def _remove_expired_jobs():
+    cutoff = time.time() - current_app.config['SPEECH_RESULT_TTL']
+    for entry in os.scandir(jobs_dir()):
+        if entry.name.startswith('.'):
+            continue
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def _get_executor():
+    # Created lazily and per process, so pre-forked workers never share a pool
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=current_app.config['SPEECH_WORKERS'],
+                                           thread_name_prefix='transcription')
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def pending_jobs():
+    return _pending
+
+
+def submit(audio_path):
+    # Takes ownership of the WAV file at audio_path -> (job_id, job state).
+    # Raises UploadError for audio that cannot be transcribed and
+    # TranscriptionBusy when the queue is full.
+    global _pending
+    keep_audio = False
+    try:
+        with open_wav(audio_path) as audio:
+            channels = audio.getnchannels()
+        backend = current_app.config['SPEECH_BACKEND']
+        job_id = job_key(audio_digest(audio_path), channels, current_app.config['SPEECH_LANGUAGE'], backend)
+        _remove_expired_jobs()
+        # Checking for the job and claiming it happen under one lock shared
+        # by all threads and processes, so of two identical uploads only
+        # one queues a job; the other gets that job and drops its audio
+        with open(os.path.join(jobs_dir(), '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            job = read_job(job_id)
+            if _reusable(job):
+                return job_id, job
+
+            with _pending_lock:
+                if _pending >= current_app.config['SPEECH_QUEUE_SIZE']:
+                    # The client may retry the same upload later
+                    keep_audio = True
+                    raise TranscriptionBusy()
+                _pending += 1
+            os.replace(audio_path, _job_path(job_id, '.wav'))
+            job = {'status': 'queued', 'transcript': '', 'partial': ''}
+            _write_job(job_id, **job)
+        _get_executor().submit(_run, current_app._get_current_object(), job_id)
+        return job_id, job
+    finally:
+        if not keep_audio and os.path.exists(audio_path):
+            os.remove(audio_path)
+
+
+def _run(app, job_id):
+    with app.app_context():
+        _transcribe(job_id)
+
+
+def _transcribe(job_id):
+    global _pending
+    audio_path = _job_path(job_id, '.wav')
+    try:
+        backend = get_backend()
+        finals = []
+        last_write = 0
+        _write_job(job_id, status='running', transcript='', partial='')
+        with open_wav(audio_path) as audio, external_call('speech'):
+            sample_rate = min(audio.getframerate(), backend.sample_rate)
+            chunks = convert(wav_chunks(audio), audio.getframerate(), audio.getnchannels(), sample_rate)
+            for text, is_final in backend.stream(chunks, sample_rate, 1, current_app.config['SPEECH_LANGUAGE']):
+                if is_final:
+                    finals.append(text)
+                    text = ''
+                if time.monotonic() - last_write > PARTIAL_INTERVAL:
+                    _write_job(job_id, status='running', transcript=' '.join(filter(None, finals)), partial=text)
+                    last_write = time.monotonic()
+        _write_job(job_id, status='done', transcript=' '.join(filter(None, finals)), partial='')
+    except SpeechError as e:
+        _write_job(job_id, status='error', error=str(e), transcript='', partial='')
+    except Exception as e:
+        current_app.logger.error(f'Transcription {job_id} failed: {e}')
+        _write_job(job_id, status='error', error='Transcription failed', transcript='', partial='')
+    finally:
+        with _pending_lock:
+            _pending -= 1
+        if os.path.exists(audio_path):
+            os.remove(audio_path)
@@ -0,0 +1,78 @@
+# visits.py
+# Visit history lookup for car_detail. Dates typed into the search box
+# ("05.03.2024", "2024-03-05", "03.2024", "2024-03", "2024",
+# "01.01.2024 - 31.03.2024") become half-open ranges on the (car_id, date)
+# index; the remaining words go through the full-text index on the
+# description.
+
+import re
+from datetime import datetime, timedelta
+from app.models import CarVisit
+from app.search import matches
+
+_DAY = r'\d{1,2}[./-]\d{1,2}[./-]\d{4}|\d{4}-\d{1,2}-\d{1,2}'
+_MONTH = r'\d{1,2}[./-]\d{4}|\d{4}-\d{1,2}'
+_YEAR = r'\d{4}'
+_DATE = rf'(?:{_DAY}|{_MONTH}|{_YEAR})'
+_RANGE = re.compile(rf'({_DATE})\s*(?:-|–|\.\.)\s*({_DATE})')
+_SINGLE = re.compile(rf'(?<![\d./-])({_DATE})(?![\d./-])')
+
+
+def _parse_date(value):
+    # Returns the half-open [start, end) covered by a day, month or year
+    parts = [int(part) for part in re.split(r'[./-]', value)]
+    try:
+        if len(parts) == 1:
+            year, = parts
+            return datetime(year, 1, 1), datetime(year + 1, 1, 1)
+        if len(parts) == 2:
+            month, year = parts if parts[1] > 31 else reversed(parts)
+            start = datetime(year, month, 1)
+            end = datetime(year + month // 12, month % 12 + 1, 1)
+            return start, end
+        if parts[0] > 31:
+            year, month, day = parts
+        else:
+            day, month, year = parts
+        start = datetime(year, month, day)
+        return start, start + timedelta(days=1)
+    except ValueError:
+        return None
+
+
+def parse_visit_search(search_query):
+    # -> (start, end, remaining text); start/end are None when no date was given
+    start = end = None
+    match = _RANGE.search(search_query) or _SINGLE.search(search_query)
+    if match:
+        bounds = [_parse_date(value) for value in match.groups()]
+        if all(bounds):
+            start, end = bounds[0][0], bounds[-1][1]
+            search_query = search_query[:match.start()] + search_query[match.end():]
+    return start, end, search_query.strip()
+
+
+def parse_date_input(value):
+    # <input type="date"> values
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except (TypeError, ValueError):
+        return None
+
+
+def visit_query(car_id, search_query='', date_from=None, date_to=None):
+    start, end, text_query = parse_visit_search(search_query)
+    if date_from and (start is None or date_from > start):
+        start = date_from
+    if date_to and (end is None or date_to + timedelta(days=1) < end):
+        end = date_to + timedelta(days=1)
+
+    query = CarVisit.query.filter(CarVisit.car_id == car_id)
+    if start:
+        query = query.filter(CarVisit.date >= start)
+    if end:
+        query = query.filter(CarVisit.date < end)
+    if text_query:
+        query = query.filter(matches('car_visit', CarVisit, text_query))
+    # Callers order by (date, id) newest first, which the (car_id, date) index serves
+    return query
@@ -0,0 +1,283 @@
+# benchmark.py
+# Drives the hot routes and reports latency percentiles, throughput and
+# queries per request (read from the Server-Timing header). Requests go
+# through the Flask test client, or with --server through a threaded
+# local WSGI server over HTTP. Run it against a database filled by
+# seed.py; --json writes the results for comparing commits, --compare
+# prints the change against an earlier result file. --startup N instead
+# times N fresh interpreters importing the app and running create_app(),
+# and lists the optional heavy packages that got imported on the way.
+#
+#   SQLALCHEMY_DATABASE_URI=sqlite:///bench.db python benchmark.py --json bench.json
+#   python benchmark.py --startup 20 --json startup.json
+
+import argparse
+import http.client
+import json
+import logging
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from sqlalchemy import select, func
+from sqlalchemy.engine import make_url
+from werkzeug.serving import make_server
+from app import create_app, db
+from app.models import Role, Post, Car, user_roles
+
+SEARCH_TERMS = ['масло', 'спирачки', 'двигател', 'климатик', 'ремък', 'диагностика', 'Голф']
+PLATE_PREFIXES = ['CA', 'CB', 'PB', 'K', 'BT', 'CA1', 'H']
+_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+# Only needed by some requests or commands, so start-up should not load them
+DEFERRED_MODULES = ['alembic', 'authlib', 'google.cloud.speech', 'PIL']
+STARTUP_SCRIPT = f'''
+import sys, time
+started = time.perf_counter()
+from app import create_app
+create_app()
+print(time.perf_counter() - started, *[name for name in {DEFERRED_MODULES!r} if name in sys.modules])
+'''
+
+
+def _user_with_role(name):
+    return db.session.scalar(select(user_roles.c.user_id).join(Role, Role.id == user_roles.c.role_id)
+                             .where(Role.name == name).order_by(user_roles.c.user_id).limit(1))
+
+
+def build_scenarios(rng):
+    # name -> (user role or None, function returning the next URL)
+    mechanic = _user_with_role('mechanic')
+    admin = _user_with_role('admin')
+    if mechanic is None or admin is None:
+        raise SystemExit('The database needs a mechanic and an admin, run seed.py first')
+    last_post = db.session.scalar(select(func.max(Post.id))) or 1
+    cars = db.session.scalars(select(Car.id).where(Car.mechanic_id == mechanic).limit(500)).all() or [1]
+    return {
+        'home': (None, lambda: '/'),
+        'search': (None, lambda: f'/search?query={rng.choice(SEARCH_TERMS)}'),
+        'post_comments': (None, lambda: f'/post/{rng.randint(1, last_post)}/comments'),
+        'mechanic_dashboard': (mechanic, lambda: '/mechanic_dashboard'),
+        'mechanic_dashboard_search': (mechanic, lambda: f'/mechanic_dashboard?search={rng.choice(PLATE_PREFIXES)}'),
+        'car_detail': (mechanic, lambda: f'/car/{rng.choice(cars)}'),
+        'admin_cars': (admin, lambda: f'/admin_cars?page={rng.randint(1, 20)}'),
+    }
+
+
+def session_cookie(app, user_id):
+    if user_id is None:
+        return None
+    serializer = app.session_interface.get_signing_serializer(app)
+    return serializer.dumps({'_user_id': str(user_id), '_fresh': True})
+
+
+class TestClientDriver:
+    def __init__(self, app, cookie):
+        self.client = app.test_client()
+        if cookie:
+            self.client.set_cookie(app.config['SESSION_COOKIE_NAME'], cookie)
+
+    def get(self, url):
+        response = self.client.get(url)
+        return response.status_code, response.headers.get('Server-Timing', '')
+
+
+class HTTPDriver:
+    def __init__(self, app, cookie, port):
+        self.connection = http.client.HTTPConnection('127.0.0.1', port)
+        self.headers = {'Cookie': f'{app.config["SESSION_COOKIE_NAME"]}={cookie}'} if cookie else {}
+
+    def get(self, url):
+        self.connection.request('GET', url, headers=self.headers)
+        response = self.connection.getresponse()
+        response.read()
+        return response.status, response.getheader('Server-Timing', '')
+
+
+def percentile(sorted_values, fraction):
+    # Nearest-rank percentile
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, max(int(round(fraction * len(sorted_values))) - 1, 0))]
+
+
+def run_scenario(make_driver, next_url, requests, concurrency, warmup):
+    latencies, queries, errors = [], [], 0
+    lock = threading.Lock()
+    remaining = [requests]
+
+    def worker():
+        nonlocal errors
+        driver = make_driver()
+        for _ in range(warmup):
+            driver.get(next_url())
+        while True:
+            with lock:
+                if not remaining[0]:
+                    return
+                remaining[0] -= 1
+                url = next_url()
+            started = time.perf_counter()
+            status, timing = driver.get(url)
+            elapsed = time.perf_counter() - started
+            match = _QUERIES.search(timing)
+            with lock:
+                latencies.append(elapsed)
+                if match:
+                    queries.append(int(match.group(1)))
+                if status >= 400:
+                    errors += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2),
+        'throughput_rps': round(len(latencies) / wall, 1),
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+    }
+
+
+def measure_startup(runs):
+    imports, processes, loaded = [], [], set()
+    for _ in range(runs):
+        started = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], capture_output=True, text=True,
+                                check=True).stdout.split()
+        processes.append(time.perf_counter() - started)
+        imports.append(float(output[0]))
+        loaded.update(output[1:])
+    imports.sort()
+    processes.sort()
+    return {
+        'runs': runs,
+        'create_app_p50_ms': round(percentile(imports, 0.50) * 1000, 1),
+        'create_app_p95_ms': round(percentile(imports, 0.95) * 1000, 1),
+        'process_p50_ms': round(percentile(processes, 0.50) * 1000, 1),
+        'deferred_modules_loaded': sorted(loaded),
+    }
+
+
+def print_startup(result, baseline=None):
+    print(f'import + create_app p50 {result["create_app_p50_ms"]:.1f} ms, p95 {result["create_app_p95_ms"]:.1f} ms, '
+          f'whole process p50 {result["process_p50_ms"]:.1f} ms ({result["runs"]} runs)')
+    print(f'deferred modules loaded at start: {", ".join(result["deferred_modules_loaded"]) or "none"}')
+    if baseline:
+        changes = [f'{key} {(result[key] - baseline[key]) / baseline[key] * 100:+.0f}%'
+                   for key in ('create_app_p50_ms', 'create_app_p95_ms', 'process_p50_ms') if baseline.get(key)]
+        print(f'vs baseline: {", ".join(changes)}')
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    print(f'{"route":28} {"req":>6} {"err":>4} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"req/s":>8} {"q/req":>6}')
+    for name, row in results.items():
+        print(f'{name:28} {row["requests"]:6} {row["errors"]:4} {row["p50_ms"]:8.2f} {row["p95_ms"]:8.2f} '
+              f'{row["p99_ms"]:8.2f} {row["throughput_rps"]:8.1f} {row["queries_per_request"] or 0:6.1f}')
+        old = (baseline or {}).get(name)
+        if old:
+            changes = [f'{key} {(row[key] - old[key]) / old[key] * 100:+.0f}%'
+                       for key in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps') if old.get(key)]
+            print(f'{"":28} vs baseline: {", ".join(changes)}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the hot routes.')
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per route (default 200)')
+    parser.add_argument('--warmup', type=int, default=10, help='unmeasured requests per worker first (default 10)')
+    parser.add_argument('--concurrency', type=int, default=1, help='parallel clients (default 1)')
+    parser.add_argument('--server', action='store_true', help='go through a local threaded WSGI server')
+    parser.add_argument('--routes', help='comma separated subset of routes')
+    parser.add_argument('--seed', type=int, default=1, help='random seed for the URLs (default 1)')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='earlier --json output to compare against')
+    parser.add_argument('--startup', type=int, metavar='N', help='time N application start-ups instead')
+    args = parser.parse_args()
+
+    if args.startup:
+        result = measure_startup(args.startup)
+        baseline = None
+        if args.compare:
+            with open(args.compare) as baseline_file:
+                baseline = json.load(baseline_file).get('startup')
+        print_startup(result, baseline)
+        if args.json:
+            report = {
+                'commit': git_commit(),
+                'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'python': sys.version.split()[0],
+                'startup': result,
+            }
+            with open(args.json, 'w') as report_file:
+                json.dump(report, report_file, indent=2)
+        return
+
+    app = create_app()
+    rng = random.Random(args.seed)
+    server = None
+    with app.app_context():
+        scenarios = build_scenarios(rng)
+    if args.routes:
+        scenarios = {name: scenarios[name] for name in args.routes.split(',')}
+    if args.server:
+        # One access log line per request would dominate the measurement
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    results = {}
+    try:
+        for name, (user_id, next_url) in scenarios.items():
+            cookie = session_cookie(app, user_id)
+            if server is not None:
+                make_driver = lambda: HTTPDriver(app, cookie, server.server_port)
+            else:
+                make_driver = lambda: TestClientDriver(app, cookie)
+            results[name] = run_scenario(make_driver, next_url, args.requests, args.concurrency, args.warmup)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)['routes']
+    print_results(results, baseline)
+
+    if args.json:
+        report = {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'database': make_url(app.config['SQLALCHEMY_DATABASE_URI']).render_as_string(hide_password=True),
+            'mode': 'server' if args.server else 'test_client',
+            'concurrency': args.concurrency,
+            'requests_per_route': args.requests,
+            'routes': results,
+        }
+        with open(args.json, 'w') as report_file:
+            json.dump(report, report_file, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,9 @@
-from app import app, db
+from app import create_app, db
 from app.models import Role, User
 from flask_bcrypt import Bcrypt
 from sqlalchemy import text
 
+app = create_app()
 bcrypt = Bcrypt(app)
 
 with app.app_context():
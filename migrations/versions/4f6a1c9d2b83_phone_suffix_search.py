@@ -0,0 +1,36 @@
+"""phone-suffix-search
+
+Revision ID: 4f6a1c9d2b83
+Revises: d93a5f0e7b21
+Create Date: 2026-10-18 16:12:09.318402
+
+"""
+from alembic import op
+import re
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f6a1c9d2b83'
+down_revision = 'd93a5f0e7b21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('car_owner', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('phone_search_reversed', sa.String(length=30), nullable=True))
+        batch_op.create_index(batch_op.f('ix_car_owner_phone_search_reversed'), ['phone_search_reversed'], unique=False)
+
+    # Backfill from the raw number, as the digits-only copy may be missing
+    bind = op.get_bind()
+    car_owner = sa.table('car_owner', sa.column('id'), sa.column('phone_number'), sa.column('phone_search_reversed'))
+    for row in bind.execute(sa.select(car_owner.c.id, car_owner.c.phone_number)).all():
+        bind.execute(car_owner.update().where(car_owner.c.id == row.id).values(
+            phone_search_reversed=re.sub(r'\D', '', row.phone_number or '')[::-1]))
+
+
+def downgrade():
+    with op.batch_alter_table('car_owner', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_car_owner_phone_search_reversed'))
+        batch_op.drop_column('phone_search_reversed')
@@ -0,0 +1,40 @@
+"""search-column-lengths
+
+Revision ID: 8b2e5d7a1c64
+Revises: 4f6a1c9d2b83
+Create Date: 2026-10-18 16:40:27.615093
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b2e5d7a1c64'
+down_revision = '4f6a1c9d2b83'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('car', schema=None) as batch_op:
+        batch_op.alter_column('registration_search', existing_type=sa.String(length=20), type_=sa.String(),
+                              existing_nullable=True)
+
+    with op.batch_alter_table('car_owner', schema=None) as batch_op:
+        batch_op.alter_column('phone_search', existing_type=sa.String(length=30), type_=sa.String(),
+                              existing_nullable=True)
+        batch_op.alter_column('phone_search_reversed', existing_type=sa.String(length=30), type_=sa.String(),
+                              existing_nullable=True)
+
+
+def downgrade():
+    with op.batch_alter_table('car_owner', schema=None) as batch_op:
+        batch_op.alter_column('phone_search_reversed', existing_type=sa.String(), type_=sa.String(length=30),
+                              existing_nullable=True)
+        batch_op.alter_column('phone_search', existing_type=sa.String(), type_=sa.String(length=30),
+                              existing_nullable=True)
+
+    with op.batch_alter_table('car', schema=None) as batch_op:
+        batch_op.alter_column('registration_search', existing_type=sa.String(), type_=sa.String(length=20),
+                              existing_nullable=True)
@@ -0,0 +1,26 @@
+"""user-version
+
+Revision ID: a3e91f4c27d0
+Revises: 5130cf33323b
+Create Date: 2026-10-18 09:12:40.318522
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3e91f4c27d0'
+down_revision = '5130cf33323b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('version')
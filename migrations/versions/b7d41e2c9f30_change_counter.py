@@ -0,0 +1,29 @@
+"""change-counter
+
+Revision ID: b7d41e2c9f30
+Revises: f20c4a86e9b1
+Create Date: 2026-10-18 14:05:12.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d41e2c9f30'
+down_revision = 'f20c4a86e9b1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('change_counter',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('updated', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('change_counter')
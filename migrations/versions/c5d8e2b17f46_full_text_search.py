@@ -0,0 +1,51 @@
+"""full-text-search
+
+Revision ID: c5d8e2b17f46
+Revises: a3e91f4c27d0
+Create Date: 2026-10-18 10:03:17.502914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5d8e2b17f46'
+down_revision = 'a3e91f4c27d0'
+branch_labels = None
+depends_on = None
+
+
+# Frozen copy of the search DDL as of this revision; later revisions that
+# index more columns carry their own statements
+INDEXED = [('post', 'content'), ('comment', 'content'), ('user', 'username')]
+
+
+def upgrade():
+    dialect_name = op.get_bind().dialect.name
+    for table, column in INDEXED:
+        if dialect_name == 'sqlite':
+            fts = f'{table}_fts'
+            op.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({column}, content='{table}', content_rowid='id', tokenize='unicode61 remove_diacritics 0')")
+            op.execute(f'CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON "{table}" BEGIN '
+                       f'INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END')
+            op.execute(f'CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON "{table}" BEGIN '
+                       f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column}); END")
+            op.execute(f'CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {column} ON "{table}" BEGIN '
+                       f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column}); "
+                       f'INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END')
+            op.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+        elif dialect_name == 'postgresql':
+            op.execute(f'CREATE INDEX IF NOT EXISTS ix_{table}_{column}_fts ON "{table}" '
+                       f"USING gin (to_tsvector('simple', {column}))")
+
+
+def downgrade():
+    dialect_name = op.get_bind().dialect.name
+    for table, column in INDEXED:
+        if dialect_name == 'sqlite':
+            for suffix in ('ai', 'ad', 'au'):
+                op.execute(f'DROP TRIGGER IF EXISTS {table}_fts_{suffix}')
+            op.execute(f'DROP TABLE IF EXISTS {table}_fts')
+        elif dialect_name == 'postgresql':
+            op.execute(f'DROP INDEX IF EXISTS ix_{table}_{column}_fts')
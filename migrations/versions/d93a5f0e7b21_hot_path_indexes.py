@@ -0,0 +1,59 @@
+"""hot-path-indexes
+
+Revision ID: d93a5f0e7b21
+Revises: b7d41e2c9f30
+Create Date: 2026-10-18 15:02:40.517893
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd93a5f0e7b21'
+down_revision = 'b7d41e2c9f30'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.create_index('ix_post_date_posted', ['date_posted', 'id'], unique=False)
+
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.create_index('ix_comment_post_date', ['post_id', 'date_posted', 'id'], unique=False)
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.create_index('ix_user_date_created', ['date_created', 'id'], unique=False)
+
+    with op.batch_alter_table('user_roles', schema=None) as batch_op:
+        batch_op.create_index('ix_user_roles_role_user', ['role_id', 'user_id'], unique=False)
+
+    with op.batch_alter_table('repair_shop_image', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_repair_shop_image_user_id'), ['user_id'], unique=False)
+
+    with op.batch_alter_table('car', schema=None) as batch_op:
+        batch_op.create_index('ix_car_date_created', ['date_created', 'id'], unique=False)
+        batch_op.create_index('ix_car_mechanic_visible_created', ['mechanic_id', 'date_created', 'id'], unique=False,
+                              sqlite_where=sa.text('visibility = 1'), postgresql_where=sa.text('visibility'))
+
+
+def downgrade():
+    with op.batch_alter_table('car', schema=None) as batch_op:
+        batch_op.drop_index('ix_car_mechanic_visible_created')
+        batch_op.drop_index('ix_car_date_created')
+
+    with op.batch_alter_table('repair_shop_image', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_repair_shop_image_user_id'))
+
+    with op.batch_alter_table('user_roles', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_roles_role_user')
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index('ix_user_date_created')
+
+    with op.batch_alter_table('comment', schema=None) as batch_op:
+        batch_op.drop_index('ix_comment_post_date')
+
+    with op.batch_alter_table('post', schema=None) as batch_op:
+        batch_op.drop_index('ix_post_date_posted')
@@ -0,0 +1,70 @@
+"""car-search-columns
+
+Revision ID: e71b0c9a4d53
+Revises: c5d8e2b17f46
+Create Date: 2026-10-18 10:41:05.771230
+
+"""
+from alembic import op
+import re
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e71b0c9a4d53'
+down_revision = 'c5d8e2b17f46'
+branch_labels = None
+depends_on = None
+
+# Normalization as of this revision, frozen here so the backfill does
+# not change when app.normalize does
+CYRILLIC_TO_LATIN_MAP = {
+    'А': 'A', 'В': 'B', 'Е': 'E', 'К': 'K', 'М': 'M', 'Н': 'H',
+    'О': 'O', 'Р': 'P', 'С': 'C', 'Т': 'T', 'У': 'Y', 'Х': 'X',
+}
+
+
+def normalize_registration_number(value):
+    if not value:
+        return ''
+    folded = ''.join(CYRILLIC_TO_LATIN_MAP.get(char, char) for char in value.upper())
+    return re.sub(r'[^0-9A-Z]', '', folded)
+
+
+def normalize_phone_number(value):
+    if not value:
+        return ''
+    return re.sub(r'\D', '', value)
+
+
+def upgrade():
+    with op.batch_alter_table('car_owner', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('phone_search', sa.String(length=30), nullable=True))
+        batch_op.create_index(batch_op.f('ix_car_owner_phone_search'), ['phone_search'], unique=False)
+
+    with op.batch_alter_table('car', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('registration_search', sa.String(length=20), nullable=True))
+        batch_op.create_index('ix_car_mechanic_registration_search', ['mechanic_id', 'registration_search'], unique=False)
+        batch_op.create_index('ix_car_owner_mechanic', ['owner_id', 'mechanic_id'], unique=False)
+
+    # Backfill the normalized copies for existing rows
+    bind = op.get_bind()
+    car_owner = sa.table('car_owner', sa.column('id'), sa.column('phone_number'), sa.column('phone_search'))
+    car = sa.table('car', sa.column('id'), sa.column('registration_number'), sa.column('registration_search'))
+    for row in bind.execute(sa.select(car_owner.c.id, car_owner.c.phone_number)).all():
+        bind.execute(car_owner.update().where(car_owner.c.id == row.id).values(
+            phone_search=normalize_phone_number(row.phone_number)))
+    for row in bind.execute(sa.select(car.c.id, car.c.registration_number)).all():
+        bind.execute(car.update().where(car.c.id == row.id).values(
+            registration_search=normalize_registration_number(row.registration_number)))
+
+
+def downgrade():
+    with op.batch_alter_table('car', schema=None) as batch_op:
+        batch_op.drop_index('ix_car_owner_mechanic')
+        batch_op.drop_index('ix_car_mechanic_registration_search')
+        batch_op.drop_column('registration_search')
+
+    with op.batch_alter_table('car_owner', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_car_owner_phone_search'))
+        batch_op.drop_column('phone_search')
@@ -0,0 +1,49 @@
+"""car-visit-search
+
+Revision ID: f20c4a86e9b1
+Revises: e71b0c9a4d53
+Create Date: 2026-10-18 11:20:52.104637
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f20c4a86e9b1'
+down_revision = 'e71b0c9a4d53'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('car_visit', schema=None) as batch_op:
+        batch_op.create_index('ix_car_visit_car_date', ['car_id', 'date'], unique=False)
+
+    dialect_name = op.get_bind().dialect.name
+    if dialect_name == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE IF NOT EXISTS car_visit_fts USING fts5(description, content='car_visit', content_rowid='id', tokenize='unicode61 remove_diacritics 0')")
+        op.execute('CREATE TRIGGER IF NOT EXISTS car_visit_fts_ai AFTER INSERT ON "car_visit" BEGIN '
+                   'INSERT INTO car_visit_fts(rowid, description) VALUES (new.id, new.description); END')
+        op.execute('CREATE TRIGGER IF NOT EXISTS car_visit_fts_ad AFTER DELETE ON "car_visit" BEGIN '
+                   "INSERT INTO car_visit_fts(car_visit_fts, rowid, description) VALUES ('delete', old.id, old.description); END")
+        op.execute('CREATE TRIGGER IF NOT EXISTS car_visit_fts_au AFTER UPDATE OF description ON "car_visit" BEGIN '
+                   "INSERT INTO car_visit_fts(car_visit_fts, rowid, description) VALUES ('delete', old.id, old.description); "
+                   'INSERT INTO car_visit_fts(rowid, description) VALUES (new.id, new.description); END')
+        op.execute("INSERT INTO car_visit_fts(car_visit_fts) VALUES ('rebuild')")
+    elif dialect_name == 'postgresql':
+        op.execute('CREATE INDEX IF NOT EXISTS ix_car_visit_description_fts ON "car_visit" '
+                   "USING gin (to_tsvector('simple', description))")
+
+
+def downgrade():
+    dialect_name = op.get_bind().dialect.name
+    if dialect_name == 'sqlite':
+        for suffix in ('ai', 'ad', 'au'):
+            op.execute(f'DROP TRIGGER IF EXISTS car_visit_fts_{suffix}')
+        op.execute('DROP TABLE IF EXISTS car_visit_fts')
+    elif dialect_name == 'postgresql':
+        op.execute('DROP INDEX IF EXISTS ix_car_visit_description_fts')
+
+    with op.batch_alter_table('car_visit', schema=None) as batch_op:
+        batch_op.drop_index('ix_car_visit_car_date')
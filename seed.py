@@ -0,0 +1,235 @@
+# seed.py
+# Bulk-generates a production-sized data set for benchmarking: mechanics,
+# customers, car owners, cars, visits, posts and comments with Bulgarian
+# text, names, phone numbers and registration plates. The same --seed
+# always produces the same rows. Point it at a scratch database; --reset
+# drops every table first, so it needs the database named explicitly
+# and asks before dropping unless --yes is given:
+#
+#   python seed.py --database sqlite:///bench.db --reset
+#   python seed.py --database sqlite:///bench.db --scale 0.1
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import insert, func, text
+from app import create_app, db
+from app.models import Role, User, CarOwner, Car, CarVisit, Post, Comment, user_roles
+from app.normalize import normalize_registration_number, normalize_phone_number
+from app.search import drop_search_ddl
+
+# Rows generated at --scale 1
+VOLUMES = {
+    'mechanics': 40,
+    'users': 3000,
+    'owners': 6000,
+    'cars': 9000,
+    'visits': 60000,
+    'posts': 12000,
+    'comments': 45000,
+}
+BATCH_SIZE = 2000
+HISTORY_DAYS = 3 * 365
+PASSWORD_HASH = '$2b$12$rO6wrQC5uuyOg/LYIUbvmOxd7KhL3qaWfITos07XbCAgREWXlF2Am'
+ROLES = {
+    'admin': 'Administrator role',
+    'mechanic': 'Mechanic role',
+    'frontend_user': 'Frontend user role',
+    'backend_user': 'Backend user role',
+}
+
+FIRST_NAMES = ['Иван', 'Георги', 'Димитър', 'Николай', 'Петър', 'Христо', 'Стоян', 'Тодор', 'Васил', 'Атанас',
+               'Мария', 'Елена', 'Йорданка', 'Пенка', 'Десислава', 'Никол', 'Гергана', 'Цветелина', 'Радослав', 'Калоян']
+LAST_NAMES = ['Иванов', 'Георгиев', 'Димитров', 'Петров', 'Николов', 'Христов', 'Стоянов', 'Тодоров', 'Илиев', 'Ангелов',
+              'Костов', 'Маринов', 'Колев', 'Йорданов', 'Попов', 'Станев', 'Михайлов', 'Цветков']
+CARS = ['БМВ 320д', 'Фолксваген Голф 4', 'Опел Астра', 'Тойота Корола', 'Мерцедес C220', 'Ауди А4', 'Шкода Октавия',
+        'Рено Меган', 'Пежо 307', 'Форд Фокус', 'Дачия Логан', 'Хонда Сивик', 'Мазда 6', 'Ситроен C4', 'Волво V70']
+PROBLEMS = ['тропа отпред вляво при неравности', 'свети лампичката за двигателя', 'пуши бял дим на студено',
+            'скърцат спирачките', 'вибрира волана над 100 км/ч', 'не пали сутрин', 'тече масло под двигателя',
+            'климатикът не охлажда', 'дърпа наляво при спиране', 'чука при завой на място', 'губи мощност при изкачване',
+            'прегрява в задръстване', 'съединителят хваща високо', 'свири ремък при запалване']
+QUESTIONS = ['Някой знае ли какво може да е?', 'Колко ще ми струва ремонтът?', 'Опасно ли е да карам така?',
+             'Къде в София да го погледнат?', 'Сменях вече свещите, без промяна.', 'Моля за съвет.']
+ANSWERS = ['Най-вероятно е {part}, карайте го на диагностика.', 'Проверете {part}, при този модел е често.',
+           'Звучи като {part}. Ремонтът е около {price} лв. с труда.', 'Елате в сервиза, ще погледнем {part} на място.',
+           'При нас смяната на {part} отнема около час.', 'Първо проверете {part}, после мислете за по-скъпото.']
+PARTS = ['тампона на стабилизатора', 'накрайника на кормилната щанга', 'ангренажния ремък', 'дебитомера',
+         'EGR клапана', 'главината', 'носача', 'спирачните накладки', 'водната помпа', 'термостата',
+         'компресора на климатика', 'запалителната бобина', 'горивния филтър', 'маншона на полуоската']
+VISITS = ['Смяна на масло и филтри', 'Смяна на {part}', 'Диагностика, изчистени грешки', 'Годишен технически преглед',
+          'Смяна на гуми и баланс', 'Зареждане на климатик', 'Ремонт на {part}', 'Смяна на накладки и дискове',
+          'Реглаж на преден мост', 'Смяна на акумулатор']
+REGIONS = ['СА', 'СВ', 'СН', 'СО', 'СС', 'СТ', 'СМ', 'СК', 'А', 'В', 'ВТ', 'ВН', 'ВР', 'Е', 'ЕВ', 'ЕН',
+           'К', 'КН', 'ОВ', 'РА', 'РВ', 'РК', 'РР', 'Т', 'ТХ', 'Х', 'Н', 'М', 'У', 'СР']
+PLATE_LETTERS = 'АВЕКМНОРСТУХ'
+
+
+def insert_rows(model, rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(insert(model), rows[start:start + BATCH_SIZE])
+
+
+def next_id(model):
+    return (db.session.query(func.max(model.id)).scalar() or 0) + 1
+
+
+def random_date(rng, now, after=None):
+    start = after or now - timedelta(days=HISTORY_DAYS)
+    return start + timedelta(seconds=rng.randint(0, max(int((now - start).total_seconds()), 1)))
+
+
+def plate(rng):
+    return (f'{rng.choice(REGIONS)} {rng.randint(0, 9999):04d} '
+            f'{rng.choice(PLATE_LETTERS)}{rng.choice(PLATE_LETTERS)}')
+
+
+def ensure_roles():
+    existing = {role.name: role for role in Role.query.all()}
+    for name, description in ROLES.items():
+        if name not in existing:
+            existing[name] = Role(name=name, description=description)
+            db.session.add(existing[name])
+    db.session.commit()
+    return {name: role.id for name, role in existing.items()}
+
+
+def seed(volumes, rng):
+    now = datetime.utcnow()
+    roles = ensure_roles()
+
+    # Users: one admin, the mechanics, then customers
+    first_user = next_id(User)
+    users, memberships = [], []
+    total_users = 1 + volumes['mechanics'] + volumes['users']
+    for offset in range(total_users):
+        user_id = first_user + offset
+        role = 'admin' if offset == 0 else 'mechanic' if offset <= volumes['mechanics'] else 'frontend_user'
+        name = f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+        users.append({
+            'id': user_id,
+            'username': f'{name} {user_id}',
+            'email': f'user{user_id}@example.bg',
+            'phone_number': f'08{rng.choice("789")}{rng.randrange(10 ** 7):07d}',
+            'image_file': 'default.jpg',
+            'biography': f'{rng.randint(3, 30)} години опит с {rng.choice(CARS)} и {rng.choice(CARS)}.' if role == 'mechanic' else None,
+            'expertise': ', '.join(rng.sample(['ходова част', 'двигатели', 'електроника', 'климатици', 'скоростни кутии', 'тенекеджийство'], 2)) if role == 'mechanic' else None,
+            'password': PASSWORD_HASH,
+            'date_created': random_date(rng, now),
+            'visibility': True,
+            'version': 1,
+        })
+        memberships.append({'user_id': user_id, 'role_id': roles[role]})
+    insert_rows(User, users)
+    db.session.execute(insert(user_roles), memberships)
+    mechanic_ids = [user['id'] for user in users[1:1 + volumes['mechanics']]]
+    customer_ids = [user['id'] for user in users[1 + volumes['mechanics']:]] or mechanic_ids
+
+    first_owner = next_id(CarOwner)
+    owners = []
+    for offset in range(volumes['owners']):
+        # Owner phone numbers are unique; deriving them from the id keeps
+        # repeated runs against the same database from colliding
+        phone = f'08{rng.choice("789")}{first_owner + offset:07d}'
+        owners.append({'id': first_owner + offset, 'name': f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}',
+                       'phone_number': phone, 'phone_search': normalize_phone_number(phone),
+                       'phone_search_reversed': normalize_phone_number(phone)[::-1]})
+    insert_rows(CarOwner, owners)
+
+    first_car = next_id(Car)
+    cars, plates = [], set()
+    for offset in range(volumes['cars']):
+        mechanic_id = rng.choice(mechanic_ids)
+        registration = plate(rng)
+        while (registration, mechanic_id) in plates:
+            registration = plate(rng)
+        plates.add((registration, mechanic_id))
+        cars.append({
+            'id': first_car + offset,
+            'registration_number': registration,
+            'registration_search': normalize_registration_number(registration),
+            'vin_number': ''.join(rng.choice('ABCDEFGHJKLMNPRSTUVWXYZ0123456789') for _ in range(17)),
+            'additional_info': rng.choice(CARS),
+            'date_created': random_date(rng, now),
+            'visibility': rng.random() > 0.05,
+            'owner_id': rng.choice(owners)['id'],
+            'mechanic_id': mechanic_id,
+        })
+    insert_rows(Car, cars)
+
+    visits = []
+    for _ in range(volumes['visits']):
+        car = rng.choice(cars)
+        visits.append({'car_id': car['id'], 'date': random_date(rng, now, after=car['date_created']),
+                       'description': rng.choice(VISITS).format(part=rng.choice(PARTS))})
+    insert_rows(CarVisit, visits)
+
+    first_post = next_id(Post)
+    posts = []
+    for offset in range(volumes['posts']):
+        posts.append({
+            'id': first_post + offset,
+            'content': f'{rng.choice(CARS)}: {rng.choice(PROBLEMS)}. {rng.choice(QUESTIONS)}',
+            'date_posted': random_date(rng, now),
+            'user_id': rng.choice(customer_ids),
+        })
+    insert_rows(Post, posts)
+
+    comments = []
+    for _ in range(volumes['comments']):
+        # Comment counts are skewed: a few threads get most of the answers
+        post = posts[min(int(rng.expovariate(1 / (len(posts) / 8))), len(posts) - 1)] if posts else None
+        if post is None:
+            break
+        comments.append({
+            'content': rng.choice(ANSWERS).format(part=rng.choice(PARTS), price=rng.randrange(40, 900, 10)),
+            'date_posted': random_date(rng, now, after=post['date_posted']),
+            'user_id': rng.choice(mechanic_ids + [post['user_id']]),
+            'post_id': post['id'],
+        })
+    insert_rows(Comment, comments)
+    db.session.commit()
+    return {'users': len(users), 'owners': len(owners), 'cars': len(cars), 'visits': len(visits),
+            'posts': len(posts), 'comments': len(comments)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a benchmark data set.')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplies every volume (default 1)')
+    parser.add_argument('--seed', type=int, default=1, help='random seed (default 1)')
+    parser.add_argument('--database', default=os.getenv('SQLALCHEMY_DATABASE_URI'),
+                        help='database URL (default $SQLALCHEMY_DATABASE_URI)')
+    parser.add_argument('--reset', action='store_true', help='drop and recreate all tables first')
+    parser.add_argument('--yes', action='store_true', help='do not ask before --reset drops the tables')
+    for name, count in VOLUMES.items():
+        parser.add_argument(f'--{name}', type=int, help=f'number of {name} (default {count} x scale)')
+    args = parser.parse_args()
+    volumes = {name: getattr(args, name) if getattr(args, name) is not None else int(count * args.scale)
+               for name, count in VOLUMES.items()}
+    volumes['mechanics'] = max(volumes['mechanics'], 1)
+
+    if args.database is None:
+        # The app would fall back to its own site.db
+        parser.error('name the database to fill with --database or SQLALCHEMY_DATABASE_URI')
+    app = create_app({'SQLALCHEMY_DATABASE_URI': args.database})
+    with app.app_context():
+        if args.reset:
+            shown = db.engine.url.render_as_string(hide_password=True)
+            if not args.yes and input(f'Drop every table in {shown}? [y/N] ').strip().lower() != 'y':
+                sys.exit('Nothing changed')
+            # The full-text tables are not part of the metadata
+            for statement in drop_search_ddl(db.engine.dialect.name):
+                db.session.execute(text(statement))
+            db.session.commit()
+            db.drop_all()
+            db.create_all()
+        started = time.perf_counter()
+        created = seed(volumes, random.Random(args.seed))
+        print(', '.join(f'{count} {name}' for name, count in created.items()),
+              f'in {time.perf_counter() - started:.1f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+# serve.py
+# Production server: a gunicorn master that imports the app and warms
+# its caches once, then forks the workers, so they start ready and share
+# those pages copy-on-write. Each worker runs request threads (gthread),
+# which keeps slow Speech uploads, transcription streams and OAuth round
+# trips from blocking a whole process. Workers are replaced gracefully
+# after --max-requests requests (with jitter, so they do not all restart
+# at once); SIGHUP reloads all of them, SIGTERM drains and stops.
+# run.py stays the development server.
+#
+#   python serve.py --bind 0.0.0.0:5000 --workers 4 --threads 8
+#   python serve.py --certfile cert.pem --keyfile key.pem
+
+import argparse
+import multiprocessing
+import os
+import sys
+from gunicorn.app.base import BaseApplication
+from gunicorn.workers.gthread import ThreadWorker
+from app import create_app, db, metrics
+from app.directory import mechanic_directory
+
+
+def warm_up(app):
+    # Compiled templates and the mechanics list, then no open connections:
+    # a pooled connection inherited by several workers gets corrupted
+    for name in app.jinja_env.list_templates(filter_func=lambda name: name.endswith('.html')):
+        app.jinja_env.get_template(name)
+    with app.app_context():
+        mechanic_directory.get()
+        db.session.remove()
+        db.engine.dispose()
+
+
+class RecyclingThreadWorker(ThreadWorker):
+    # The stock gthread worker closes its poller as soon as it reaches
+    # max_requests, dropping connections it has accepted but not read yet.
+    # This one stops accepting, lets idle keep-alive connections go,
+    # answers what it already has and only then exits.
+    def init_process(self):
+        self.recycle_after, self.max_requests = self.max_requests, sys.maxsize
+        self.draining = False
+        super().init_process()
+
+    def handle_request(self, req, conn):
+        # Decided before the response is created (super() counts this
+        # request), so the response that starts the drain already closes
+        if self.nr + 1 >= self.recycle_after and not self.draining:
+            self.log.info('Autorestarting worker after the requests it has accepted.')
+            self.draining = True
+            # The stock handler calls resp.force_close() once it holds
+            # max_keepalived connections: from now on that is always
+            self.max_keepalived = 0
+        return super().handle_request(req, conn)
+
+    def murder_keepalived(self):
+        # Called from the main loop on every turn
+        if self.draining:
+            with self._lock:
+                if self.alive:
+                    for sock in self.sockets:
+                        try:
+                            self.poller.unregister(sock)
+                        except (KeyError, ValueError):
+                            pass
+                for conn in self._keep:
+                    conn.timeout = 0
+        super().murder_keepalived()
+        if self.draining and self.nr_conns <= 0:
+            self.alive = False
+
+
+def flush_metrics(server, worker):
+    # Requests since the last periodic flush would be lost with the worker
+    try:
+        with worker.wsgi.app_context():
+            metrics.flush()
+    except OSError as e:
+        server.log.error(f'Could not write metrics: {e}')
+
+
+class Server(BaseApplication):
+    def __init__(self, app, options):
+        self.application = app
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if value is not None:
+                self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the app with pre-forked gunicorn workers.')
+    parser.add_argument('--bind', default=os.getenv('BIND', '0.0.0.0:5000'), help='address (default 0.0.0.0:5000)')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1)),
+                        help='worker processes (default 2 x CPUs + 1)')
+    parser.add_argument('--threads', type=int, default=int(os.getenv('WEB_THREADS', 4)),
+                        help='request threads per worker, 1 uses sync workers (default 4)')
+    parser.add_argument('--max-requests', type=int, default=1000, help='recycle a worker after this many requests, 0 never (default 1000)')
+    parser.add_argument('--max-requests-jitter', type=int, default=100, help='random extra requests per worker (default 100)')
+    parser.add_argument('--timeout', type=int, default=60,
+                        help='seconds before a silent worker is killed; with sync workers this also caps '
+                             'transcription streams (default 60)')
+    parser.add_argument('--graceful-timeout', type=int, default=30, help='seconds to finish requests on restart (default 30)')
+    parser.add_argument('--certfile', help='TLS certificate')
+    parser.add_argument('--keyfile', help='TLS private key')
+    parser.add_argument('--no-warm-up', action='store_true', help='skip warming caches before forking')
+    args = parser.parse_args()
+
+    app = create_app()
+    if not args.no_warm_up:
+        warm_up(app)
+
+    Server(app, {
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        'worker_class': f'{__name__}.RecyclingThreadWorker' if args.threads > 1 else 'sync',
+        'preload_app': True,
+        'max_requests': args.max_requests,
+        'max_requests_jitter': args.max_requests_jitter,
+        'timeout': args.timeout,
+        'graceful_timeout': args.graceful_timeout,
+        'keepalive': 5,
+        'certfile': args.certfile,
+        'keyfile': args.keyfile,
+        'accesslog': '-',
+        'errorlog': '-',
+        'worker_exit': flush_metrics,
+    }).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+# conftest.py
+# One application per test session, configured against a scratch
+# directory; every test starts from freshly created tables.
+
+import pytest
+from sqlalchemy import text
+from app import create_app, db as _db
+from app.fragments import fragment_cache
+from app.models import Role, User, user_cache
+from app.search import drop_search_ddl
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('garage')
+    return create_app({
+        'TESTING': True,
+        'WTF_CSRF_ENABLED': False,
+        # Views going over their @query_budget fail the test
+        'SQL_STRICT': True,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{directory / "test.db"}',
+        'METRICS_DIR': str(directory / 'metrics'),
+        'IMAGE_CACHE_DIR': str(directory / 'image_cache'),
+    })
+
+
+@pytest.fixture
+def db(app):
+    with app.app_context():
+        _db.create_all()
+        # Ids are reused from test to test; a cached user or fragment would
+        # outlive its row
+        user_cache.clear()
+        fragment_cache.backend.clear()
+        yield _db
+        _db.session.remove()
+        # The full-text tables are not part of the metadata
+        for statement in drop_search_ddl(_db.engine.dialect.name):
+            _db.session.execute(text(statement))
+        _db.session.commit()
+        _db.drop_all()
+
+
+@pytest.fixture
+def make_user(db):
+    roles = {}
+
+    def make_user(username, role='frontend_user', **fields):
+        if role not in roles:
+            roles[role] = Role.query.filter_by(name=role).first() or Role(name=role)
+        user = User(username=username, email=fields.pop('email', f'{username.replace(" ", ".")}@example.bg'),
+                    roles=[roles[role]], **fields)
+        db.session.add(user)
+        db.session.commit()
+        return user
+    return make_user
+
+
+@pytest.fixture
+def client_for(app):
+    def client_for(user):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+            session['_fresh'] = True
+        return client
+    return client_for
@@ -0,0 +1,39 @@
+import math
+import struct
+from app.audio import convert
+
+
+def _pcm(samples):
+    return struct.pack(f'<{len(samples)}h', *samples)
+
+
+def _samples(data):
+    return struct.unpack(f'<{len(data) // 2}h', data)
+
+
+def _sine(rate, seconds=1.0, frequency=440):
+    return [int(10000 * math.sin(2 * math.pi * frequency * n / rate)) for n in range(int(rate * seconds))]
+
+
+def test_convert_downmixes_stereo():
+    stereo = _pcm([1000, 3000] * 100 + [-32768, -32768])
+    assert _samples(b''.join(convert([stereo], 16000, 2, 16000))) == tuple([2000] * 100 + [-32768])
+
+
+def test_convert_resamples_the_same_in_chunks_as_whole():
+    data = _pcm(_sine(48000))
+    chunk = 4800 * 2
+    whole = b''.join(convert([data], 48000, 1, 16000))
+    chunked = b''.join(convert([data[start:start + chunk] for start in range(0, len(data), chunk)], 48000, 1, 16000))
+
+    assert chunked == whole
+    assert abs(len(whole) // 2 - 16000) <= 1
+    expected = _sine(16000)
+    assert max(abs(a - b) for a, b in zip(_samples(whole), expected)) < 200
+
+
+def test_convert_upsamples():
+    data = _pcm(_sine(8000))
+    out = _samples(b''.join(convert([data[:8000], data[8000:]], 8000, 1, 16000)))
+    assert abs(len(out) - 16000) <= 2
+    assert max(abs(a - b) for a, b in zip(out, _sine(16000))) < 500
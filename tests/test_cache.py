@@ -0,0 +1,66 @@
+import os
+import threading
+import time
+from app.cache import DiskCache
+
+
+def _writer(data):
+    def write(path):
+        with open(path, 'wb') as output:
+            output.write(data)
+    return write
+
+
+def test_disk_cache_concurrent_writers(tmp_path):
+    # Two caches on one directory stand in for two worker processes
+    caches = [DiskCache(str(tmp_path), 20_000), DiskCache(str(tmp_path), 20_000)]
+    errors = []
+
+    def work(number):
+        cache = caches[number % 2]
+        for key in range(60):
+            try:
+                # Overlapping keys: several threads render the same entry
+                path = cache.put(f'key-{key % 30}-{number % 3}', _writer(b'x' * 1000))
+                assert path is not None
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(number,)) for number in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    names = os.listdir(tmp_path)
+    assert errors == []
+    assert not [name for name in names if name.endswith('.tmp')]
+    assert sum(os.path.getsize(tmp_path / name) for name in names) <= 20_000 * 1.1
+
+
+def test_disk_cache_never_evicts_files_being_written(tmp_path):
+    cache = DiskCache(str(tmp_path), 5_000)
+    in_flight = tmp_path / 'other.1234.tmp'
+    in_flight.write_bytes(b'x' * 10_000)
+
+    for key in range(10):
+        cache.put(f'key-{key}', _writer(b'x' * 1000))
+
+    assert in_flight.exists()
+    assert cache.get('key-9') is not None
+    assert cache.get('missing') is None
+
+
+def test_disk_cache_removes_temporary_files_left_by_dead_writers(tmp_path):
+    cache = DiskCache(str(tmp_path), 5_000)
+    abandoned = tmp_path / 'crashed.1234.tmp'
+    abandoned.write_bytes(b'\0' * 1000)
+    old = time.time() - DiskCache.TMP_GRACE - 60
+    os.utime(abandoned, (old, old))
+    in_flight = tmp_path / 'other.5678.tmp'
+    in_flight.write_bytes(b'\0' * 1000)
+
+    cache.put('first', _writer(b'\0' * 100))
+
+    assert not abandoned.exists()
+    assert in_flight.exists()
@@ -0,0 +1,39 @@
+from app.models import Car, CarOwner
+
+
+def _car(db, mechanic, registration, phone):
+    car = Car(registration_number=registration, mechanic_id=mechanic.id,
+              owner=CarOwner(name='Собственик', phone_number=phone))
+    db.session.add(car)
+    db.session.commit()
+    return car
+
+
+def _found(client, query):
+    page = client.get('/mechanic_dashboard', query_string={'search': query}).get_data(as_text=True)
+    return {registration for registration in ('CA1234BX', 'PB7777KK') if registration in page}
+
+
+def test_dashboard_search_matches_normalized_registration_and_phone(db, make_user, client_for):
+    mechanic = make_user('Механик', role='mechanic')
+    _car(db, mechanic, 'CA1234BX', '0888 123 456')
+    _car(db, mechanic, 'PB7777KK', '+359 87 654 3210')
+    client = client_for(mechanic)
+
+    # Cyrillic look-alikes and separators in a registration
+    assert _found(client, 'са 12') == {'CA1234BX'}
+    # Start of the number, typed with or without separators
+    assert _found(client, '0888-12') == {'CA1234BX'}
+    assert _found(client, '35987') == {'PB7777KK'}
+    # End of the number, as people usually remember it
+    assert _found(client, '3456') == {'CA1234BX'}
+    assert _found(client, '654 3210') == {'PB7777KK'}
+    assert _found(client, '999') == set()
+
+
+def test_dashboard_search_is_limited_to_the_mechanics_cars(db, make_user, client_for):
+    mechanic = make_user('Механик', role='mechanic')
+    other = make_user('Друг механик', role='mechanic')
+    _car(db, other, 'CA1234BX', '0888 123 456')
+
+    assert _found(client_for(mechanic), '3456') == set()
@@ -0,0 +1,109 @@
+import re
+from sqlalchemy import select
+from app.models import ChangeCounter, Comment, Post
+
+
+def _counter(db, name):
+    return db.session.scalar(select(ChangeCounter.version).where(ChangeCounter.name == name))
+
+
+def test_unchanged_page_is_answered_with_304(app, db, make_user):
+    author = make_user('Клиент')
+    db.session.add(Post(content='Тропа отпред', user_id=author.id))
+    db.session.commit()
+    client = app.test_client()
+
+    first = client.get('/')
+    assert first.status_code == 200 and first.headers['ETag']
+    again = client.get('/', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
+    assert again.headers['ETag'] == first.headers['ETag']
+
+    db.session.add(Post(content='Свети лампичката', user_id=author.id))
+    db.session.commit()
+    changed = client.get('/', headers={'If-None-Match': first.headers['ETag']})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != first.headers['ETag']
+
+
+def test_edit_changes_the_post_page_etag(app, db, make_user):
+    post = Post(content='Скърцат спирачките', user_id=make_user('Клиент').id)
+    db.session.add(post)
+    db.session.commit()
+    client = app.test_client()
+    etag = client.get(f'/post/{post.id}').headers['ETag']
+
+    post.content = 'Скърцат спирачките на студено'
+    db.session.commit()
+
+    assert client.get(f'/post/{post.id}', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_table_counters_are_bumped_after_the_commit(db, make_user):
+    author = make_user('Клиент')
+    before = _counter(db, 'post') or 0
+    post = Post(content='Не пали сутрин', user_id=author.id)
+    db.session.add(post)
+    db.session.flush()
+
+    # Only the row's counter is written inside the writer's transaction
+    assert _counter(db, f'post:{post.id}') == 1
+    assert (_counter(db, 'post') or 0) == before
+
+    db.session.commit()
+    assert _counter(db, 'post') == before + 1
+
+
+def test_rolled_back_changes_bump_nothing(db, make_user):
+    author = make_user('Клиент')
+    before = _counter(db, 'post') or 0
+    db.session.add(Post(content='Пуши бял дим', user_id=author.id))
+    db.session.flush()
+    db.session.rollback()
+
+    assert (_counter(db, 'post') or 0) == before
+
+
+def _queries(response):
+    return int(re.search(r'"(\d+) queries"', response.headers['Server-Timing']).group(1))
+
+
+def test_polling_the_comments_is_answered_without_running_the_view(app, db, make_user):
+    author = make_user('Клиент')
+    post, other = Post(content='Вибрира волана', user_id=author.id), Post(content='Мирише на изгоряло', user_id=author.id)
+    db.session.add_all([post, other])
+    db.session.commit()
+    post_id, other_id, author_id = post.id, other.id, author.id
+    client = app.test_client()
+    first = client.get(f'/post/{post_id}/comments')
+    assert first.status_code == 200
+
+    again = client.get(f'/post/{post_id}/comments', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304 and again.data == b''
+    # Only the counter lookup: no post, comments or authors were loaded
+    assert _queries(again) == 1
+
+    db.session.add(Comment(content='Баланс на гумите', user_id=author_id, post_id=other_id))
+    db.session.commit()
+    assert client.get(f'/post/{post_id}/comments', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+    db.session.add(Comment(content='Проверете карданите', user_id=author_id, post_id=post_id))
+    db.session.commit()
+    changed = client.get(f'/post/{post_id}/comments', headers={'If-None-Match': first.headers['ETag']})
+    assert changed.status_code == 200
+    assert [comment['content'] for comment in changed.get_json()['comments']] == ['Проверете карданите']
+
+
+def test_last_modified_answers_if_modified_since(app, db, make_user):
+    mechanic = make_user('Механик', role='mechanic')
+    client = app.test_client()
+    first = client.get(f'/mechanic/{mechanic.id}')
+    assert first.status_code == 200 and first.headers['Last-Modified']
+
+    again = client.get(f'/mechanic/{mechanic.id}', headers={'If-Modified-Since': first.headers['Last-Modified']})
+    assert again.status_code == 304
+
+    mechanic.biography = 'Ходова част и спирачки'
+    db.session.commit()
+    changed = client.get(f'/mechanic/{mechanic.id}', headers={'If-None-Match': first.headers['ETag']})
+    assert changed.status_code == 200 and 'Ходова част и спирачки' in changed.get_data(as_text=True)
@@ -0,0 +1,38 @@
+import re
+from app.models import Role, User
+
+
+def _queries(response):
+    return int(re.search(r'"(\d+) queries"', response.headers['Server-Timing']).group(1))
+
+
+def _menu(client):
+    page = client.get('/about').get_data(as_text=True)
+    return re.findall(r'href="/mechanic/\d+">([^<]+)</a>', page)
+
+
+def test_mechanics_menu_is_served_from_the_cache(app, db, make_user):
+    make_user('Механик Иван', role='mechanic')
+    client = app.test_client()
+
+    assert _menu(client) == ['Механик Иван']
+    assert _queries(client.get('/about')) == 0
+
+
+def test_mechanics_menu_follows_role_and_profile_changes(app, db, make_user):
+    mechanic = make_user('Механик Иван', role='mechanic')
+    customer = make_user('Петър')
+    client = app.test_client()
+    assert _menu(client) == ['Механик Иван']
+
+    customer.roles.append(Role.query.filter_by(name='mechanic').one())
+    db.session.commit()
+    assert _menu(client) == ['Механик Иван', 'Петър']
+
+    db.session.get(User, mechanic.id).username = 'Механик Иван Петров'
+    db.session.commit()
+    assert _menu(client) == ['Механик Иван Петров', 'Петър']
+
+    db.session.get(User, customer.id).roles = []
+    db.session.commit()
+    assert _menu(client) == ['Механик Иван Петров']
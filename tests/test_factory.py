@@ -0,0 +1,24 @@
+from app import create_app, db
+
+
+def test_each_call_builds_an_independent_app(app, tmp_path):
+    other = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "other.db"}'})
+    assert other is not app
+    assert other.config['SQLALCHEMY_DATABASE_URI'] != app.config['SQLALCHEMY_DATABASE_URI']
+    with other.app_context():
+        assert str(db.engine.url).endswith('other.db')
+    with app.app_context():
+        assert str(db.engine.url).endswith('test.db')
+
+
+def test_config_is_read_when_the_app_is_created(monkeypatch):
+    monkeypatch.setenv('SQL_QUERY_BUDGET', '12')
+    assert create_app({'TESTING': True}).config['SQL_QUERY_BUDGET'] == 12
+
+
+def test_hooks_and_commands_are_registered_per_app(app, db):
+    other = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': app.config['SQLALCHEMY_DATABASE_URI']})
+    assert {'gc-images', 'check-query-plans', 'db'} <= set(other.cli.commands)
+    response = other.test_client().get('/about')
+    assert response.status_code == 200
+    assert 'Server-Timing' in response.headers
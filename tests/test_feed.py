@@ -0,0 +1,53 @@
+import re
+from datetime import datetime, timedelta
+from app.models import Comment, Post
+
+
+def _queries(response):
+    return int(re.search(r'"(\d+) queries"', response.headers['Server-Timing']).group(1))
+
+
+def _post(db, author_id, commenter_ids, number, comments=3):
+    now = datetime.utcnow()
+    post = Post(content=f'Пост {number}', user_id=author_id, date_posted=now - timedelta(hours=number))
+    post.comments = [Comment(content=f'Коментар {number}.{index}', user_id=commenter_ids[(number * comments + index) % len(commenter_ids)],
+                             date_posted=now + timedelta(minutes=index))
+                     for index in range(comments)]
+    db.session.add(post)
+    db.session.commit()
+
+
+def test_home_shows_the_first_comments_of_each_post(app, db, make_user):
+    author = make_user('Клиент').id
+    mechanic = make_user('Механик', role='mechanic').id
+    _post(db, author, [mechanic, author], 0)
+    _post(db, author, [mechanic], 1, comments=1)
+    db.session.expunge_all()
+
+    page = app.test_client().get('/').get_data(as_text=True)
+
+    assert 'Коментар 0.0' in page and 'Коментар 0.1' in page and 'Коментар 0.2' not in page
+    assert 'Коментар 1.0' in page
+    # Only the post with more comments than shown links to the rest
+    assert page.count('Виж коментарите...') == 1
+    # Mechanic commenters link to their profile
+    assert f'/mechanic/{mechanic}"' in page
+
+
+def test_feed_query_count_does_not_grow_with_the_page(app, db, make_user):
+    # Every post gets its own author and commenters, so lazy loading would
+    # cost more queries per post
+    commenters = [make_user(f'Механик {number}', role='mechanic').id for number in range(15)]
+    authors = [make_user(f'Клиент {number}').id for number in range(5)]
+    _post(db, authors[0], commenters, 0)
+    client = app.test_client()
+    client.get('/')
+    client.get('/posts')
+    db.session.expunge_all()
+    one_post = (_queries(client.get('/')), _queries(client.get('/posts')))
+
+    for number in range(1, 5):
+        _post(db, authors[number], commenters, number)
+    db.session.expunge_all()
+
+    assert (_queries(client.get('/')), _queries(client.get('/posts'))) == one_post
@@ -0,0 +1,52 @@
+from sqlalchemy import update
+from app.cache import LRUCache
+from app.fragments import FragmentCache
+from app.models import RepairShopImage, User
+
+
+def test_invalidating_a_tag_renders_its_fragments_again():
+    cache = FragmentCache(LRUCache())
+    renders = []
+
+    def render():
+        renders.append(1)
+        return f'<ul>{len(renders)}</ul>'
+
+    assert cache.render('menu', ['user'], render) == '<ul>1</ul>'
+    assert cache.render('menu', ['user'], render) == '<ul>1</ul>'
+    cache.invalidate('role')
+    assert cache.render('menu', ['user'], render) == '<ul>1</ul>'
+    cache.invalidate('user')
+    assert cache.render('menu', ['user'], render) == '<ul>2</ul>'
+    # Tags nothing was rendered under are not stored
+    assert cache.backend.get('tag:role') is None
+
+
+def test_profile_card_is_cached_until_its_mechanic_changes(app, db, make_user):
+    mechanic = make_user('Механик', role='mechanic', biography='Ходова част')
+    mechanic_id = mechanic.id
+    client = app.test_client()
+    assert 'Ходова част' in client.get(f'/mechanic/{mechanic_id}').get_data(as_text=True)
+
+    # Written behind the ORM's back: nothing invalidates the card
+    db.session.execute(update(User).where(User.id == mechanic_id).values(biography='Спирачки'))
+    db.session.commit()
+    db.session.expire_all()
+    assert 'Ходова част' in client.get(f'/mechanic/{mechanic_id}').get_data(as_text=True)
+
+    # A new repair shop image touches its owner's tag
+    db.session.add(RepairShopImage(image_file='0123456789abcdef.jpg', user_id=mechanic_id))
+    db.session.commit()
+    page = client.get(f'/mechanic/{mechanic_id}').get_data(as_text=True)
+    assert 'Спирачки' in page and 'Ходова част' not in page
+
+
+def test_home_mechanics_section_follows_a_rename(app, db, make_user):
+    mechanic = make_user('Механик', role='mechanic')
+    client = app.test_client()
+    assert 'Механик' in client.get('/').get_data(as_text=True)
+
+    mechanic.username = 'Тенекеджия'
+    db.session.commit()
+    page = client.get('/').get_data(as_text=True)
+    assert 'Тенекеджия' in page and 'Механик' not in page
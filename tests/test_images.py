@@ -0,0 +1,110 @@
+import io
+import os
+from concurrent.futures import Future
+import pytest
+from PIL import Image
+from app import images
+from app.models import RepairShopImage, User, user_cache
+
+BROKEN = '0123456789abcdef.jpg'
+
+
+def _failed_job():
+    future = Future()
+    future.set_exception(OSError('cannot identify image file'))
+    return future
+
+
+def test_failed_processing_drops_the_references(app, db, make_user, monkeypatch):
+    monkeypatch.setattr(images, '_pending', 2)
+    user = make_user('Механик', role='mechanic', image_file=BROKEN)
+    db.session.add(RepairShopImage(image_file=BROKEN, user_id=user.id))
+    db.session.commit()
+    user_cache.set(user.id, 'stale')
+
+    images._job_done(app, 'profile_pics', BROKEN, _failed_job())
+    images._job_done(app, 'repair_shop_pics', BROKEN, _failed_job())
+
+    db.session.expire_all()
+    assert db.session.get(User, user.id).image_file == 'default.jpg'
+    assert RepairShopImage.query.count() == 0
+    assert user_cache.get(user.id) is None
+    assert images.pending_jobs() == 0
+
+
+def test_picture_that_failed_before_its_row_committed_falls_back(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'instance_path', str(tmp_path))
+    with app.test_request_context():
+        assert 'profile_pics/default.jpg' in images.picture('profile_pics', BROKEN, 64)
+        assert images.picture('repair_shop_pics', BROKEN, 320) == ''
+
+        # Still staged: the placeholder waits for it
+        (tmp_path / 'staging').mkdir(exist_ok=True)
+        (tmp_path / 'staging' / f'profile_pics-{BROKEN}').write_bytes(b'')
+        assert 'data-pending-src' in images.picture('profile_pics', BROKEN, 64)
+
+
+@pytest.fixture
+def uploads(app, db, make_user, client_for, tmp_path, monkeypatch):
+    # Pictures go to a scratch static folder instead of the app's own.
+    # The template loader is bound to the real root_path first.
+    app.jinja_loader
+    monkeypatch.setattr(app, 'root_path', str(tmp_path))
+    monkeypatch.setattr(app, 'instance_path', str(tmp_path / 'instance'))
+    monkeypatch.setitem(app.config, 'IMAGE_WORKERS', 0)
+    monkeypatch.setitem(app.config, 'IMAGE_GC_GRACE', 0)
+    for folder in images.REFERENCES:
+        (tmp_path / 'static' / folder).mkdir(parents=True)
+    user = make_user('Механик', role='mechanic', email='mechanic@example.bg')
+    client = client_for(user)
+    user_id = user.id
+
+    def upload(color, size=(800, 600)):
+        data = io.BytesIO()
+        Image.new('RGB', size, color).save(data, format='PNG')
+        data.seek(0)
+        response = client.post('/account', data={'username': 'Механик', 'email': 'mechanic@example.bg',
+                                                  'picture': (data, 'snimka.png')})
+        assert response.status_code == 302
+        db.session.expire_all()
+        return db.session.get(User, user_id).image_file
+    upload.client = client
+    upload.folder = tmp_path / 'static' / 'profile_pics'
+    return upload
+
+
+def test_identical_uploads_share_one_immutable_blob(uploads):
+    name = uploads('red')
+    assert uploads('red') == name
+    assert os.listdir(uploads.folder) == [name]
+
+    response = uploads.client.get(f'/static/profile_pics/{name}')
+    assert response.status_code == 200
+    assert 'immutable' in response.headers['Cache-Control']
+    assert 'max-age=31536000' in response.headers['Cache-Control']
+
+    # Replacing the picture releases the last reference to the old blob
+    replacement = uploads('blue')
+    assert replacement != name
+    assert os.listdir(uploads.folder) == [replacement]
+
+
+def test_derivatives_are_rendered_on_request(uploads):
+    name = uploads('green')
+    digest = name.split('.')[0]
+    page = uploads.client.get('/account').get_data(as_text=True)
+    assert f'/img/{digest}/64 64w' in page and f'/img/{digest}/320.webp 320w' in page
+    assert f'<img src="/static/profile_pics/{name}" srcset="/img/{digest}/64 64w' in page
+    assert f'/static/profile_pics/{name} 500w' in page
+
+    response = uploads.client.get(f'/img/{digest}/64')
+    assert response.status_code == 200 and 'immutable' in response.headers['Cache-Control']
+    with Image.open(io.BytesIO(response.data)) as thumbnail:
+        assert thumbnail.format == 'PNG' and thumbnail.width == 64
+    with Image.open(io.BytesIO(uploads.client.get(f'/img/{digest}/128.webp').data)) as thumbnail:
+        assert thumbnail.format == 'WEBP' and thumbnail.width == 128
+
+    again = uploads.client.get(f'/img/{digest}/64', headers={'If-None-Match': response.headers['ETag']})
+    assert again.status_code == 304
+    assert uploads.client.get(f'/img/{digest}/100').status_code == 404
+    assert uploads.client.get('/img/0000000000000000/64').status_code == 404
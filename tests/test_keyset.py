@@ -0,0 +1,67 @@
+import re
+from datetime import datetime, timedelta
+from app.models import Comment, Post
+
+
+def _posts(db, author, count, same_time=False):
+    now = datetime.utcnow()
+    posts = [Post(content=f'Пост {number}', user_id=author.id,
+                  date_posted=now if same_time else now - timedelta(minutes=number))
+             for number in range(count)]
+    db.session.add_all(posts)
+    db.session.commit()
+    return [post.id for post in posts]
+
+
+def _archive(client, url):
+    page = client.get(url).get_data(as_text=True)
+    ids = [int(post_id) for post_id in re.findall(r'href="/post/(\d+)"', page)]
+    more = re.search(r'id="load-more-posts"[^>]*href="([^"]+)"', page)
+    return ids, more and more.group(1).replace('&amp;', '&')
+
+
+def test_posts_archive_pages_forward_with_a_cursor(app, db, make_user):
+    ids = _posts(db, make_user('Клиент'), 25)
+    client = app.test_client()
+
+    first, more = _archive(client, '/posts')
+    assert first == ids[:20] and 'cursor=' in more
+    second, more = _archive(client, more)
+    assert second == ids[20:] and more is None
+
+
+def test_posts_with_the_same_timestamp_are_neither_skipped_nor_repeated(app, db, make_user):
+    ids = _posts(db, make_user('Клиент'), 23, same_time=True)
+    client = app.test_client()
+
+    first, more = _archive(client, '/posts')
+    second, _ = _archive(client, more)
+    assert first + second == sorted(ids, reverse=True)
+
+
+def test_comments_api_pages_oldest_first(app, db, make_user):
+    author = make_user('Клиент')
+    post = Post(content='Пост', user_id=author.id)
+    now = datetime.utcnow()
+    post.comments = [Comment(content=f'Коментар {number}', user_id=author.id, date_posted=now + timedelta(minutes=number))
+                     for number in range(5)]
+    db.session.add(post)
+    db.session.commit()
+    client = app.test_client()
+
+    seen, cursor = [], None
+    while True:
+        body = client.get(f'/post/{post.id}/comments', query_string={'limit': 2, 'cursor': cursor or ''}).get_json()
+        seen += [comment['content'] for comment in body['comments']]
+        cursor = body['next_cursor']
+        if not cursor:
+            break
+    assert seen == [f'Коментар {number}' for number in range(5)]
+
+
+def test_malformed_cursor_is_a_bad_request(app, db, make_user):
+    post_id = _posts(db, make_user('Клиент'), 1)[0]
+    client = app.test_client()
+
+    assert client.get('/posts?cursor=garbage').status_code == 400
+    assert client.get(f'/post/{post_id}/comments?cursor=garbage').status_code == 400
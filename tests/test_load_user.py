@@ -0,0 +1,53 @@
+from sqlalchemy import delete, event
+from app.models import User, Role, load_user, user_cache, user_roles
+
+
+def _change_elsewhere(db, *statements):
+    # As another worker would: straight to the database, this process's
+    # user_cache is not told
+    for statement in statements:
+        db.session.execute(statement)
+    db.session.commit()
+    db.session.expire_all()
+
+
+def test_cached_user_needs_no_query(db, make_user):
+    user = make_user('Механик', role='mechanic')
+    user_cache.invalidate(user.id)
+    assert load_user(str(user.id)).is_mechanic()
+
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        assert load_user(str(user.id)).is_mechanic()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    assert statements == []
+
+
+def test_invalidated_user_is_reloaded(db, make_user):
+    user = make_user('Механик', role='mechanic')
+    assert load_user(str(user.id)).is_mechanic()
+
+    mechanic = Role.query.filter_by(name='mechanic').one()
+    _change_elsewhere(db, delete(user_roles).where(user_roles.c.user_id == user.id, user_roles.c.role_id == mechanic.id))
+    # Still cached until the TTL runs out or this process is told
+    assert load_user(str(user.id)).is_mechanic()
+
+    user_cache.invalidate(user.id)
+    assert not load_user(str(user.id)).is_mechanic()
+
+
+def test_snapshot_expires_after_the_ttl(db, make_user, monkeypatch):
+    user = make_user('Клиент')
+    user_id = user.id
+    assert load_user(str(user_id)) is not None
+
+    _change_elsewhere(db, delete(user_roles).where(user_roles.c.user_id == user_id),
+                      delete(User).where(User.id == user_id))
+    monkeypatch.setattr(user_cache, 'ttl', 0)
+
+    assert load_user(str(user_id)) is None
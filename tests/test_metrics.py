@@ -0,0 +1,37 @@
+import gc
+import threading
+from app.metrics import Counter, Registry, registry
+
+
+def test_finished_threads_fold_into_one_shard():
+    metric = Counter('test_thread_requests_total', 'Requests in the thread test')
+    threads = [threading.Thread(target=metric.inc) for _ in range(300)]
+    for thread in threads:
+        thread.start()
+        thread.join()
+    gc.collect()
+
+    assert len(registry._shards) < 10
+    assert registry.collect()['test_thread_requests_total'] == {(): 300}
+
+
+def test_live_threads_keep_their_shards():
+    local = Registry()
+    local.metrics['live_total'] = None
+    started, release = threading.Event(), threading.Event()
+
+    def work():
+        values = local.shard()
+        values[('live_total', ())] = 1
+        started.set()
+        release.wait()
+
+    thread = threading.Thread(target=work)
+    thread.start()
+    started.wait()
+    assert local.collect()['live_total'] == {(): 1}
+    release.set()
+    thread.join()
+    gc.collect()
+    assert local.collect()['live_total'] == {(): 1}
+    assert local._shards == []
@@ -0,0 +1,59 @@
+import re
+from app.models import Car, CarOwner, Post
+from app.pagination import Pagination, cached_count
+
+
+def _posts(db, author, count):
+    db.session.add_all(Post(content=f'Чука двигателят {number}', user_id=author.id) for number in range(count))
+    db.session.commit()
+
+
+def test_approximate_count_reports_a_lower_bound_past_the_cap(db, make_user):
+    _posts(db, make_user('Клиент'), 5)
+
+    assert cached_count(Post.query, [Post], approximate=True, cap=3) == (3, False)
+    assert cached_count(Post.query, [Post], approximate=True, cap=5) == (5, True)
+    assert cached_count(Post.query, [Post]) == (5, True)
+
+
+def test_inexact_total_limits_the_numbered_pages(app):
+    with app.test_request_context('/mechanic_dashboard?search=CA'):
+        pagination = Pagination(page=1, per_page=10, total=1000, exact=False, next_cursor='next',
+                                css_framework='bootstrap4')
+        assert pagination.total_pages == 100
+        assert 'more than <b>1000</b>' in pagination.info
+
+        deep = Pagination(page=150, per_page=10, total=1000, exact=False, css_framework='bootstrap4')
+        assert deep.total_pages == 150
+
+
+def test_page_links_do_not_share_the_cursor(app):
+    with app.test_request_context('/posts?page=2&cursor=old'):
+        pagination = Pagination(page=2, per_page=10, total=50, next_cursor='next', css_framework='bootstrap4')
+        links = [pagination.page_href(page) for page in (3, 1, 4)]
+
+    assert 'cursor=next' in links[0] and 'page=3' in links[0]
+    assert 'cursor' not in links[1] and 'cursor' not in links[2]
+    assert pagination.args == {'page': '2'}
+
+
+def test_dashboard_total_follows_committed_changes(db, make_user, client_for):
+    mechanic = make_user('Механик', role='mechanic')
+    owner = CarOwner(name='Собственик', phone_number='0888123456')
+    db.session.add_all(Car(registration_number=f'CA{number:04}AB', mechanic_id=mechanic.id, owner=owner)
+                       for number in range(4))
+    db.session.commit()
+    client = client_for(mechanic)
+
+    def page_links():
+        page = client.get('/mechanic_dashboard?per_page=2').get_data(as_text=True)
+        return {int(number) for number in re.findall(r'page=(\d+)', page)}
+
+    assert max(page_links()) == 2
+    car = Car(registration_number='CA0004AB', mechanic_id=mechanic.id, owner=owner)
+    db.session.add(car)
+    db.session.commit()
+    assert max(page_links()) == 3
+
+    client.post(f'/delete_car/{car.id}')
+    assert max(page_links()) == 2
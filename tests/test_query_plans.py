@@ -0,0 +1,32 @@
+from datetime import datetime, timedelta
+from app.models import Car, CarOwner, CarVisit, Post, Comment
+from app.queryplans import ROUTES, check_routes
+
+
+def _seed(db, make_user):
+    mechanic = make_user('Механик', role='mechanic')
+    make_user('Админ', role='admin')
+    customer = make_user('Клиент')
+    now = datetime.utcnow()
+    for number in range(20):
+        owner = CarOwner(name=f'Собственик {number}', phone_number=f'08877{number:05d}')
+        car = Car(registration_number=f'CA{number:04d}AB', owner=owner, mechanic_id=mechanic.id,
+                  date_created=now - timedelta(days=number), visibility=number % 5 != 0)
+        car.visits = [CarVisit(description=f'Смяна на масло {number}', date=now - timedelta(days=day))
+                      for day in range(3)]
+        post = Post(content=f'Тропа отпред {number}', user_id=customer.id, date_posted=now - timedelta(hours=number))
+        post.comments = [Comment(content='Проверете носача', user_id=mechanic.id) for _ in range(2)]
+        db.session.add_all([car, post])
+    db.session.commit()
+
+
+def test_hot_queries_use_indexes(db, make_user):
+    _seed(db, make_user)
+
+    results = list(check_routes())
+
+    assert len(results) == len(ROUTES)
+    assert [url for who, url, status, queries, problems in results if status != 200] == []
+    scans = {url: [" ".join(statement.split()) for statement, _ in problems]
+             for who, url, status, queries, problems in results if problems}
+    assert scans == {}
@@ -0,0 +1,53 @@
+from sqlalchemy import event
+from app.models import Comment, Post, user_cache
+
+ROLE_LOOKUP = 'role.name AS role_name FROM user_roles JOIN role'
+LAZY_ROLES = 'FROM role, user_roles'
+
+
+def _statements(db, request):
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(' '.join(statement.split()))
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        response = request()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    return response, statements
+
+
+def test_roles_are_resolved_in_bulk_once_per_request(app, db, make_user, client_for):
+    viewer = make_user('Механик', role='mechanic')
+    commenters = [make_user(f'Механик {number}', role='mechanic').id for number in range(4)]
+    author = make_user('Клиент').id
+    for number in range(4):
+        post = Post(content=f'Пост {number}', user_id=author)
+        post.comments = [Comment(content='Коментар', user_id=commenters[number])]
+        db.session.add(post)
+    db.session.commit()
+    client = client_for(viewer)
+    user_cache.clear()
+    db.session.expunge_all()
+
+    response, statements = _statements(db, lambda: client.get('/'))
+
+    page = response.get_data(as_text=True)
+    # The mechanic navigation and the links to commenting mechanics
+    assert 'Клиенти' in page
+    assert all(f'/mechanic/{commenter}"' in page for commenter in commenters)
+    # One lookup for the signed-in user, one for everyone on the page
+    assert [statement for statement in statements if LAZY_ROLES in statement] == []
+    assert len([statement for statement in statements if ROLE_LOOKUP in statement]) == 2
+
+
+def test_signed_in_user_roles_come_from_the_user_cache(app, db, make_user, client_for):
+    client = client_for(make_user('Механик', role='mechanic'))
+    client.get('/about')
+    db.session.expunge_all()
+
+    response, statements = _statements(db, lambda: client.get('/about'))
+
+    assert 'Клиенти' in response.get_data(as_text=True)
+    assert statements == []
@@ -0,0 +1,113 @@
+# Hot pages rendered over enough rows that an N+1 would push them past
+# their @query_budget, which SQL_STRICT turns into a test failure.
+
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import pytest
+from app.instrumentation import QueryBudgetExceeded
+from app.models import Car, CarOwner, CarVisit, Comment, Post
+
+
+@pytest.fixture
+def garage(db, make_user):
+    mechanics = [make_user(f'Механик {number}', role='mechanic') for number in range(3)]
+    customers = [make_user(f'Клиент {number}') for number in range(3)]
+    admin = make_user('Админ', role='admin')
+    now = datetime.utcnow()
+    for number in range(12):
+        mechanic = mechanics[number % 3]
+        post = Post(content=f'Тропа отпред при завой {number}', user_id=customers[number % 3].id,
+                    date_posted=now - timedelta(hours=number))
+        post.comments = [Comment(content=f'Проверете тампоните {number}', user_id=mechanics[i].id) for i in range(3)]
+        car = Car(registration_number=f'CA{number:04d}BX', mechanic_id=mechanic.id,
+                  owner=CarOwner(name=f'Собственик {number}', phone_number=f'0888{number:06d}'),
+                  date_created=now - timedelta(days=number))
+        car.visits = [CarVisit(description=f'Смяна на масло и филтри {day}', date=now - timedelta(days=30 * day))
+                      for day in range(8)]
+        db.session.add_all([post, car])
+    db.session.commit()
+    ids = {'mechanic': mechanics[0].id, 'admin': admin.id,
+           'car': Car.query.filter_by(mechanic_id=mechanics[0].id).first().id}
+    # Requests should load what they need themselves
+    db.session.expunge_all()
+    return ids
+
+
+@pytest.fixture
+def as_user(garage, client_for):
+    return lambda role: client_for(SimpleNamespace(id=garage[role]))
+
+
+def _ok(response):
+    assert response.status_code == 200, response.status_code
+    return response.get_data(as_text=True)
+
+
+def test_home(app, garage):
+    page = _ok(app.test_client().get('/'))
+    assert 'Тропа отпред при завой 0' in page and 'Проверете тампоните 0' in page
+
+
+def test_search(app, garage):
+    page = _ok(app.test_client().get('/search', query_string={'query': 'тропа'}))
+    assert 'Тропа' in page
+    assert 'Механик 0' in _ok(app.test_client().get('/search', query_string={'query': 'механик'}))
+
+
+def test_mechanic_dashboard(as_user):
+    client = as_user('mechanic')
+    assert 'CA0000BX' in _ok(client.get('/mechanic_dashboard'))
+    assert 'CA0003BX' in _ok(client.get('/mechanic_dashboard', query_string={'search': 'ca0003'}))
+
+
+def test_car_detail(as_user, garage):
+    client = as_user('mechanic')
+    assert 'Смяна на масло' in _ok(client.get(f'/car/{garage["car"]}'))
+    _ok(client.get(f'/car/{garage["car"]}', query_string={'search': f'{datetime.utcnow().year} масло'}))
+
+
+def test_admin_cars(as_user, garage):
+    client = as_user('admin')
+    page = _ok(client.get('/admin_cars'))
+    assert 'CA0000BX' in page and 'CA0011BX' in page
+    _ok(client.get('/admin_cars', query_string={'owner': '0888', 'mechanic_id': garage['mechanic']}))
+
+
+def test_admin_cars_filters_and_pages(as_user, garage):
+    client = as_user('admin')
+    page = _ok(client.get('/admin_cars', query_string={'mechanic_id': garage['mechanic']}))
+    assert all(f'CA{number:04d}BX' in page for number in (0, 3, 6, 9))
+    assert 'CA0001BX' not in page
+
+    first = _ok(client.get('/admin_cars', query_string={'per_page': 5}))
+    assert 'CA0004BX' in first and 'CA0005BX' not in first
+    assert 'page=3' in first and 'page=4' not in first
+
+
+def test_admin_cars_export_streams_the_filtered_rows(as_user, garage):
+    client = as_user('admin')
+    response = client.get('/admin_cars/export.csv', query_string={'mechanic_id': garage['mechanic']})
+    assert response.is_streamed and response.mimetype == 'text/csv'
+    header, *rows = csv.reader(io.StringIO(response.get_data(as_text=True)))
+    assert header[:2] == ['id', 'registration_number']
+    assert [row[1] for row in rows] == ['CA0000BX', 'CA0003BX', 'CA0006BX', 'CA0009BX']
+    assert {row[8] for row in rows} == {'Механик 0'}
+
+    response = client.get('/admin_cars/export.json', query_string={'owner': 'Собственик 1'})
+    records = json.loads(response.get_data(as_text=True))
+    assert [record['registration_number'] for record in records] == ['CA0001BX', 'CA0010BX', 'CA0011BX']
+    assert records[0]['owner_phone_number'] == '0888000001'
+
+
+def test_export_is_for_admins_only(as_user):
+    response = as_user('mechanic').get('/admin_cars/export.csv')
+    assert response.status_code == 302
+
+
+def test_strict_mode_fails_a_view_over_budget(app, garage, monkeypatch):
+    monkeypatch.setattr(app.view_functions['public.home'], 'query_budget', 1)
+    with pytest.raises(QueryBudgetExceeded):
+        app.test_client().get('/')
@@ -0,0 +1,20 @@
+from app.search import search_mechanics
+
+
+def test_search_mechanics_finds_mechanics_outranked_by_customers(make_user):
+    # Short usernames rank higher, so every customer outranks every mechanic
+    for number in range(60):
+        make_user(f'Иванов {number}')
+    mechanics = [make_user(f'Георги Петров Иванов сервиз {number}', role='mechanic') for number in range(3)]
+
+    found = search_mechanics('Иванов')
+
+    assert {user.id for user in found} == {user.id for user in mechanics}
+
+
+def test_search_mechanics_respects_limit(make_user):
+    for number in range(5):
+        make_user(f'Станев {number}', role='mechanic')
+
+    assert len(search_mechanics('Станев', limit=3)) == 3
+    assert search_mechanics('') == []
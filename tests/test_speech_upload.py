@@ -0,0 +1,79 @@
+import io
+import threading
+import time
+from app import audio
+
+BOUNDARY = 'recording'
+
+
+def _multipart(audio):
+    return (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="audio"; filename="a.wav"\r\n'
+            f'Content-Type: audio/wav\r\n\r\n').encode() + audio + f'\r\n--{BOUNDARY}--\r\n'.encode()
+
+
+def _post(client, body=None, **kwargs):
+    return client.post('/speech_to_text', content_type=f'multipart/form-data; boundary={BOUNDARY}', data=body, **kwargs)
+
+
+def test_multipart_upload_over_the_limit_is_rejected(app, make_user, client_for, monkeypatch):
+    monkeypatch.setitem(app.config, 'SPEECH_MAX_UPLOAD_BYTES', 1000)
+    client = client_for(make_user('Механик', role='mechanic'))
+
+    response = _post(client, _multipart(b'\0' * 5000))
+
+    assert response.status_code == 413
+
+
+def test_chunked_upload_without_content_length_is_rejected(app, make_user, client_for, monkeypatch):
+    monkeypatch.setitem(app.config, 'SPEECH_MAX_UPLOAD_BYTES', 1000)
+    client = client_for(make_user('Механик', role='mechanic'))
+
+    # As a server passes on a chunked request body: no Content-Length,
+    # the stream ends where the body does
+    response = _post(client, input_stream=io.BytesIO(_multipart(b'\0' * 5000)),
+                     headers={'Transfer-Encoding': 'chunked'},
+                     environ_overrides={'wsgi.input_terminated': True})
+
+    assert response.status_code == 413
+    assert response.get_json() == {'error': 'Recording too long'}
+
+
+class SlowStream:
+    # A request body that stalls after signalling its first read
+    def __init__(self, data, started, resume):
+        self.data, self.started, self.resume = io.BytesIO(data), started, resume
+
+    def read(self, size):
+        self.started.set()
+        self.resume.wait(timeout=5)
+        return self.data.read(size)
+
+
+def test_racing_chunks_for_the_same_offset_are_appended_once(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'instance_path', str(tmp_path))
+    started, resume = threading.Event(), threading.Event()
+    results = []
+
+    def put(stream):
+        with app.app_context():
+            try:
+                results.append(audio.append_chunk(1, upload_id, 0, stream, 4))
+            except audio.UploadError as e:
+                results.append((e.status, e.received))
+
+    with app.app_context():
+        upload_id = audio.create_upload(1)
+    first = threading.Thread(target=put, args=(SlowStream(b'abcd', started, resume),))
+    first.start()
+    started.wait(timeout=5)
+    # The retry checks the offset while the original is still writing
+    retry = threading.Thread(target=put, args=(io.BytesIO(b'abcd'),))
+    retry.start()
+    time.sleep(0.1)
+    resume.set()
+    first.join()
+    retry.join()
+
+    assert sorted(results, key=str) == [(409, 4), 4]
+    with app.app_context():
+        assert audio.received_bytes(1, upload_id) == 4
@@ -0,0 +1,68 @@
+import shutil
+import threading
+import time
+import wave
+from app import transcription
+
+
+def _wav(path, seconds=1, rate=16000):
+    with wave.open(str(path), 'wb') as audio:
+        audio.setnchannels(1)
+        audio.setsampwidth(2)
+        audio.setframerate(rate)
+        audio.writeframes(b'\x01\x00' * rate * seconds)
+    return str(path)
+
+
+class RecordingExecutor:
+    def __init__(self):
+        self.calls = []
+
+    def submit(self, fn, *args):
+        self.calls.append((fn, args))
+
+
+def test_identical_uploads_submitted_together_share_one_job(app, tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'instance_path', str(tmp_path))
+    monkeypatch.setitem(app.config, 'SPEECH_BACKEND', 'local')
+    executor = RecordingExecutor()
+    monkeypatch.setattr(transcription, '_get_executor', lambda: executor)
+    # Both requests have hashed their audio before either looks for the
+    # job, and take a while to decide about what they found
+    both_hashed = threading.Barrier(2)
+    digest, reusable = transcription.audio_digest, transcription._reusable
+
+    def audio_digest(path):
+        result = digest(path)
+        both_hashed.wait(timeout=5)
+        return result
+
+    def slow_reusable(job):
+        time.sleep(0.1)
+        return reusable(job)
+    monkeypatch.setattr(transcription, 'audio_digest', audio_digest)
+    monkeypatch.setattr(transcription, '_reusable', slow_reusable)
+
+    first = _wav(tmp_path / 'first.part')
+    second = shutil.copy(first, str(tmp_path / 'second.part'))
+    results = []
+
+    def submit(path):
+        with app.app_context():
+            results.append(transcription.submit(path))
+    threads = [threading.Thread(target=submit, args=(path,)) for path in (first, second)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 2 and results[0][0] == results[1][0]
+    assert len(executor.calls) == 1
+    # The second upload was discarded instead of replacing the queued audio
+    assert not (tmp_path / 'first.part').exists() and not (tmp_path / 'second.part').exists()
+
+    fn, args = executor.calls[0]
+    fn(*args)
+    with app.app_context():
+        assert transcription.read_job(results[0][0])['status'] == 'done'
+    assert transcription.pending_jobs() == 0
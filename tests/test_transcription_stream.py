@@ -0,0 +1,54 @@
+import json
+import pytest
+from app.transcription import _write_job, read_job
+
+
+@pytest.fixture
+def mechanic_client(app, make_user, client_for, tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'instance_path', str(tmp_path))
+    monkeypatch.setitem(app.config, 'SPEECH_STREAM_WINDOW', 0)
+    return client_for(make_user('Механик', role='mechanic'))
+
+
+def _stream(client, job_id, last_id=None):
+    headers = {'Accept': 'text/event-stream'}
+    if last_id is not None:
+        headers['Last-Event-ID'] = last_id
+    return client.get(f'/speech_to_text/jobs/{job_id}', headers=headers).get_data(as_text=True)
+
+
+def test_stream_ends_after_its_window_and_resumes(mechanic_client):
+    _write_job('job1', status='running', transcript='', partial='смяна на')
+    updated = repr(read_job('job1')['updated'])
+
+    body = _stream(mechanic_client, 'job1')
+    assert body.startswith('retry: ')
+    assert f'id: {updated}\nevent: partial\ndata: {json.dumps({"transcript": "смяна на"})}' in body
+    assert 'event: error' not in body
+
+    # Reconnecting with the id already seen sends nothing new
+    assert 'event:' not in _stream(mechanic_client, 'job1', updated)
+
+    _write_job('job1', status='done', transcript='смяна на масло', partial='')
+    done = repr(read_job('job1')['updated'])
+    body = _stream(mechanic_client, 'job1', updated)
+    assert 'event: final' in body and 'event: done' in body
+    # The final transcript is not repeated to a client that has it
+    assert 'event: final' not in _stream(mechanic_client, 'job1', done)
+
+
+def test_stale_job_times_out(app, mechanic_client, monkeypatch):
+    monkeypatch.setitem(app.config, 'SPEECH_JOB_TIMEOUT', -1)
+    _write_job('job2', status='running', transcript='', partial='')
+
+    assert 'Transcription timed out' in _stream(mechanic_client, 'job2')
+
+
+def test_stream_does_not_hold_a_database_connection(app, db, mechanic_client):
+    _write_job('job3', status='running', transcript='', partial='')
+
+    response = mechanic_client.get('/speech_to_text/jobs/job3', headers={'Accept': 'text/event-stream'},
+                                   buffered=False)
+    assert next(response.response).startswith(b'retry: ')
+    assert db.engine.pool.checkedout() == 0
+    response.close()
@@ -0,0 +1,66 @@
+import re
+from datetime import datetime
+import pytest
+from app.models import Car, CarOwner, CarVisit
+from app.visits import parse_visit_search
+
+
+@pytest.mark.parametrize('query, start, end', [
+    ('05.03.2024', datetime(2024, 3, 5), datetime(2024, 3, 6)),
+    ('2024-03-05', datetime(2024, 3, 5), datetime(2024, 3, 6)),
+    ('03.2024', datetime(2024, 3, 1), datetime(2024, 4, 1)),
+    ('2024-03', datetime(2024, 3, 1), datetime(2024, 4, 1)),
+    ('2024-12', datetime(2024, 12, 1), datetime(2025, 1, 1)),
+    ('2024', datetime(2024, 1, 1), datetime(2025, 1, 1)),
+    ('01.01.2024 - 31.03.2024', datetime(2024, 1, 1), datetime(2024, 4, 1)),
+    ('2023 - 2024', datetime(2023, 1, 1), datetime(2025, 1, 1)),
+])
+def test_dates_become_half_open_ranges(query, start, end):
+    assert parse_visit_search(query) == (start, end, '')
+
+
+def test_date_is_taken_out_of_the_text_query():
+    assert parse_visit_search('смяна масло 2024-03') == (datetime(2024, 3, 1), datetime(2024, 4, 1), 'смяна масло')
+
+
+@pytest.mark.parametrize('query', ['2024-13', '31.02.2024', 'ремонт 12345'])
+def test_invalid_dates_are_left_as_text(query):
+    assert parse_visit_search(query) == (None, None, query)
+
+
+@pytest.fixture
+def car_with_visits(db, make_user, client_for):
+    mechanic = make_user('Механик', role='mechanic')
+    car = Car(registration_number='CA1234BX', mechanic_id=mechanic.id,
+              owner=CarOwner(name='Собственик', phone_number='0888123456'))
+    car.visits = [
+        CarVisit(description='Смяна на масло', date=datetime(2023, 11, 20)),
+        CarVisit(description='Смяна на накладки', date=datetime(2024, 3, 5)),
+        CarVisit(description='Масло и филтри', date=datetime(2024, 3, 28)),
+        CarVisit(description='Геометрия', date=datetime(2024, 4, 1)),
+    ]
+    db.session.add(car)
+    db.session.commit()
+    return client_for(mechanic), car.id
+
+
+def _visit_dates(client, car_id, **args):
+    page = client.get(f'/car/{car_id}', query_string=args).get_data(as_text=True)
+    return re.findall(r'<strong>Дата:</strong> ([\d.]+)', page)
+
+
+def test_car_detail_filters_visits_by_typed_dates_and_words(car_with_visits):
+    client, car_id = car_with_visits
+
+    assert _visit_dates(client, car_id, search='2024-03') == ['28.03.2024', '05.03.2024']
+    assert _visit_dates(client, car_id, search='2023') == ['20.11.2023']
+    assert _visit_dates(client, car_id, search='масло') == ['28.03.2024', '20.11.2023']
+    assert _visit_dates(client, car_id, search='масло 03.2024') == ['28.03.2024']
+    assert _visit_dates(client, car_id, search='01.03.2024 - 01.04.2024') == ['01.04.2024', '28.03.2024', '05.03.2024']
+
+
+def test_car_detail_date_inputs_narrow_the_range(car_with_visits):
+    client, car_id = car_with_visits
+
+    assert _visit_dates(client, car_id, date_from='2024-03-06', date_to='2024-04-01') == ['01.04.2024', '28.03.2024']
+    assert _visit_dates(client, car_id, search='2024', date_to='2024-03-05') == ['05.03.2024']